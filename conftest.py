@@ -2,6 +2,7 @@ import pytest
 import django_webtest
 import os
 import mock
+import tempfile
 
 from django.core.urlresolvers import reverse
 
@@ -20,6 +21,13 @@ def cleansearch():
     create_index_table(force=True)
 
 
+@pytest.fixture(autouse=True)
+def clearcache():
+    # The database is reset after each test, but not the shared cache
+    from django.core.cache import cache
+    cache.clear()
+
+
 @pytest.fixture()
 def user(db):
     return UserFactory(short_name="Hello", password='password')
@@ -44,6 +52,7 @@ def setup_dirs(monkeypatch, tmpdir, settings):
     settings.MEDIA_ROOT = storage_root.mkdir('main', 'media').strpath
     settings.CATALOG_STORAGE_ROOT = storage_root.mkdir(
         'main', 'catalog').strpath
+    settings.SESSION_FILE_PATH = storage_root.join('sessions').strpath
 
     cache_root = tmpdir.mkdir('cache')
     settings.CATALOG_CACHE_ROOT = cache_root.mkdir('catalog').strpath
@@ -129,6 +138,11 @@ def pytest_configure(config):
     settings.STATICFILES_STORAGE = (
         'django.contrib.staticfiles.storage.StaticFilesStorage')
 
+    # Do not share the cache with the server, or with the previous runs
+    settings.CACHES['default']['LOCATION'] = os.path.join(
+        tempfile.mkdtemp(), 'cache.sqlite')
+
+
 class CatalogMocker:
     """A CatalogMocker.
     A instance of CatalogMocker is a (reusable) context manager.
@@ -3,7 +3,7 @@ from datetime import date, datetime
 import pytest
 
 from django.core.urlresolvers import reverse
-from django.utils import translation
+from django.utils import timezone, translation
 
 from ..views import Index
 from ..models import Content
@@ -25,6 +25,30 @@ def test_only_published_should_be_in_index(app, published, draft, deleted,
     assert published_in_the_future.title not in response.content.decode()
 
 
+def test_index_page_is_not_modified_until_a_content_changes(app, published):
+    etag = app.get(reverse('blog:index')).headers['ETag']
+    app.get(reverse('blog:index'), headers={'If-None-Match': etag},
+            status=304)
+
+    published.title = 'A new title'
+    published.save()
+    response = app.get(reverse('blog:index'),
+                       headers={'If-None-Match': etag}, status=200)
+    assert 'A new title' in response.content.decode()
+
+
+def test_index_page_changes_when_a_content_gets_published(
+        app, published, published_in_the_future):
+    etag = app.get(reverse('blog:index')).headers['ETag']
+
+    # The date comes, without the content being saved
+    Content.objects.filter(pk=published_in_the_future.pk).update(
+        published_at=timezone.now())
+    response = app.get(reverse('blog:index'),
+                       headers={'If-None-Match': etag}, status=200)
+    assert response.headers['ETag'] != etag
+
+
 def test_index_page_is_paginated(app, monkeypatch):
     monkeypatch.setattr(Index, 'paginate_by', 2)
     ContentFactory.create_batch(size=4, status=Content.PUBLISHED)
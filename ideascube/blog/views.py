@@ -1,14 +1,23 @@
 from django.views.generic import (ListView, DetailView, UpdateView, CreateView)
-from django.db.models import F
+from django.db.models import F, Max
 from django.utils.translation import ugettext_lazy as _
 
 from ideascube.mixins import FilterableViewMixin, OrderableViewMixin
-from ideascube.decorators import staff_member_required
+from ideascube.decorators import conditional_page, staff_member_required
 
 from .forms import ContentForm
 from .models import Content
 
 
+BLOG_DEPENDS = ('blog.content', 'taggit.tag', 'taggit.taggeditem')
+
+
+def get_last_publication(request):
+    # Contents get published when their date comes, without being saved
+    return Content.objects.published().aggregate(
+        Max('published_at'))['published_at__max']
+
+
 class Index(FilterableViewMixin, OrderableViewMixin, ListView):
 
     ORDERS = [
@@ -31,7 +40,8 @@ class Index(FilterableViewMixin, OrderableViewMixin, ListView):
         self._set_available_tags(context)
         return context
 
-index = Index.as_view()
+index = conditional_page(
+    *BLOG_DEPENDS, vary_on=get_last_publication)(Index.as_view())
 
 
 class ContentDetail(DetailView):
@@ -43,7 +53,8 @@ class ContentDetail(DetailView):
         else:
             return Content.objects.published()
 
-content_detail = ContentDetail.as_view()
+content_detail = conditional_page(
+    *BLOG_DEPENDS, vary_on=get_last_publication)(ContentDetail.as_view())
 
 
 class ContentUpdate(UpdateView):
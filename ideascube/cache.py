@@ -0,0 +1,226 @@
+"""A cache shared by all the processes, in an SQLite database
+
+The boxes have neither memcached nor redis, and the default cache of Django
+lives in the memory of each process: the uwsgi workers each had their own
+copy, which was lost on every restart.
+
+This cache is a table in an SQLite database (the LOCATION), in WAL mode so
+that readers never wait for the writer. Each operation is a single
+transaction, so that concurrent processes always see whole entries.
+
+The total size of the values is kept by triggers. When it goes over the
+MAX_SIZE option, the expired entries are removed, then the least recently
+used ones, until it is under the CULL_TARGET ratio of the MAX_SIZE. Not to
+write for every read, the last access time of an entry is only updated when
+it is older than the ACCESS_GRANULARITY option, in seconds.
+"""
+from contextlib import contextmanager
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    '  key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL,'
+    '  accessed REAL NOT NULL, size INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+    'CREATE TABLE IF NOT EXISTS cache_size (total INTEGER NOT NULL)',
+    'INSERT INTO cache_size SELECT 0 WHERE NOT EXISTS ('
+    '  SELECT * FROM cache_size)',
+    'CREATE TRIGGER IF NOT EXISTS cache_insert AFTER INSERT ON cache BEGIN'
+    '  UPDATE cache_size SET total = total + new.size; END',
+    'CREATE TRIGGER IF NOT EXISTS cache_delete AFTER DELETE ON cache BEGIN'
+    '  UPDATE cache_size SET total = total - old.size; END',
+    'CREATE TRIGGER IF NOT EXISTS cache_update AFTER UPDATE OF size ON cache'
+    '  BEGIN UPDATE cache_size SET total = total - old.size + new.size; END',
+)
+
+
+class SQLiteCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+
+        options = params.get('OPTIONS', {})
+        self.path = location
+        self.max_size = int(options.get('MAX_SIZE', 64 * 1024 * 1024))
+        self.cull_target = float(options.get('CULL_TARGET', 0.8))
+        self.access_granularity = float(options.get('ACCESS_GRANULARITY', 10))
+
+        self._local = threading.local()
+
+    def _get_connection(self):
+        # Connections must not be shared with forked processes
+        pid = os.getpid()
+
+        if getattr(self._local, 'pid', None) != pid:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+
+            # The cache can always be recomputed
+            conn.execute('PRAGMA synchronous = OFF')
+
+            # Otherwise replacing an entry does not run the delete trigger
+            conn.execute('PRAGMA recursive_triggers = ON')
+
+            with self._transaction(conn):
+                for statement in SCHEMA:
+                    conn.execute(statement)
+
+            self._local.conn = conn
+            self._local.pid = pid
+
+        return self._local.conn
+
+    @contextmanager
+    def _transaction(self, conn=None, write=False):
+        if conn is None:
+            conn = self._get_connection()
+
+        # Take the write lock right away, not to deadlock when upgrading a
+        # read transaction while another process writes
+        conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+
+        try:
+            yield conn
+
+        except:
+            conn.execute('ROLLBACK')
+            raise
+
+        else:
+            conn.execute('COMMIT')
+
+    def _make_key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+
+        return key
+
+    def _get(self, conn, key, now):
+        row = conn.execute(
+            'SELECT value, expires, accessed FROM cache WHERE key = ?',
+            (key,)).fetchone()
+
+        if row is None:
+            return None
+
+        value, expires, accessed = row
+
+        if expires is not None and expires <= now:
+            return None
+
+        return value, accessed
+
+    def _set(self, conn, key, value, timeout, now):
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        expires = self.get_backend_timeout(timeout)
+        conn.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires, accessed, '
+            'size) VALUES (?, ?, ?, ?, ?)',
+            (key, value, expires, now, len(key) + len(value)))
+
+        self._cull(conn, now)
+
+    def _cull(self, conn, now):
+        total = conn.execute('SELECT total FROM cache_size').fetchone()[0]
+
+        if total <= self.max_size:
+            return
+
+        conn.execute('DELETE FROM cache WHERE expires <= ?', (now,))
+        target = self.max_size * self.cull_target
+        total = conn.execute('SELECT total FROM cache_size').fetchone()[0]
+        keys = []
+
+        for key, size in conn.execute(
+                'SELECT key, size FROM cache ORDER BY accessed'):
+            if total <= target:
+                break
+
+            keys.append(key)
+            total -= size
+
+        # SQLite limits the number of parameters of a query
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            conn.execute(
+                'DELETE FROM cache WHERE key IN ({})'.format(
+                    ', '.join('?' * len(chunk))),
+                chunk)
+
+    def get(self, key, default=None, version=None):
+        key = self._make_key(key, version)
+        now = time.time()
+
+        with self._transaction() as conn:
+            found = self._get(conn, key, now)
+
+        if found is None:
+            return default
+
+        value, accessed = found
+
+        if now - accessed >= self.access_granularity:
+            with self._transaction(write=True) as conn:
+                conn.execute(
+                    'UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._make_key(key, version)
+
+        with self._transaction(write=True) as conn:
+            self._set(conn, key, value, timeout, time.time())
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._make_key(key, version)
+        now = time.time()
+
+        with self._transaction(write=True) as conn:
+            if self._get(conn, key, now) is not None:
+                return False
+
+            self._set(conn, key, value, timeout, now)
+            return True
+
+    def incr(self, key, delta=1, version=None):
+        key = self._make_key(key, version)
+        now = time.time()
+
+        with self._transaction(write=True) as conn:
+            found = self._get(conn, key, now)
+
+            if found is None:
+                raise ValueError("Key '%s' not found" % key)
+
+            value = pickle.loads(found[0]) + delta
+            pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            conn.execute(
+                'UPDATE cache SET value = ?, accessed = ?, size = ? '
+                'WHERE key = ?',
+                (pickled, now, len(key) + len(pickled), key))
+
+        return value
+
+    def delete(self, key, version=None):
+        key = self._make_key(key, version)
+
+        with self._transaction(write=True) as conn:
+            conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def has_key(self, key, version=None):
+        key = self._make_key(key, version)
+
+        with self._transaction() as conn:
+            return self._get(conn, key, time.time()) is not None
+
+    def clear(self):
+        with self._transaction(write=True) as conn:
+            conn.execute('DELETE FROM cache')
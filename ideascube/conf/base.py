@@ -51,6 +51,7 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'ideascube.middleware.GZipMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -361,6 +362,34 @@ SERVICES = [
 
 SESSION_COOKIE_AGE = 60 * 60  # Members must be logged out after one hour
 SESSION_SAVE_EVERY_REQUEST = True
+# Sessions are files outside the backed up data, refreshed at most once per
+# SESSION_REFRESH_INTERVAL seconds. Loaded relatively to STORAGE_ROOT.
+SESSION_ENGINE = 'ideascube.sessions'
+SESSION_FILE_PATH = None
+SESSION_REFRESH_INTERVAL = 60
 BACKUP_FORMAT = 'gztar'  # One of 'tar', 'bztar', 'gztar'
 TAGGIT_CASE_INSENSITIVE = True
 DATABASE_ROUTERS = ['ideascube.db_router.DatabaseRouter']
+
+# Applied to each new connection, see ideascube.sqlite
+SQLITE_PRAGMAS = {
+    'default': [
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('busy_timeout', 5000),
+        ('temp_store', 'MEMORY'),
+        ('mmap_size', 64 * 1024 * 1024),
+        ('cache_size', -8 * 1024),  # In KiB
+    ],
+    'transient': [
+        ('journal_mode', 'WAL'),
+        # The search index can always be rebuilt, it does not need to be
+        # synced to disk
+        ('synchronous', 'OFF'),
+        ('busy_timeout', 5000),
+        ('temp_store', 'MEMORY'),
+        ('mmap_size', 64 * 1024 * 1024),
+        ('cache_size', -16 * 1024),  # In KiB
+    ],
+}
+SQLITE_CHECKPOINT_INTERVAL = 5 * 60
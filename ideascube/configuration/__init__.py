@@ -1,4 +1,19 @@
+"""Read and write the configuration of the server
+
+The configuration is read on every page, so it is cached in each process.
+
+All the processes share a generation stamp, a file which is replaced every
+time the configuration changes. Checking whether the cache is still valid
+then only costs a stat() of that file, and a process only queries the
+database again after a change, loading the whole configuration at once.
+"""
+import copy
 import logging
+import os
+import uuid
+
+from django.conf import settings
+from django.db import transaction
 
 
 __all__ = [
@@ -13,6 +28,73 @@ IMPOSSIBLE_MESSAGE = (
     'The stored value for %s is of type %s instead of %s. This should never '
     'have happened.')
 
+_cache = {'generation': None, 'values': None}
+
+
+def _get_stamp_path():
+    return getattr(
+        settings, 'CONFIGURATION_STAMP',
+        os.path.join(settings.STORAGE_ROOT, 'configuration.stamp'))
+
+
+def _get_generation():
+    path = _get_stamp_path()
+
+    try:
+        stat = os.stat(path)
+
+    except FileNotFoundError:
+        return (path, None)
+
+    # The stamp is replaced, not modified, so its inode changes every time
+    return (path, stat.st_ino, stat.st_mtime_ns)
+
+
+def _bump_generation():
+    path = _get_stamp_path()
+    tmppath = '{}.{}.tmp'.format(path, os.getpid())
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(tmppath, 'w') as f:
+            f.write(uuid.uuid4().hex)
+
+        os.rename(tmppath, path)
+
+    except OSError as e:
+        logger.error('Could not bump the configuration stamp: %s', e)
+
+
+def invalidate_cache():
+    """Make all the processes read the configuration again
+
+    The other processes must only do it once the change is committed, or
+    they could cache the previous values again.
+    """
+    _cache['values'] = None
+    _bump_generation()
+    transaction.on_commit(_bump_generation)
+
+
+def _get_values():
+    from .models import Configuration
+
+    generation = _get_generation()
+    values = _cache['values']
+
+    if values is None or _cache['generation'] != generation:
+        values = {
+            (namespace, key): value
+            for namespace, key, value in Configuration.objects.order_by(
+                'date').values_list('namespace', 'key', 'value')
+        }
+
+        # Replace the whole cache at once, for the threads of this process
+        _cache.update(generation=generation, values=values)
+
+    return values
+
 
 def get_config(namespace, key):
     """Get a configuration option
@@ -31,24 +113,24 @@ def get_config(namespace, key):
         ideascube.configuration.exceptions.NoSuchConfigurationKeyError:
             The requested key does not exist in the requested namespace.
     """
-    from .models import Configuration
     from .registry import get_default_value, get_expected_type
 
     default_value = get_default_value(namespace, key)
     expected_type = get_expected_type(namespace, key)
 
     try:
-        config = Configuration.objects.get(namespace=namespace, key=key)
+        value = _get_values()[(namespace, key)]
 
-    except Configuration.DoesNotExist:
+    except KeyError:
         return default_value
 
-    if not isinstance(config.value, expected_type):
+    if not isinstance(value, expected_type):
         logger.error(IMPOSSIBLE_MESSAGE % (
-            config, type(config.value), expected_type))
+            '%s.%s=%r' % (namespace, key, value), type(value), expected_type))
         return default_value
 
-    return config.value
+    # Changing the returned value must not change the cached one
+    return copy.deepcopy(value)
 
 
 def reset_config(namespace, key):
@@ -1,8 +1,12 @@
 from django.conf import settings
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 
 from ideascube.models import JSONField
 
+from . import invalidate_cache
+
 
 class Configuration(models.Model):
     class Meta:
@@ -16,3 +20,9 @@ class Configuration(models.Model):
 
     def __str__(self):
         return '%s.%s=%r' % (self.namespace, self.key, self.value)
+
+
+@receiver(post_save, sender=Configuration)
+@receiver(post_delete, sender=Configuration)
+def invalidate_configuration_cache(sender, **kwargs):
+    invalidate_cache()
@@ -195,3 +195,58 @@ def test_set_configuration_invalid_type(monkeypatch, user):
 
     with pytest.raises(InvalidConfigurationValueError):
         set_config('tests', 'setting1', 'value1', user)
+
+
+def test_get_configuration_is_cached(monkeypatch, user):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    monkeypatch.setattr(
+        'ideascube.configuration.registry.REGISTRY',
+        {'tests': {'setting1': {'type': int, 'default': 42}}})
+
+    get_config('tests', 'setting1')
+
+    with CaptureQueriesContext(connection) as queries:
+        assert get_config('tests', 'setting1') == 42
+
+    assert len(queries) == 0
+
+    set_config('tests', 'setting1', 43, user)
+    assert get_config('tests', 'setting1') == 43
+
+    reset_config('tests', 'setting1')
+    assert get_config('tests', 'setting1') == 42
+
+
+def test_get_configuration_returns_a_copy_of_the_cached_value(
+        monkeypatch, user):
+    monkeypatch.setattr(
+        'ideascube.configuration.registry.REGISTRY',
+        {'tests': {'setting1': {'type': list, 'default': []}}})
+
+    set_config('tests', 'setting1', ['foo'], user)
+
+    value = get_config('tests', 'setting1')
+    value.append('bar')
+
+    assert get_config('tests', 'setting1') == ['foo']
+
+
+def test_get_configuration_changed_by_another_process(monkeypatch, user):
+    import ideascube.configuration
+
+    monkeypatch.setattr(
+        'ideascube.configuration.registry.REGISTRY',
+        {'tests': {'setting1': {'type': int, 'default': 42}}})
+
+    assert get_config('tests', 'setting1') == 42
+
+    # Another process changed the configuration, and bumped the stamp
+    Configuration.objects.bulk_create([
+        Configuration(namespace='tests', key='setting1', value=43, actor=user)
+    ])
+    assert get_config('tests', 'setting1') == 42
+
+    ideascube.configuration._bump_generation()
+    assert get_config('tests', 'setting1') == 43
@@ -1,6 +1,61 @@
+import hashlib
+
+from django.contrib import messages
 from django.contrib.admin.views.decorators import \
     staff_member_required as django_staff_member_required
+from django.utils import timezone, translation
+from django.views.decorators.http import condition
+
+from ideascube import __version__, fragments
+
+
+# Every page shows the configured settings and the logged in user
+PAGE_DEPENDS = ('configuration.configuration', 'ideascube.user')
 
 
 def staff_member_required(view_func):
     return django_staff_member_required(view_func, login_url='login')
+
+
+def _get_page_state(request, depends, vary_on):
+    # The messages are consumed when the page is rendered
+    if len(messages.get_messages(request)):
+        return None, None
+
+    user = request.user
+    parts = fragments.get_versions(PAGE_DEPENDS + depends)
+    parts.extend([
+        __version__, translation.get_language() or '',
+        request.get_full_path(), str(user.pk), str(user.is_staff),
+    ])
+
+    if vary_on is not None:
+        parts.append(str(vary_on(request)))
+
+    etag = hashlib.md5('\n'.join(parts).encode('utf-8')).hexdigest()
+    last_modified = fragments.get_or_set(
+        'last_modified', [], timezone.now, vary_on=[etag])
+
+    return etag, last_modified
+
+
+def conditional_page(*depends, vary_on=None):
+    """Answer 304 Not Modified to the clients which have the page already
+
+    The ETag of a page is made of the versions of what it depends on (see
+    ideascube.fragments), which does not cost any query, and of what else it
+    varies on: the user, the language, the URL and anything the optional
+    vary_on function returns for the request. The Last-Modified date of a
+    page is when its ETag was first seen.
+    """
+    def get_state(request):
+        if not hasattr(request, '_ideascube_page_state'):
+            request._ideascube_page_state = _get_page_state(
+                request, depends, vary_on)
+
+        return request._ideascube_page_state
+
+    return condition(
+        etag_func=lambda request, *args, **kwargs: get_state(request)[0],
+        last_modified_func=lambda request, *args, **kwargs: get_state(
+            request)[1])
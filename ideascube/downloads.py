@@ -0,0 +1,177 @@
+"""Send files to the clients without holding a worker for the whole transfer
+
+Behind nginx, the response only has an X-Accel-Redirect header, to an
+internal location from which nginx sends the file itself. The uwsgi worker
+is then free as soon as the headers are sent, and nginx handles the range
+requests.
+
+Which locations serve which directories is configured in nginx, which
+passes them as the X_ACCEL_MAPPING variable, in the same format as the
+X-Accel-Mapping header of Rack: a comma separated list of
+"/directory/=/internal/location/" pairs (see extras/nginx/ideascube).
+
+Without nginx, e.g with the development server, the file is sent by Django,
+with support for single range requests, so that downloads can be resumed
+and videos can be seeked.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.http import FileResponse, HttpResponse
+from django.utils.http import http_date
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class FileRange(object):
+    """Read a range of a file, as a file object would"""
+    def __init__(self, file, offset, length):
+        file.seek(offset)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+
+        data = self.file.read(size)
+        self.remaining -= len(data)
+
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def get_accel_mapping(request):
+    mapping = []
+
+    for pair in request.META.get('X_ACCEL_MAPPING', '').split(','):
+        directory, sep, location = pair.strip().partition('=')
+
+        if sep:
+            mapping.append((directory.strip(), location.strip()))
+
+    return mapping
+
+
+def get_accel_location(request, path):
+    """The internal location of nginx serving this file, if any"""
+    for directory, location in get_accel_mapping(request):
+        directory = os.path.join(directory, '')
+
+        if path.startswith(directory):
+            relpath = path[len(directory):]
+            return os.path.join(location, '') + quote(relpath)
+
+    return None
+
+
+def parse_range(header, size):
+    """Get the (offset, length) of a single byte range
+
+    Returns None for ranges which can not be satisfied, and raises ValueError
+    for those which are invalid, or made of several ranges.
+    """
+    match = RANGE_RE.match(header.strip())
+
+    if match is None:
+        raise ValueError('Unsupported range: {}'.format(header))
+
+    first, last = match.groups()
+
+    if first:
+        first = int(first)
+
+        if last and int(last) < first:
+            raise ValueError('Invalid range: {}'.format(header))
+
+        if first >= size:
+            return None
+
+        last = min(int(last), size - 1) if last else size - 1
+
+    elif last:
+        # The last bytes of the file
+        if not int(last):
+            return None
+
+        first = max(size - int(last), 0)
+        last = size - 1
+
+    else:
+        raise ValueError('Invalid range: {}'.format(header))
+
+    return first, last - first + 1
+
+
+def _send_range(request, path, stat):
+    mtime = http_date(stat.st_mtime)
+    header = request.META.get('HTTP_RANGE')
+    found = (0, stat.st_size)
+
+    # The range of a file which changed since is not the one asked for
+    if header is not None and request.META.get('HTTP_IF_RANGE',
+                                               mtime) == mtime:
+        try:
+            found = parse_range(header, stat.st_size)
+
+        except ValueError:
+            # Invalid ranges are ignored
+            pass
+
+    if found is None:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{}'.format(stat.st_size)
+        return response
+
+    offset, length = found
+
+    if length == stat.st_size:
+        response = FileResponse(open(path, 'rb'))
+
+    else:
+        response = FileResponse(
+            FileRange(open(path, 'rb'), offset, length), status=206)
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(
+            offset, offset + length - 1, stat.st_size)
+
+    response['Content-Length'] = str(length)
+    response['Accept-Ranges'] = 'bytes'
+    response['Last-Modified'] = mtime
+
+    return response
+
+
+def send_file(request, path, filename=None, attachment=False):
+    """Send the file at this path
+
+    If filename is given, or if attachment is True, the file is downloaded
+    rather than displayed by the browser.
+    """
+    path = os.path.abspath(path)
+    location = get_accel_location(request, path)
+
+    if location is not None:
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = location
+
+    else:
+        response = _send_range(request, path, os.stat(path))
+
+    content_type, encoding = mimetypes.guess_type(path)
+
+    # Browsers would uncompress e.g a .tar.gz backup, as a Content-Encoding
+    if content_type is None or encoding is not None:
+        content_type = 'application/octet-stream'
+
+    response['Content-Type'] = content_type
+
+    if filename is not None or attachment:
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(
+            filename or os.path.basename(path))
+
+    return response
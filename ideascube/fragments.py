@@ -0,0 +1,101 @@
+"""Cache the fragments of pages until what they depend on changes
+
+A fragment depends on names: model labels like 'library.book', or anything
+else like 'catalog'. Each of them has a version in the shared cache, and the
+key of a fragment includes the versions of all its dependencies.
+
+Saving or deleting an object bumps the version of its model, as would
+changing anything else a fragment can depend on. The fragments depending on
+it then miss the cache, so they are invalidated exactly when they need to
+be, instead of expiring after a while. The previous ones are eventually
+evicted by the cache.
+
+Only the models listed in MODELS are tracked, not to write to the cache each
+time anything else is saved: fragments can not depend on the other ones.
+
+Versions are random tokens rather than counters: if one was evicted from
+the cache, its new version must not be one it already had.
+"""
+import hashlib
+import uuid
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.utils import translation
+
+
+VERSION_KEY = 'fragments:version:{}'
+FRAGMENT_KEY = 'fragments:{}:{}'
+
+MODELS = (
+    'blog.content',
+    'configuration.configuration',
+    'ideascube.user',
+    'library.book',
+    'library.bookspecimen',
+    'mediacenter.document',
+    'taggit.tag',
+    'taggit.taggeditem',
+)
+
+
+def get_label(model):
+    return model._meta.label_lower
+
+
+def _new_version():
+    return uuid.uuid4().hex[:12]
+
+
+def get_versions(depends):
+    keys = [VERSION_KEY.format(name) for name in depends]
+    versions = cache.get_many(keys)
+
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _new_version(), timeout=None)
+            versions[key] = cache.get(key)
+
+    return [versions[key] for key in keys]
+
+
+def bump(*depends):
+    """Invalidate all the fragments depending on any of these names"""
+    cache.set_many(
+        {VERSION_KEY.format(name): _new_version() for name in depends},
+        timeout=None)
+
+
+def make_key(name, depends, vary_on=()):
+    """Make the key of a fragment
+
+    Fragments also vary on the current language, as most of them contain
+    translated strings.
+    """
+    parts = [translation.get_language() or '']
+    parts.extend(get_versions(depends))
+    parts.extend(str(v) for v in vary_on)
+    digest = hashlib.md5('\n'.join(parts).encode('utf-8')).hexdigest()
+
+    return FRAGMENT_KEY.format(name, digest)
+
+
+def get_or_set(name, depends, compute, vary_on=()):
+    """Get a cached value, computing it if it is not there"""
+    key = make_key(name, depends, vary_on=vary_on)
+    value = cache.get(key)
+
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout=None)
+
+    return value
+
+
+def bump_model_version(sender, **kwargs):
+    bump(get_label(sender))
+
+
+for model in MODELS:
+    post_save.connect(bump_model_version, sender=model)
+    post_delete.connect(bump_model_version, sender=model)
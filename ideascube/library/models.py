@@ -2,12 +2,15 @@ import os
 
 from django.core.urlresolvers import reverse
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 from taggit.managers import TaggableManager
 
 from ideascube.models import (
     LanguageField, SortedTaggableManager, TimeStampedModel)
 from ideascube.monitoring.models import StockItem, Specimen
+from ideascube.sampling import Sampler
 from ideascube.search.models import SearchableQuerySet, SearchMixin
 
 
@@ -108,3 +111,19 @@ class BookSpecimen(Specimen, TimeStampedModel):
             return ''
         name, extension = os.path.splitext(self.file.name)
         return extension[1:]
+
+
+available_books = Sampler(
+    'library.available_books', lambda: Book.objects.available())
+
+
+@receiver(post_save, sender=BookSpecimen)
+@receiver(post_delete, sender=BookSpecimen)
+@receiver(post_delete, sender=Specimen)
+def update_available_books(sender, instance, **kwargs):
+    available_books.update(instance.item_id)
+
+
+@receiver(post_delete, sender=Book)
+def discard_available_book(sender, instance, **kwargs):
+    available_books.discard(instance.pk)
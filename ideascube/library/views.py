@@ -13,7 +13,7 @@ from django.views.generic import (CreateView, DeleteView, DetailView, FormView,
                                   ListView, UpdateView, View)
 
 from ideascube.configuration import get_config
-from ideascube.decorators import staff_member_required
+from ideascube.decorators import conditional_page, staff_member_required
 from ideascube.mixins import (FilterableViewMixin, CSVExportMixin,
                               OrderableViewMixin)
 
@@ -21,6 +21,10 @@ from .forms import BookForm, BookSpecimenForm, ImportForm
 from .models import Book, BookSpecimen
 
 
+LIBRARY_DEPENDS = (
+    'library.book', 'library.bookspecimen', 'taggit.tag', 'taggit.taggeditem')
+
+
 class Index(FilterableViewMixin, OrderableViewMixin, ListView):
 
     ORDERS = [
@@ -61,12 +65,12 @@ class Index(FilterableViewMixin, OrderableViewMixin, ListView):
         self._set_available_tags(context)
         return context
 
-index = Index.as_view()
+index = conditional_page(*LIBRARY_DEPENDS)(Index.as_view())
 
 
 class BookDetail(DetailView):
     model = Book
-book_detail = BookDetail.as_view()
+book_detail = conditional_page(*LIBRARY_DEPENDS)(BookDetail.as_view())
 
 
 class BookUpdate(UpdateView):
@@ -0,0 +1,83 @@
+import argparse
+import sys
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from ideascube.sqlite import CHECKPOINT_MODES, checkpoint, get_pragmas
+
+
+# Reported for all the databases, whether they are set or not
+REPORTED_PRAGMAS = (
+    'journal_mode', 'synchronous', 'busy_timeout', 'temp_store', 'mmap_size',
+    'cache_size', 'page_size', 'wal_autocheckpoint',
+)
+
+
+class Command(BaseCommand):
+    help = "Manage the SQLite databases"
+
+    def add_arguments(self, parser):
+        self.parser = parser
+        subs = parser.add_subparsers(
+            title='Commands', dest='cmd', metavar='',
+            parser_class=argparse.ArgumentParser)
+
+        info = subs.add_parser(
+            'info', help='Show the effective settings of the databases')
+        info.set_defaults(func=self.info)
+
+        checkpoint = subs.add_parser(
+            'checkpoint',
+            help='Write the write-ahead logs back into the databases')
+        checkpoint.add_argument(
+            '--mode', choices=[m.lower() for m in CHECKPOINT_MODES],
+            default='truncate', help='The checkpoint mode')
+        checkpoint.set_defaults(func=self.checkpoint)
+
+    def handle(self, *args, **options):
+        if 'func' not in options:
+            self.parser.print_help()
+            self.parser.exit(1)
+
+        options['func'](options)
+
+    def get_connections(self):
+        for alias in connections:
+            connection = connections[alias]
+
+            if connection.vendor == 'sqlite':
+                yield connection
+
+    def info(self, options):
+        for connection in self.get_connections():
+            expected = dict(get_pragmas(connection.alias))
+            print('{}: {}'.format(
+                connection.alias, connection.settings_dict['NAME']))
+            print('  conn_max_age = {}'.format(
+                connection.settings_dict['CONN_MAX_AGE']))
+
+            with connection.cursor() as cursor:
+                for name in REPORTED_PRAGMAS:
+                    cursor.execute('PRAGMA {}'.format(name))
+                    value = cursor.fetchone()[0]
+                    line = '  {} = {}'.format(name, value)
+
+                    if name in expected:
+                        line += ' (configured: {})'.format(expected[name])
+
+                    print(line)
+
+    def checkpoint(self, options):
+        mode = options['mode'].upper()
+
+        for connection in self.get_connections():
+            busy, log, checkpointed = checkpoint(connection, mode=mode)
+
+            if busy:
+                print('{}: busy, could not checkpoint all of the write-ahead '
+                      'log'.format(connection.alias), file=sys.stderr)
+
+            else:
+                print('{}: checkpointed {} pages of {}'.format(
+                    connection.alias, checkpointed, log))
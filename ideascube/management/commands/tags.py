@@ -6,6 +6,8 @@ from django.utils.termcolors import colorize
 
 from taggit.models import Tag, TaggedItem
 
+from ideascube.models import TagCount
+
 
 def log(text, **kwargs):
     sys.stdout.write(colorize(str(text), **kwargs) + '\n')
@@ -53,6 +55,10 @@ class Command(BaseCommand):
         list_ = subs.add_parser('list', help='List tags')
         list_.set_defaults(func=self.list)
 
+        recount = subs.add_parser(
+            'recount', help='Rebuild the counts of the tag usage')
+        recount.set_defaults(func=self.recount)
+
     def handle(self, *args, **options):
         if 'func' not in options:
             self.parser.print_help()
@@ -119,5 +125,12 @@ class Command(BaseCommand):
         row = '{:<40}{:<40}{}'
         print(row.format('name', 'slug', 'count'))
         print(row.format('.' * 40, '.' * 40, '.' * 40))
+        counts = dict(TagCount.objects.filter(
+            content_type=None).values_list('tag_id', 'count'))
         for tag in Tag.objects.order_by('slug'):
-            print(row.format(tag.name, tag.slug, self._count(tag.name)))
+            print(row.format(tag.name, tag.slug, counts.get(tag.id, 0)))
+
+    def recount(self, options):
+        TagCount.objects.rebuild()
+        notice('Counted the usage of {} tag(s).'.format(
+            TagCount.objects.filter(content_type=None).count()))
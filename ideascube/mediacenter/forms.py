@@ -53,16 +53,57 @@ class DocumentForm(forms.ModelForm):
         return document
 
 
+def list_package_files(path):
+    """List the files a packaged document can refer to"""
+    files = set()
+
+    for name in os.listdir(path):
+        filepath = os.path.join(path, name)
+
+        if os.path.isfile(filepath):
+            files.add(filepath)
+
+    return files
+
+
+class PackagedFileField(forms.CharField):
+    """Like a FilePathField, with the list of files computed beforehand
+
+    Building a FilePathField lists the files in its path, which is way too
+    slow when validating all the documents of a big package.
+    """
+    default_error_messages = {
+        'invalid_choice': forms.ChoiceField.default_error_messages[
+            'invalid_choice'],
+    }
+
+    def __init__(self, files, **kwargs):
+        self.files = files
+        super().__init__(strip=False, **kwargs)
+
+    def validate(self, value):
+        super().validate(value)
+
+        if value and value not in self.files:
+            raise forms.ValidationError(
+                self.error_messages['invalid_choice'], code='invalid_choice',
+                params={'value': value})
+
+
 class PackagedDocumentForm(forms.ModelForm):
 
     class Meta:
         model = Document
         exclude = ['original', 'preview']
 
-    def __init__(self, path, *args, **kwargs):
+    def __init__(self, path, *args, files=None, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['original'] = forms.FilePathField(path=path)
-        self.fields['preview'] = forms.FilePathField(path=path, required=False)
+
+        if files is None:
+            files = list_package_files(path)
+
+        self.fields['original'] = PackagedFileField(files)
+        self.fields['preview'] = PackagedFileField(files, required=False)
 
     def save(self, commit=True):
         document = super(PackagedDocumentForm, self).save(commit=False)
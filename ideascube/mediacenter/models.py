@@ -1,12 +1,23 @@
+from collections import Counter, defaultdict, deque
+from operator import attrgetter
+
+from django.contrib.contenttypes.models import ContentType
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 from taggit.managers import TaggableManager
+from taggit.models import Tag
 
+from ideascube import fragments
 from ideascube.models import (
-    LanguageField, SortedTaggableManager, TimeStampedModel)
-from ideascube.search.models import SearchableQuerySet, SearchMixin
+    LanguageField, SortedTaggableManager, TagCount, TimeStampedModel)
+from ideascube.sampling import Sampler
+from ideascube.search.models import (
+    SearchableQuerySet, SearchMixin, bulk_index)
 
 
 class DocumentQuerySet(SearchableQuerySet, models.QuerySet):
@@ -25,6 +36,104 @@ class DocumentQuerySet(SearchableQuerySet, models.QuerySet):
     def audio(self):
         return self.filter(kind=Document.AUDIO)
 
+    def bulk_create_with_tags(self, documents):
+        """Create many new documents at once, with their tags, and index them
+
+        documents is a list of (document, tag names) tuples. Only use this
+        for reasonably sized batches, as some queries list all the documents.
+        """
+        if not documents:
+            return []
+
+        with transaction.atomic():
+            last = self.aggregate(last=models.Max('id'))['last'] or 0
+            self.bulk_create([document for document, _ in documents])
+
+            # SQLite does not give us the ids of the rows we just inserted
+            ids = defaultdict(deque)
+            created = self.filter(
+                id__gt=last,
+                original__in=[d.original.name for d, _ in documents])
+
+            for id, original in created.order_by('id').values_list(
+                    'id', 'original'):
+                ids[original].append(id)
+
+            for document, _ in documents:
+                document.id = ids[document.original.name].popleft()
+
+            self._bulk_set_tags(documents)
+            all_documents.add_many([d.id for d, _ in documents])
+
+        return self._bulk_index(documents)
+
+    def bulk_update_with_tags(self, documents):
+        """Update many existing documents at once, with their tags
+
+        documents is a list of (document, tag names) tuples, and only these
+        documents are reindexed.
+        """
+        if not documents:
+            return []
+
+        fields = [
+            f for f in self.model._meta.concrete_fields if not f.primary_key]
+        now = timezone.now()
+
+        with transaction.atomic():
+            for document, _ in documents:
+                # This does not send the post_save signal, which would index
+                # the documents one by one
+                document.modified_at = now
+                self.filter(pk=document.pk).update(**{
+                    f.attname: getattr(document, f.attname) for f in fields})
+
+            self._bulk_set_tags(documents, replace=True)
+
+        return self._bulk_index(documents)
+
+    def _bulk_set_tags(self, documents, replace=False):
+        through = self.model.tags.through
+        content_type = ContentType.objects.get_for_model(self.model)
+
+        if replace:
+            through.objects.filter(
+                content_type=content_type,
+                object_id__in=[document.id for document, _ in documents],
+            ).delete()
+
+        names = {name for _, tags in documents for name in tags}
+        tags = {tag.name: tag for tag in Tag.objects.filter(name__in=names)}
+
+        for name in names - set(tags):
+            tags[name] = Tag.objects.create(name=name)
+
+        through.objects.bulk_create([
+            through(tag=tags[name], content_type=content_type,
+                    object_id=document.id)
+            for document, names in documents for name in set(names)])
+
+        # This does not send the post_save signal either
+        TagCount.objects.add(content_type.id, Counter(
+            tags[name].id for _, names in documents for name in set(names)))
+
+        for document, names in documents:
+            document._bulk_tags = sorted(
+                (tags[name] for name in set(names)), key=attrgetter('name'))
+
+    def _bulk_index(self, documents):
+        documents = [document for document, _ in documents]
+        bulk_index(documents)
+
+        # Neither the documents nor their tags sent the signals
+        fragments.bump(
+            fragments.get_label(self.model), 'taggit.tag', 'taggit.taggeditem')
+
+        for document in documents:
+            del document._bulk_tags
+
+        return documents
+
 
 class Document(SearchMixin, TimeStampedModel):
 
@@ -83,10 +192,18 @@ class Document(SearchMixin, TimeStampedModel):
     def get_absolute_url(self):
         return reverse('mediacenter:document_detail', kwargs={'pk': self.pk})
 
+    def _get_tags(self):
+        try:
+            # The tags of documents created in bulk are already known
+            return self._bulk_tags
+
+        except AttributeError:
+            return self.tags.all()
+
     @property
     def index_strings(self):
         return (self.title, self.summary, self.credits,
-                u' '.join(self.tags.names()))
+                u' '.join(tag.name for tag in self._get_tags()))
 
     @property
     def index_lang(self):
@@ -102,8 +219,22 @@ class Document(SearchMixin, TimeStampedModel):
 
     @property
     def index_tags(self):
-        return self.tags.slugs()
+        return [tag.slug for tag in self._get_tags()]
 
     @property
     def slug(self):
         return self.get_kind_display()
+
+
+all_documents = Sampler('mediacenter.documents', lambda: Document.objects)
+
+
+@receiver(post_save, sender=Document)
+def add_sample_document(sender, instance, created, **kwargs):
+    if created:
+        all_documents.add(instance.pk)
+
+
+@receiver(post_delete, sender=Document)
+def discard_sample_document(sender, instance, **kwargs):
+    all_documents.discard(instance.pk)
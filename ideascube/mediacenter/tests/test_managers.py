@@ -45,3 +45,40 @@ def test_objects_should_return_all_content(video, image, audio):
     assert video in contents
     assert image in contents
     assert audio in contents
+
+
+@pytest.mark.usefixtures('cleansearch')
+def test_bulk_create_with_tags():
+    existing = Document.objects.create(
+        title='existing', original='catalog/foo/same.pdf')
+    existing.tags.add('tag1')
+    existing.save()
+
+    documents = Document.objects.bulk_create_with_tags([
+        (Document(title='first', summary='bulk', kind=Document.PDF,
+                  original='catalog/foo/same.pdf'), ['tag1', 'tag2']),
+        (Document(title='second', summary='bulk', kind=Document.PDF,
+                  original='catalog/foo/same.pdf'), []),
+        (Document(title='third', summary='bulk', kind=Document.VIDEO,
+                  original='catalog/foo/other.mp4'), ['tag3']),
+    ])
+
+    assert Document.objects.count() == 4
+    assert [d.title for d in documents] == ['first', 'second', 'third']
+    assert all(d.id != existing.id for d in documents)
+
+    for document in documents:
+        assert Document.objects.get(id=document.id).title == document.title
+
+    first, second, third = documents
+    assert list(first.tags.names()) == ['tag1', 'tag2']
+    assert list(second.tags.names()) == []
+    assert list(third.tags.names()) == ['tag3']
+
+    assert set(Document.objects.search('bulk')) == {first, second, third}
+    assert set(Document.objects.search(tags=['tag1'])) == {existing, first}
+    assert set(Document.objects.search(kind=Document.VIDEO)) == {third}
+
+
+def test_bulk_create_with_tags_nothing():
+    assert Document.objects.bulk_create_with_tags([]) == []
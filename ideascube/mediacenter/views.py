@@ -9,7 +9,7 @@ from django.utils.translation import get_language, ugettext_lazy as _
 from django.views.generic import (CreateView, DeleteView, DetailView, ListView,
                                   UpdateView)
 
-from ideascube.decorators import staff_member_required
+from ideascube.decorators import conditional_page, staff_member_required
 from ideascube.mixins import FilterableViewMixin, OrderableViewMixin
 
 # For unittesting purpose, we need to mock the Catalog class.
@@ -25,6 +25,10 @@ from .models import Document
 from .forms import DocumentForm
 
 
+MEDIACENTER_DEPENDS = (
+    'mediacenter.document', 'taggit.tag', 'taggit.taggeditem')
+
+
 class Index(FilterableViewMixin, OrderableViewMixin, ListView):
 
     ORDERS = [
@@ -72,12 +76,15 @@ class Index(FilterableViewMixin, OrderableViewMixin, ListView):
             context['source_name'] = package.name
         return context
 
-index = Index.as_view()
+# The index shows the name of the package the documents come from
+index = conditional_page(
+    'catalog', *MEDIACENTER_DEPENDS)(Index.as_view())
 
 
 class DocumentDetail(DetailView):
     model = Document
-document_detail = DocumentDetail.as_view()
+document_detail = conditional_page(
+    *MEDIACENTER_DEPENDS)(DocumentDetail.as_view())
 
 
 class DocumentUpdate(UpdateView):
@@ -0,0 +1,28 @@
+from django.middleware.gzip import GZipMiddleware as BaseGZipMiddleware
+
+
+class GZipMiddleware(BaseGZipMiddleware):
+    """Compress the HTML pages for the clients which accept it
+
+    Other responses are either small, or files which are already compressed
+    or must keep their length for range requests. Streamed responses are
+    never compressed either, as files are sent with the wsgi.file_wrapper.
+
+    Django appends ';gzip' to the ETag of the responses it compresses, which
+    the conditional pages would then never match. Like later versions of
+    Django, make it a weak ETag instead: it still identifies the page, just
+    not its exact bytes.
+    """
+    def process_response(self, request, response):
+        if (response.streaming
+                or not response.get('Content-Type', '').startswith(
+                    'text/html')):
+            return response
+
+        etag = response.get('ETag')
+        response = super().process_response(request, response)
+
+        if etag is not None and response.get('Content-Encoding') == 'gzip':
+            response['ETag'] = etag if etag.startswith('W/') else 'W/' + etag
+
+        return response
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def add_samples(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    Document = apps.get_model('mediacenter', 'Document')
+    RandomSample = apps.get_model('ideascube', 'RandomSample')
+
+    samples = {
+        'library.available_books': Book.objects.filter(
+            specimens__isnull=False).distinct(),
+        'mediacenter.documents': Document.objects.all(),
+    }
+
+    for key, queryset in samples.items():
+        ids = queryset.order_by('pk').values_list('pk', flat=True)
+        RandomSample.objects.bulk_create([
+            RandomSample(key=key, position=position, object_id=id)
+            for position, id in enumerate(ids)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ideascube', '0012_auto_20161013_0956'),
+        ('library', '0008_library_stock'),
+        ('mediacenter', '0011_auto_20161007_1433'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RandomSample',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64)),
+                ('position', models.PositiveIntegerField()),
+                ('object_id', models.IntegerField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='randomsample',
+            unique_together=set([('key', 'position'), ('key', 'object_id')]),
+        ),
+        migrations.RunPython(add_samples, migrations.RunPython.noop),
+    ]
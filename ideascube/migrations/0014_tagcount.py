@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-19 01:24
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_tags(apps, schema_editor):
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    TagCount = apps.get_model('ideascube', 'TagCount')
+    items = TaggedItem.objects.order_by()
+
+    TagCount.objects.bulk_create([
+        TagCount(
+            tag_id=c['tag_id'], content_type_id=c['content_type_id'],
+            count=c['count'])
+        for c in items.values('tag_id', 'content_type_id').annotate(
+            count=models.Count('id'))])
+    TagCount.objects.bulk_create([
+        TagCount(tag_id=c['tag_id'], count=c['count'])
+        for c in items.values('tag_id').annotate(count=models.Count('id'))])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taggit', '0002_auto_20150616_2121'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('ideascube', '0013_randomsample'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('content_type', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counts', to='taggit.Tag')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='tagcount',
+            unique_together=set([('tag', 'content_type')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='tagcount',
+            index_together=set([('content_type', 'count')]),
+        ),
+        migrations.RunPython(count_tags, migrations.RunPython.noop),
+    ]
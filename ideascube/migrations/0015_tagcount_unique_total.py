@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# The unique constraint on (tag, content_type) does not apply to the total
+# rows, as NULL values are all distinct
+CREATE_INDEX = (
+    'CREATE UNIQUE INDEX ideascube_tagcount_total '
+    'ON ideascube_tagcount (tag_id) WHERE content_type_id IS NULL')
+DROP_INDEX = 'DROP INDEX ideascube_tagcount_total'
+
+
+def recount_totals(apps, schema_editor):
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    TagCount = apps.get_model('ideascube', 'TagCount')
+    items = TaggedItem.objects.order_by()
+
+    TagCount.objects.filter(content_type__isnull=True).delete()
+    TagCount.objects.bulk_create([
+        TagCount(tag_id=c['tag_id'], count=c['count'])
+        for c in items.values('tag_id').annotate(count=models.Count('id'))])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ideascube', '0014_tagcount'),
+    ]
+
+    operations = [
+        migrations.RunPython(recount_totals, migrations.RunPython.noop),
+        migrations.RunSQL([CREATE_INDEX], [DROP_INDEX]),
+    ]
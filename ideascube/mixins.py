@@ -9,6 +9,7 @@ from django.http import HttpResponse
 from taggit.models import Tag
 
 from ideascube.search.models import Search
+from ideascube.tagnames import TagNames
 
 
 class OrderableViewMixin:
@@ -82,6 +83,7 @@ class FilterableViewMixin:
         for tag in context['tags']:
             current_filters.append(('tags', tag))
         context['current_filters'] = current_filters
+        context['tag_names'] = TagNames(context['tags'])
 
         return context
 
@@ -1,18 +1,25 @@
-from collections import OrderedDict
+from collections import Counter, OrderedDict
 import json
 import logging
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.translation import ugettext_lazy as _
 from django_countries.fields import CountryField
 from taggit.managers import _TaggableManager
+from taggit.models import Tag, TaggedItem
 
 from ideascube.search.models import SearchMixin, SearchableQuerySet
 
+# Connect the receivers which tune the SQLite connections and invalidate the
+# cached fragments
+from . import fragments, sqlite  # noqa
 from .fields import CommaSeparatedCharField
 from .utils import classproperty, get_all_languages
 
@@ -346,3 +353,116 @@ class LanguageField(models.CharField):
         kwargs['choices'] = get_all_languages()
 
         super().__init__(*args, **kwargs)
+
+
+class RandomSample(models.Model):
+    """An entry in a compact array of ids, to pick random objects from
+
+    The positions of each key go from 0 to the number of entries, without
+    holes, so that picking one at random is a single lookup in the index.
+    See ideascube.sampling for how they are maintained.
+    """
+    key = models.CharField(max_length=64)
+    position = models.PositiveIntegerField()
+    object_id = models.IntegerField()
+
+    class Meta:
+        unique_together = (('key', 'position'), ('key', 'object_id'))
+
+
+class TagCountQuerySet(models.QuerySet):
+    def add(self, content_type_id, counts):
+        """Add to the counts of the tags of a content type
+
+        counts maps tag ids to how many objects were tagged (or untagged,
+        if negative).
+        """
+        with transaction.atomic():
+            for tag_id, delta in counts.items():
+                # The counts of all the content types are in the None one
+                for ct_id in (content_type_id, None):
+                    qs = self.filter(tag_id=tag_id, content_type_id=ct_id)
+
+                    if delta < 0:
+                        # In case the counts were wrong, until rebuilt
+                        qs = qs.filter(count__gte=-delta)
+
+                    updated = qs.update(count=models.F('count') + delta)
+
+                    if updated or delta <= 0:
+                        continue
+
+                    try:
+                        with transaction.atomic():
+                            self.create(
+                                tag_id=tag_id, content_type_id=ct_id,
+                                count=delta)
+
+                    except IntegrityError:
+                        # Another writer created it in the meantime
+                        qs.update(count=models.F('count') + delta)
+
+    def rebuild(self):
+        items = TaggedItem.objects.order_by()
+
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create([
+                TagCount(
+                    tag_id=c['tag_id'], content_type_id=c['content_type_id'],
+                    count=c['count'])
+                for c in items.values('tag_id', 'content_type_id').annotate(
+                    count=models.Count('id'))])
+            self.bulk_create([
+                TagCount(tag_id=c['tag_id'], count=c['count'])
+                for c in items.values('tag_id').annotate(
+                    count=models.Count('id'))])
+
+    def top(self, model=None, limit=20):
+        """Get the most used tags, with their count"""
+        content_type = None
+
+        if model is not None:
+            content_type = ContentType.objects.get_for_model(model)
+
+        counts = self.filter(content_type=content_type, count__gt=0)
+        tags = []
+
+        for count in counts.select_related('tag').order_by(
+                '-count', 'tag__slug')[:limit]:
+            count.tag.count = count.count
+            tags.append(count.tag)
+
+        return tags
+
+
+class TagCount(models.Model):
+    """How many objects of a content type have a tag
+
+    The counts for all the content types together are in the rows without
+    a content type, which a partial index keeps unique (see migration 0015).
+    They are updated when objects are tagged or untagged, so that the most
+    used tags can be read without counting them.
+    """
+    tag = models.ForeignKey(Tag, related_name='counts')
+    content_type = models.ForeignKey(ContentType, null=True)
+    count = models.PositiveIntegerField(default=0)
+
+    objects = TagCountQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('tag', 'content_type')
+        index_together = ('content_type', 'count')
+
+
+@receiver(post_save, sender=TaggedItem)
+def count_tagged_item(sender, instance, created, **kwargs):
+    if created:
+        TagCount.objects.add(
+            instance.content_type_id, Counter([instance.tag_id]))
+
+
+@receiver(post_delete, sender=TaggedItem)
+def uncount_tagged_item(sender, instance, **kwargs):
+    TagCount.objects.add(
+        instance.content_type_id, Counter({instance.tag_id: -1}))
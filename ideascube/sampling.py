@@ -0,0 +1,137 @@
+"""Pick random objects without sorting whole tables
+
+Ordering by RANDOM() makes SQLite sort all the rows of the query, which gets
+slower as the collections grow. Instead, the ids of the objects we want to
+pick from are kept in a compact array: a table of (position, id) entries,
+where the positions go from 0 to the number of entries, without holes.
+
+Picking an object is then a lookup of the last position, and one of a random
+position, both in the index.
+
+The arrays are kept up to date from the model signals. Removing an entry
+moves the last one in its place, so the positions stay compact. Changes take
+the write lock before reading the positions, and are tried again if they
+still conflict with another writer.
+"""
+import random
+
+from django.db import IntegrityError, transaction
+
+from ideascube.models import RandomSample
+from ideascube.sqlite import immediate_atomic
+
+
+# How many times to try a change conflicting with another writer
+ATTEMPTS = 5
+
+
+class Sampler:
+    def __init__(self, key, get_queryset):
+        self.key = key
+        self.get_queryset = get_queryset
+
+    @property
+    def _samples(self):
+        return RandomSample.objects.filter(key=self.key)
+
+    def _get_last_position(self):
+        return self._samples.order_by('-position').values_list(
+            'position', flat=True).first()
+
+    def _retry(self, func, *args):
+        for attempt in range(ATTEMPTS):
+            try:
+                # Not to read a position another writer is about to take
+                with immediate_atomic():
+                    return func(*args)
+
+            except IntegrityError:
+                if attempt == ATTEMPTS - 1:
+                    raise
+
+    def add_many(self, ids):
+        self._retry(self._add_many, ids)
+
+    def _add_many(self, ids):
+        last = self._get_last_position()
+        position = 0 if last is None else last + 1
+        known = set()
+        samples = []
+
+        # SQLite limits the number of parameters of a query
+        for i in range(0, len(ids) if last is not None else 0, 500):
+            known.update(self._samples.filter(
+                object_id__in=ids[i:i + 500]).values_list(
+                    'object_id', flat=True))
+
+        for id in ids:
+            if id in known:
+                continue
+
+            samples.append(RandomSample(
+                key=self.key, position=position, object_id=id))
+            known.add(id)
+            position += 1
+
+        RandomSample.objects.bulk_create(samples)
+
+    def add(self, id):
+        self.add_many([id])
+
+    def discard(self, id):
+        self._retry(self._discard, id)
+
+    def _discard(self, id):
+        sample = self._samples.filter(object_id=id).first()
+
+        if sample is None:
+            return
+
+        sample.delete()
+        last = self._samples.order_by('-position').first()
+
+        if last is not None and last.position > sample.position:
+            last.position = sample.position
+            last.save(update_fields=['position'])
+
+    def update(self, id):
+        """Add or remove the object, depending on whether it is eligible"""
+        if self.get_queryset().filter(pk=id).exists():
+            self.add(id)
+
+        else:
+            self.discard(id)
+
+    def rebuild(self):
+        with transaction.atomic():
+            self._samples.delete()
+            self.add_many(list(
+                self.get_queryset().order_by().values_list('pk', flat=True)))
+
+    def pick(self, retries=3):
+        """Get a random object, or None if there are none
+
+        Entries which got stale (e.g because their objects were changed
+        without sending signals) are removed on the way.
+        """
+        for _ in range(retries):
+            last = self._get_last_position()
+
+            if last is None:
+                return None
+
+            id = self._samples.filter(
+                position=random.randint(0, last)).values_list(
+                    'object_id', flat=True).first()
+
+            if id is None:
+                continue
+
+            obj = self.get_queryset().filter(pk=id).first()
+
+            if obj is not None:
+                return obj
+
+            self.discard(id)
+
+        return None
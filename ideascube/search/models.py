@@ -114,12 +114,10 @@ class SearchMixin(models.Model):
     def is_indexable(self):
         return True
 
-    def index(self):
-        if not self.is_indexable():
-            return
+    def get_index_fields(self):
         text = u" ".join([s for s in self.index_strings if s])
         tags = u"|{}|".format(u"|".join(self.index_tags))
-        defaults = {
+        return {
             'text': text,
             'public': self.index_public,
             'lang': self.index_lang,
@@ -127,10 +125,14 @@ class SearchMixin(models.Model):
             'source': self.index_source,
             'tags': tags
         }
+
+    def index(self):
+        if not self.is_indexable():
+            return
         Search.objects.update_or_create(
             model=self.__class__.__name__,
             model_id=self.pk,
-            defaults=defaults
+            defaults=self.get_index_fields()
         )
 
     def deindex(self):
@@ -159,6 +161,26 @@ class SearchableQuerySet(object):
         return self.filter(pk__in=ids)
 
 
+def bulk_index(instances):
+    """Index many saved instances at once
+
+    This is much faster than indexing them one by one, but the instances must
+    all be of the same model, and there must not be too many of them for a
+    single query.
+    """
+    instances = [i for i in instances if i.is_indexable()]
+
+    if not instances:
+        return
+
+    model = instances[0].__class__.__name__
+    Search.objects.filter(
+        model=model, model_id__in=[i.pk for i in instances]).delete()
+    Search.objects.bulk_create([
+        Search(model=model, model_id=i.pk, **i.get_index_fields())
+        for i in instances])
+
+
 @receiver(post_save)
 def index(sender, instance, **kwargs):
     if SearchMixin in sender.__mro__:
@@ -1,14 +1,79 @@
+from contextlib import contextmanager
 import os
 import re
 import shutil
 import tarfile
+import time
 import zipfile
 from datetime import datetime
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
 from django.utils.translation import ugettext as _
 
 from ideascube import __version__
+from ideascube.configuration import invalidate_cache
+from ideascube.sqlite import checkpoint, get_path
+
+# The write-ahead log of SQLite, which must never be restored over another
+# database
+SQLITE_SUFFIXES = ('-wal', '-shm')
+
+
+def is_excluded(path):
+    return os.path.islink(path) or path.endswith(SQLITE_SUFFIXES)
+
+
+# How many times to try checkpointing a busy database, a second apart
+CHECKPOINT_ATTEMPTS = 5
+
+
+def get_database_path():
+    return get_path(connections['default'])
+
+
+@contextmanager
+def frozen_database():
+    """Keep the database file whole and unchanged while it is archived
+
+    Its write-ahead log is not archived, so it is first written back into the
+    database file. A read transaction then keeps SQLite from writing the
+    later transactions into the database file, until the end of the block.
+    """
+    connection = connections['default']
+    dbpath = get_database_path()
+
+    if dbpath is None:
+        yield
+        return
+
+    walpath = dbpath + '-wal'
+
+    for attempt in range(CHECKPOINT_ATTEMPTS):
+        if attempt:
+            time.sleep(1)
+
+        if os.path.exists(walpath):
+            busy, _, _ = checkpoint(connection, mode='TRUNCATE')
+
+            if busy:
+                # A reader still needs the log, it was not all written back
+                continue
+
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT count(*) FROM sqlite_master')
+
+            # Something was committed since the checkpoint
+            if os.path.exists(walpath) and os.path.getsize(walpath):
+                continue
+
+            yield
+            return
+
+    raise RuntimeError(
+        'Could not write the write-ahead log back into the database')
 
 
 def make_name(format):
@@ -81,30 +146,65 @@ class Backup(object):
         base_name = os.path.join(Backup.ROOT, self.basename)
         base_name = "{}{}".format(base_name,
                                   self.FORMAT_TO_EXTENSION[self.format])
-        try:
-            mode = 'w'
-            if self.format == 'gztar':
-                mode = 'w:gz'
-            elif self.format == 'bztar':
-                mode = 'w:bz2'
-            archive = tarfile.open(base_name, mode=mode)
-            archive.add(settings.BACKUPED_ROOT,
-                        arcname='./',
-                        recursive=True,
-                        exclude=os.path.islink)
-        except:
-            raise
-        finally:
-            archive.close()
+
+        with frozen_database():
+            try:
+                mode = 'w'
+                if self.format == 'gztar':
+                    mode = 'w:gz'
+                elif self.format == 'bztar':
+                    mode = 'w:bz2'
+                archive = tarfile.open(base_name, mode=mode)
+                archive.add(settings.BACKUPED_ROOT,
+                            arcname='./',
+                            recursive=True,
+                            exclude=is_excluded)
+            except:
+                raise
+            finally:
+                archive.close()
         return archive
 
     def restore(self):
         """Restore a backup from a backup name."""
+        dbpath = get_database_path()
+
+        if dbpath is not None and self.contains(dbpath):
+            # Other processes notice the new database file and reconnect,
+            # while the write-ahead log of the current one must go with it
+            connections['default'].close()
+
+            for suffix in ('',) + SQLITE_SUFFIXES:
+                try:
+                    os.unlink(dbpath + suffix)
+
+                except FileNotFoundError:
+                    pass
+
         if self.format == 'zip':
             self.restore_zip()
         else:
             self.restore_tar()
 
+        # The processes cached the configuration, fragments and tag names of
+        # the previous database, without any save telling them it changed
+        invalidate_cache()
+        cache.clear()
+
+    def contains(self, path):
+        """Whether restoring the backup would overwrite this file"""
+        name = os.path.relpath(path, settings.BACKUPED_ROOT)
+
+        if self.format == 'zip':
+            with zipfile.ZipFile(self.path, "r") as z:
+                names = z.namelist()
+
+        else:
+            with tarfile.open(self.path, mode="r") as tar:
+                names = tar.getnames()
+
+        return name in (os.path.normpath(n) for n in names)
+
     def restore_zip(self):
         with zipfile.ZipFile(self.path, "r") as z:
             z.extractall(settings.BACKUPED_ROOT)
@@ -1,35 +1,55 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from fnmatch import fnmatch
 from glob import glob
+import gzip
 from hashlib import sha256
+import lzma
 from operator import attrgetter
 import os
 from pathlib import Path
 import shutil
+import subprocess
 import tempfile
+from threading import Lock
+import time
+from urllib.parse import urljoin, urlparse
 import zipfile
+import zlib
 
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.template.defaultfilters import filesizeformat
 from lxml import etree
 from progressist import ProgressBar
 from resumable import DownloadCheck, DownloadError, urlretrieve
-from requests import ConnectionError
+from requests import ConnectionError, RequestException
 import yaml
 import mimetypes
 
+from ideascube import fragments
 from ideascube.mediacenter.models import Document
-from ideascube.mediacenter.forms import PackagedDocumentForm
+from ideascube.mediacenter.forms import (
+    PackagedDocumentForm, list_package_files)
 from ideascube.mediacenter.utils import guess_kind_from_content_type
 from ideascube.templatetags.ideascube_tags import smart_truncate
 from ideascube.configuration import get_config, set_config
 from ideascube.models import User
 
+from . import delta, mirrors, peers, precompress, segmented, zipextract
+from .packagecache import PackageCache
+from .throttle import OutsideWindow, Throttle
 from .systemd import Manager as SystemManager, NoSuchUnit
 
 from ..utils import printerr
 
 
+# New documents are looked up with one query parameter each, plus one, and
+# SQLite allows at most 999 parameters in a query
+MAX_MEDIA_BATCH_SIZE = 998
+
+
 def rm(path):
     try:
         os.unlink(path)
@@ -38,9 +58,58 @@ def rm(path):
         shutil.rmtree(path)
 
 
+def swap(new, path, old):
+    """Put new in place of path, moving what was there to old
+
+    Both renames are atomic, so path is only missing for the time between
+    them, instead of for the whole time it takes to install its new content.
+    """
+    if os.path.lexists(path):
+        os.rename(path, old)
+
+    os.rename(new, path)
+
+
+def is_same_file(path, info):
+    """Whether the file at path has the same content as the zip member"""
+    try:
+        if os.path.getsize(path) != info.file_size:
+            return False
+
+    except OSError:
+        return False
+
+    crc = 0
+
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(8388608)
+
+            if not data:
+                break
+
+            crc = zlib.crc32(data, crc)
+
+    return crc == info.CRC
+
+
+def open_maybe_compressed(path):
+    """Open a text file, transparently decompressing it if needed
+
+    The compression is guessed from the file extension.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+
+    if path.endswith('.xz'):
+        return lzma.open(path, 'rt', encoding='utf-8')
+
+    return open(path, 'r')
+
+
 def load_from_file(path):
-    with open(path, 'r') as f:
-        return yaml.safe_load(f.read())
+    with open_maybe_compressed(path) as f:
+        return yaml.safe_load(f)
 
 
 def persist_to_file(path, data):
@@ -85,17 +154,22 @@ class ExistingRemoteError(Exception):
 
 
 class Remote:
-    def __init__(self, id, name, url):
+    def __init__(self, id, name, url, mirrors=None):
         self.id = id
         self.name = name
         self.url = url
+        self.mirrors = list(mirrors or [])
+
+    @property
+    def urls(self):
+        return [self.url] + self.mirrors
 
     @classmethod
     def from_file(cls, path):
         d = load_from_file(path)
 
         try:
-            return cls(d['id'], d['name'], d['url'])
+            return cls(d['id'], d['name'], d['url'], mirrors=d.get('mirrors'))
 
         except KeyError as e:
             raise InvalidFile(
@@ -103,9 +177,66 @@ class Remote:
 
     def to_file(self, path):
         d = {'id': self.id, 'name': self.name, 'url': self.url}
+
+        if self.mirrors:
+            d['mirrors'] = self.mirrors
+
         persist_to_file(path, d)
 
 
+def restart_service(name):
+    print('Restarting service', name)
+    try:
+        manager = SystemManager()
+        service = manager.get_service(name)
+    except NoSuchUnit:
+        # Service is not installed, give up.
+        printerr('No service named', name)
+    else:
+        manager.restart(service.Id)
+
+
+def reload_service(name):
+    try:
+        manager = SystemManager()
+        service = manager.get_service(name)
+    except NoSuchUnit:
+        # Service is not installed, give up.
+        printerr('No service named', name)
+    else:
+        if service.can_reload:
+            print('Reloading service', name)
+            manager.reload(service.Id)
+        else:
+            print('Restarting service', name)
+            manager.restart(service.Id)
+
+
+def commit_handlers(handlers):
+    """Commit the handlers, then restart or reload their services
+
+    Several handlers can use the same service, which is only restarted or
+    reloaded once, after all of them are committed.
+    """
+    services = OrderedDict()
+
+    for handler in handlers:
+        handler._services = services
+
+        try:
+            handler.commit()
+
+        finally:
+            handler._services = None
+
+    for name, action in services.items():
+        if action == 'restart':
+            restart_service(name)
+
+        else:
+            reload_service(name)
+
+
 class Handler:
 
     def __init__(self):
@@ -114,6 +245,7 @@ class Handler:
         self._install_dir = getattr(settings, setting, default)
         self._installed = []
         self._removed = []
+        self._services = None
 
     @property
     def name(self):
@@ -127,51 +259,143 @@ class Handler:
         package.remove(self._install_dir)
         self._removed.append(package)
 
+    def upgrade(self, previous, package, download_path):
+        package.upgrade(previous, download_path, self._install_dir)
+        self._installed.append(package)
+
     def commit(self):
         self._installed = []
         self._removed = []
 
     def restart_service(self, name):
-        print('Restarting service', name)
-        try:
-            manager = SystemManager()
-            service = manager.get_service(name)
-        except NoSuchUnit:
-            # Service is not installed, give up.
-            printerr('No service named', name)
-        else:
-            manager.restart(service.Id)
+        if self._services is not None:
+            # See commit_handlers
+            self._services[name] = 'restart'
+            return
+
+        restart_service(name)
+
+    def reload_service(self, name):
+        """Reload the service if it supports it, restart it otherwise"""
+        if self._services is not None:
+            # See commit_handlers, a restart also does what a reload does
+            self._services.setdefault(name, 'reload')
+            return
+
+        reload_service(name)
 
 
 class Kiwix(Handler):
+    def __init__(self):
+        super().__init__()
+        self._libdir = os.path.join(self._install_dir, 'data', 'library')
+        self._library = os.path.join(self._install_dir, 'library.xml')
 
-    def commit(self):
-        print('Rebuilding the Kiwix library')
-        library = etree.Element('library')
-        libdir = os.path.join(self._install_dir, 'data', 'library')
-        os.makedirs(libdir, exist_ok=True)
+    def _get_book(self, zimname):
+        libpath = os.path.join(self._libdir, '{}.xml'.format(zimname))
+
+        with open(libpath, 'r') as f:
+            et = etree.parse(f)
+            books = et.findall('book')
+
+            # We only want to handle a single zim per zip
+            assert len(books) == 1
+
+            book = books[0]
+            book.set('path', 'data/content/%s' % zimname)
+            book.set('indexPath', 'data/index/%s.idx' % zimname)
+
+            return book
 
-        for libpath in glob(os.path.join(libdir, '*.xml')):
+    def _build_library(self):
+        books = OrderedDict()
+
+        for libpath in glob(os.path.join(self._libdir, '*.xml')):
             zimname = os.path.basename(libpath)[:-4]
+            book = self._get_book(zimname)
+            books[book.get('path')] = book
+
+        return books
+
+    def _load_library(self):
+        """Load the current library, with the books indexed by path
 
-            with open(libpath, 'r') as f:
+        Returns None if there is no usable library yet.
+        """
+        try:
+            with open(self._library, 'rb') as f:
                 et = etree.parse(f)
-                books = et.findall('book')
 
-                # We only want to handle a single zim per zip
-                assert len(books) == 1
+        except (FileNotFoundError, etree.XMLSyntaxError):
+            return None
+
+        return OrderedDict(
+            (book.get('path'), book) for book in et.getroot().iter('book'))
+
+    def _update_library(self, books):
+        for pkg in self._removed:
+            books.pop('data/content/{0.id}.zim'.format(pkg), None)
+
+        for pkg in self._installed:
+            zimname = '{0.id}.zim'.format(pkg)
+
+            try:
+                book = self._get_book(zimname)
+
+            except FileNotFoundError:
+                printerr('No library file for {0.id}'.format(pkg))
+                continue
+
+            books[book.get('path')] = book
 
-                book = books[0]
-                book.set('path', 'data/content/%s' % zimname)
-                book.set('indexPath', 'data/index/%s.idx' % zimname)
+    def _write_library(self, books):
+        """Write the library, if it changed
+
+        Returns whether it was written.
+        """
+        library = etree.Element('library')
 
-                library.append(book)
+        for book in books.values():
+            library.append(book)
 
-        with open(os.path.join(self._install_dir, 'library.xml'), 'wb') as f:
-            f.write(etree.tostring(
-                library, xml_declaration=True, encoding='utf-8'))
+        data = etree.tostring(library, xml_declaration=True, encoding='utf-8')
+
+        try:
+            with open(self._library, 'rb') as f:
+                if f.read() == data:
+                    return False
+
+        except FileNotFoundError:
+            pass
+
+        # Never let kiwix-serve see a partially written library
+        tmppath = '{}.tmp'.format(self._library)
+
+        with open(tmppath, 'wb') as f:
+            f.write(data)
+
+        os.rename(tmppath, self._library)
+        return True
+
+    def commit(self):
+        os.makedirs(self._libdir, exist_ok=True)
+        books = self._load_library()
+
+        if books is None:
+            print('Rebuilding the Kiwix library')
+            books = self._build_library()
+
+        else:
+            print('Updating the Kiwix library')
+            self._update_library(books)
+
+        if not self._write_library(books):
+            print('The Kiwix library did not change')
+
+        elif not getattr(settings, 'CATALOG_KIWIX_MONITORS_LIBRARY', False):
+            # Otherwise kiwix-serve notices the changes on its own
+            self.reload_service('kiwix-server')
 
-        self.restart_service('kiwix-server')
         super().commit()
 
 
@@ -182,18 +406,94 @@ server {{
     server_name {server_name};
     root {root};
     index index.html;
+    gzip_static on;
 }}
 """
     root = '/etc/nginx/'
 
     def commit(self):
+        previous = OrderedDict()
+
         for pkg in self._removed:
+            previous.setdefault(pkg.id, self._get_site(pkg.id))
             self.unregister_site(pkg)
         for pkg in self._installed:
+            previous.setdefault(pkg.id, self._get_site(pkg.id))
             self.register_site(pkg)
-        self.restart_service('nginx')
+
+        if previous and self.check_config():
+            # Unlike a restart, a reload lets nginx finish serving the
+            # current requests, e.g videos being streamed
+            self.reload_service('nginx')
+
+        elif previous:
+            # Keep the configuration nginx is running with
+            printerr('Not reloading nginx, restoring its configuration')
+
+            for id, site in previous.items():
+                self._restore_site(id, site)
+
         super().commit()
 
+    def check_config(self):
+        """Whether nginx accepts its configuration
+
+        nginx can only be tested as root, as it opens its logs and writes its
+        pid file. The ideascube user is allowed to run a helper doing that
+        with pkexec, like it does for systemctl.
+        """
+        cmd = getattr(
+            settings, 'CATALOG_NGINX_TEST_COMMAND',
+            ['pkexec', '/usr/bin/ideascube-nginx-test'])
+
+        try:
+            subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+
+        except OSError as e:
+            printerr('Could not check the nginx configuration: {}'.format(e))
+            return False
+
+        except subprocess.CalledProcessError as e:
+            printerr('Could not validate the nginx configuration:')
+            printerr(e.output.decode('utf-8', 'replace').strip())
+            return False
+
+        return True
+
+    def _get_site(self, id):
+        """Get the configuration of a site, and whether it is enabled"""
+        available = Path(self.root, 'sites-available', id)
+        enabled = Path(self.root, 'sites-enabled', id)
+
+        try:
+            with available.open() as f:
+                config = f.read()
+
+        except FileNotFoundError:
+            config = None
+
+        return config, os.path.lexists(str(enabled))
+
+    def _restore_site(self, id, site):
+        config, is_enabled = site
+        available = Path(self.root, 'sites-available', id)
+        enabled = Path(self.root, 'sites-enabled', id)
+
+        if os.path.lexists(str(enabled)):
+            enabled.unlink()
+
+        if config is None:
+            if os.path.lexists(str(available)):
+                available.unlink()
+
+            return
+
+        with available.open('w') as f:
+            f.write(config)
+
+        if is_enabled:
+            enabled.symlink_to(available)
+
     def register_site(self, package):
         available = Path(self.root, 'sites-available', package.id)
         enabled = Path(self.root, 'sites-enabled', package.id)
@@ -205,7 +505,9 @@ server {{
         try:
             enabled.symlink_to(available)
         except FileExistsError:
-            if enabled.realpath() != available.realpath():
+            # Already enabled, e.g when upgrading the site
+            if (os.path.realpath(str(enabled))
+                    != os.path.realpath(str(available))):
                 # Can we delete it? Even if it's not a symlink?
                 # Let's prevent install for now.
                 raise
@@ -263,6 +565,10 @@ class Package(metaclass=MetaRegistry):
         # 0 has the advantage of always being "smaller" than any other version
         return self._metadata.get('version', '0')
 
+    @property
+    def urls(self):
+        return [self.url] + self._metadata.get('mirrors', [])
+
     @property
     def filesize(self):
         try:
@@ -276,6 +582,20 @@ class Package(metaclass=MetaRegistry):
     def remove(self, install_dir):
         raise NotImplementedError('Subclasses must implement this method')
 
+    def upgrade(self, previous, download_path, install_dir):
+        """Replace the previous version of the package by this one
+
+        Subclasses should override this to install the new version beside the
+        previous one, so that the content stays available during the upgrade.
+        """
+        previous.remove(install_dir)
+        self.install(download_path, install_dir)
+
+    def get_staging_dir(self, install_dir):
+        # Make it in the install dir so we can rename things out of it
+        return tempfile.mkdtemp(
+            prefix='.upgrade-{0.id}-'.format(self), dir=install_dir)
+
     def assert_is_zipfile(self, path):
         if not zipfile.is_zipfile(path):
             os.unlink(path)
@@ -295,7 +615,7 @@ class ZippedZim(Package):
             names = filter(lambda n: n.startswith('data/'), names)
             # Make it a list so we can reuse it later
             names = list(names)
-            z.extractall(install_dir, members=names)
+            zipextract.extractall(z, install_dir, members=names)
 
         datadir = os.path.join(install_dir, 'data')
 
@@ -325,6 +645,42 @@ class ZippedZim(Package):
         for path in glob(os.path.join(datadir, '*', zimname)):
             rm(path)
 
+    def upgrade(self, previous, download_path, install_dir):
+        zimname = '{0.id}.zim*'.format(self)
+        staging = self.get_staging_dir(install_dir)
+
+        try:
+            self.install(download_path, staging)
+            trash = os.path.join(staging, 'previous')
+            os.mkdir(trash)
+
+            previous_paths = glob(
+                os.path.join(install_dir, 'data', '*', zimname))
+            new_paths = glob(os.path.join(staging, 'data', '*', zimname))
+            swapped = set()
+
+            for new in new_paths:
+                relpath = os.path.relpath(new, staging)
+                path = os.path.join(install_dir, relpath)
+                old = os.path.join(trash, relpath.replace(os.path.sep, '_'))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+                if os.path.isfile(path):
+                    # Files can be replaced atomically
+                    os.rename(new, path)
+
+                else:
+                    swap(new, path, old)
+
+                swapped.add(path)
+
+            for path in previous_paths:
+                if path not in swapped:
+                    rm(path)
+
+        finally:
+            rm(staging)
+
     # [FIXME] Thoses two properties look like hacks.
     # We may want to find a way to find those information in the package or
     # catalog metadata.
@@ -372,6 +728,30 @@ class StaticSite(SimpleZipPackage):
     template_id = 'static-site'
     handler = Nginx
 
+    def install(self, download_path, install_dir):
+        super().install(download_path, install_dir)
+
+        if getattr(settings, 'CATALOG_STATIC_SITE_PRECOMPRESS', True):
+            # Compress once now, rather than for every request
+            print('Compressing the files of {0.id}'.format(self))
+            precompress.precompress(
+                self.get_root_dir(install_dir),
+                level=getattr(settings, 'CATALOG_STATIC_SITE_GZIP_LEVEL', 9),
+                workers=getattr(settings, 'CATALOG_STATIC_SITE_GZIP_WORKERS',
+                                None))
+
+    def upgrade(self, previous, download_path, install_dir):
+        staging = self.get_staging_dir(install_dir)
+
+        try:
+            self.install(download_path, staging)
+            swap(
+                self.get_root_dir(staging), self.get_root_dir(install_dir),
+                os.path.join(staging, 'previous'))
+
+        finally:
+            rm(staging)
+
     # [FIXME] This propertie looks like hacks.
     @property
     def theme(self):
@@ -401,20 +781,18 @@ class ZippedMedias(SimpleZipPackage):
         Document.objects.filter(package_id=self.id).delete()
         super().remove(install_dir)
 
-    def install(self, download_path, install_dir):
-        super().install(download_path, install_dir)
-        print('Adding medias to mediacenter database.')
-        root = self.get_root_dir(install_dir)
+    def _read_manifest(self, root):
         manifestfile = Path(root, 'manifest.yml')
 
         try:
             with manifestfile.open('r') as m:
-                manifest = yaml.safe_load(m.read())
+                return yaml.safe_load(m.read())
 
         except FileNotFoundError:
             raise InvalidPackageContent('Missing manifest file in {}'.format(
                 self.id))
 
+    def _get_pseudo_install_dir(self, install_dir):
         catalog_path = os.path.join(settings.MEDIA_ROOT, "catalog")
         try:
             os.symlink(install_dir, catalog_path)
@@ -422,20 +800,166 @@ class ZippedMedias(SimpleZipPackage):
             if not os.path.islink(catalog_path):
                 printerr("Cannot install package {}. {} must not exist "
                          "or being a symlink.".format(self.id, catalog_path))
-                return
+                return None
+
+        return os.path.join(catalog_path, self.id)
+
+    def _save_medias(self, medias, pseudo_install_dir, documents=None):
+        """Validate the medias and save them in batches
+
+        documents maps the media paths to the existing documents, which are
+        updated instead of creating new ones.
+        """
+        if documents is None:
+            documents = {}
+
+        files = list_package_files(pseudo_install_dir)
+        batch_size = min(
+            getattr(settings, 'CATALOG_MEDIA_BATCH_SIZE', 500),
+            MAX_MEDIA_BATCH_SIZE)
+        created = []
+        updated = []
+
+        for media in medias:
+            document = documents.get(media.get('path'))
 
-        pseudo_install_dir = os.path.join(catalog_path, self.id)
-        for media in manifest['medias']:
             try:
-                self._install_media(media, pseudo_install_dir)
-            except:
+                validated = self._install_media(
+                    media, pseudo_install_dir, files, instance=document)
+            except (InvalidPackageContent, ValidationError, OSError):
                 # This can lead to installed package with uninstall media.
                 # We sould handle this somehow.
                 printerr("Cannot install media {} from package {}".format(
                     media['title'], self.id))
                 continue
 
-    def _install_media(self, media_info, pseudo_install_dir):
+            if document is None:
+                created.append(validated)
+
+            else:
+                updated.append(validated)
+
+            if len(created) >= batch_size:
+                Document.objects.bulk_create_with_tags(created)
+                created = []
+
+            if len(updated) >= batch_size:
+                Document.objects.bulk_update_with_tags(updated)
+                updated = []
+
+        Document.objects.bulk_create_with_tags(created)
+        Document.objects.bulk_update_with_tags(updated)
+
+    def install(self, download_path, install_dir):
+        super().install(download_path, install_dir)
+        print('Adding medias to mediacenter database.')
+        root = self.get_root_dir(install_dir)
+        manifest = self._read_manifest(root)
+
+        pseudo_install_dir = self._get_pseudo_install_dir(install_dir)
+
+        if pseudo_install_dir is None:
+            return
+
+        self._save_medias(manifest['medias'], pseudo_install_dir)
+
+    def _extract_changed_files(self, z, root):
+        """Only extract the files which changed since the previous version
+
+        Returns the names of the files which were extracted.
+        """
+        changed = []
+        names = set()
+
+        for info in z.infolist():
+            if info.filename.endswith('/'):
+                continue
+
+            path = zipextract.get_target_path(info, root)
+            names.add(os.path.relpath(path, root))
+
+            if not is_same_file(path, info):
+                changed.append(info)
+
+        zipextract.extractall(z, root, members=changed)
+
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+
+                if os.path.relpath(path, root) not in names:
+                    os.unlink(path)
+
+        return {os.path.relpath(zipextract.get_target_path(info, root), root)
+                for info in changed}
+
+    def upgrade(self, previous, download_path, install_dir):
+        """Only update what changed since the previous version
+
+        Documents keep their ids, and only the ones which were added, changed
+        or removed are indexed again.
+        """
+        root = self.get_root_dir(install_dir)
+
+        try:
+            previous_manifest = self._read_manifest(root)
+
+        except InvalidPackageContent:
+            return super().upgrade(previous, download_path, install_dir)
+
+        self.assert_is_zipfile(download_path)
+
+        with zipfile.ZipFile(download_path, "r") as z:
+            try:
+                manifest = yaml.safe_load(z.read('manifest.yml'))
+
+            except KeyError:
+                raise InvalidPackageContent(
+                    'Missing manifest file in {}'.format(self.id))
+
+            changed_files = self._extract_changed_files(z, root)
+
+        pseudo_install_dir = self._get_pseudo_install_dir(install_dir)
+
+        if pseudo_install_dir is None:
+            return
+
+        previous_medias = {m.get('path'): m for m in previous_manifest['medias']}
+        medias = {m.get('path'): m for m in manifest['medias']}
+
+        documents = {}
+        removed = []
+        prefix = os.path.relpath(pseudo_install_dir, settings.MEDIA_ROOT)
+
+        for document in Document.objects.filter(package_id=previous.id):
+            path = os.path.relpath(document.original.name, prefix)
+
+            if path in medias:
+                documents[path] = document
+
+            else:
+                removed.append(document.id)
+
+        Document.objects.filter(id__in=removed).delete()
+
+        to_save = []
+
+        for path, media in medias.items():
+            if (path in documents
+                    and media == previous_medias.get(path)
+                    and path not in changed_files
+                    and media.get('preview') not in changed_files):
+                # Nothing changed for this one
+                continue
+
+            to_save.append(media)
+
+        print('Updating {} medias in mediacenter database.'.format(
+            len(to_save)))
+        self._save_medias(to_save, pseudo_install_dir, documents=documents)
+
+    def _install_media(self, media_info, pseudo_install_dir, files,
+                       instance=None):
         try:
             media_info['title'] = smart_truncate(media_info['title'])
         except KeyError:
@@ -461,15 +985,21 @@ class ZippedMedias(SimpleZipPackage):
             media_info['preview'] = os.path.join(pseudo_install_dir,
                                                  media_info['preview'])
 
-        self._save_media(media_info, pseudo_install_dir)
+        return self._validate_media(
+            media_info, pseudo_install_dir, files, instance=instance)
 
-    def _save_media(self, metadata, install_dir):
+    def _validate_media(self, metadata, install_dir, files, instance=None):
+        """Get the document for the media, and the names of its tags
+
+        The document is not saved, so that they can all be saved at once.
+        """
         form = PackagedDocumentForm(path=install_dir,
+                                   files=files,
                                    data=metadata,
-                                   instance=None)
+                                   instance=instance)
 
         if form.is_valid():
-            form.save()
+            return form.save(commit=False), form.cleaned_data['tags']
         else:
             lerr = ["Some values are not valid :"]
             for field, error in form.errors.items():
@@ -485,13 +1015,24 @@ class Bar(ProgressBar):
 
 
 class Catalog:
-    def __init__(self):
+    def __init__(self, bar=None, throttle=None):
         self._cache_root = settings.CATALOG_CACHE_ROOT
         os.makedirs(self._cache_root, exist_ok=True)
 
         self._catalog_cache = os.path.join(self._cache_root, 'catalog.yml')
         self._local_package_cache = os.path.join(self._cache_root, 'packages')
         os.makedirs(self._local_package_cache, exist_ok=True)
+        self._package_cache = PackageCache(
+            self._local_package_cache,
+            quota=getattr(settings, 'CATALOG_CACHE_QUOTA', None))
+
+        # Downloaded during the current transaction, and not installed yet
+        self._pending_checksums = set()
+        self._remote_catalogs = os.path.join(self._cache_root, 'catalogs')
+        self._mirrors = mirrors.MirrorStats(
+            os.path.join(self._cache_root, 'mirrors.yml'),
+            failure_penalty=getattr(
+                settings, 'CATALOG_MIRROR_FAILURE_PENALTY', 3600))
 
         self._storage_root = settings.CATALOG_STORAGE_ROOT
         os.makedirs(self._storage_root, exist_ok=True)
@@ -504,10 +1045,15 @@ class Catalog:
         self._load_remotes()
         self._load_catalog()
 
-        self._bar = Bar()
+        self._bar = Bar() if bar is None else bar
+        # The remote catalogs and the segments are downloaded in threads
+        self._bar_lock = Lock()
+        self._throttle = (
+            Throttle.from_settings() if throttle is None else throttle)
 
     def _progress(self, msg, i, chunk_size, remote_size):
-        self._bar.update(done=(i + 1) * chunk_size, total=remote_size)
+        with self._bar_lock:
+            self._bar.update(done=(i + 1) * chunk_size, total=remote_size)
 
     # -- Manage packages ------------------------------------------------------
     def _get_package(self, id, source):
@@ -578,10 +1124,269 @@ class Catalog:
 
         return sha.hexdigest() == sha256sum
 
-    def _fetch_package(self, package):
+    def _get_cached_package(self, package):
+        path = self._package_cache.get(package, record=False)
+
+        if path is not None:
+            return path
+
+        filename = '{0.id}-{0.version}'.format(package)
+
+        for cache in self._package_caches:
+            path = os.path.join(cache, filename)
+
+            if os.path.isfile(path):
+                return path
+
+    def _fetch_package_delta(self, package, previous, path):
+        """Try downloading only what changed since the previous version
+
+        This requires the remote to publish a block map for the package, and
+        the previous version to still be in one of our package caches.
+
+        Returns whether it worked. If it didn't, the caller must fall back to
+        a full download.
+        """
+        if not getattr(settings, 'CATALOG_DELTA_UPGRADES', True):
+            return False
+
+        try:
+            blockmap_url = package.blockmap
+
+        except AttributeError:
+            # The remote does not publish block maps for this package
+            return False
+
+        seed = self._get_cached_package(previous)
+
+        if seed is None:
+            return False
+
+        def _failure(url, e):
+            printerr('Could not download the changes in {0.id} from {1}: '
+                     '{2}'.format(package, mirrors.get_host(url), e))
+            self._mirrors.record_failure(url)
+
+        urls = self._mirrors.rank(
+            package.urls, size=self._get_package_size(package))
+        timeout = getattr(settings, 'CATALOG_MIRROR_TIMEOUT', 30)
+
+        print('Downloading the changes in {0.id}'.format(package))
+
+        while True:
+            self._throttle.wait_for_window()
+
+            try:
+                fetched = delta.fetch(
+                    urls, blockmap_url, seed, path, package.sha256sum,
+                    timeout=timeout, throttle=self._throttle,
+                    on_failure=_failure)
+
+            except OutsideWindow:
+                print('Pausing the download of {0.id} until the next '
+                      'download window'.format(package))
+                continue
+
+            except Exception as e:
+                printerr('Could not download the changes in {0.id}, '
+                         'downloading the whole package instead'.format(
+                             package))
+                printerr(e)
+                return False
+
+            finally:
+                self._mirrors.save()
+
+            break
+
+        print('Downloaded {} changed blocks'.format(fetched))
+        return True
+
+    def _fetch_package_segmented(self, package, path, urls):
+        """Try downloading a big package in concurrent segments
+
+        If a mirror fails, the download is resumed from the next one which
+        supports Range requests.
+
+        Returns whether it was downloaded. If the package is too small or no
+        mirror supports Range requests, the caller must download it the usual
+        way.
+        """
+        count = getattr(settings, 'CATALOG_DOWNLOAD_SEGMENTS', 4)
+        threshold = getattr(
+            settings, 'CATALOG_SEGMENTED_DOWNLOAD_THRESHOLD', 1024 ** 3)
+
+        # Don't even ask the server about packages which are too small
+        if count < 2 or self._get_package_size(package) < threshold:
+            return False
+
+        def _progress(done, total):
+            with self._bar_lock:
+                self._bar.update(done=done, total=total)
+
+        for i, url in enumerate(urls):
+            last = i == len(urls) - 1
+
+            try:
+                size = segmented.get_size(url)
+
+            except RequestException:
+                self._mirrors.record_failure(url)
+                self._mirrors.save()
+                continue
+
+            if size is None:
+                continue
+
+            print('Downloading {0.id} in {1} segments'.format(package, count))
+
+            try:
+                segmented.urlretrieve(
+                    url, path, size, package.sha256sum, segments=count,
+                    progress=_progress, throttle=self._throttle)
+
+            except DownloadError as e:
+                self._mirrors.record_failure(url)
+                self._mirrors.save()
+
+                if last:
+                    raise
+
+                # The next mirror resumes what was interrupted
+                printerr('Could not download {0.id} from {1}: {2}'.format(
+                    package, mirrors.get_host(url), e))
+                continue
+
+            return True
+
+        return False
+
+    def _get_package_size(self, package):
+        try:
+            return int(package.size)
+
+        except (AttributeError, ValueError):
+            return 0
+
+    def _fetch_package_from_mirrors(self, package, path, urls, reporthook=None):
+        """Download the package from the fastest of its mirrors
+
+        If a mirror fails, or gets too slow while there are other ones left
+        to try, the download is resumed from the next one.
+        """
+        min_throughput = getattr(
+            settings, 'CATALOG_MIRROR_MIN_THROUGHPUT', 10 * 1024)
+        window = getattr(settings, 'CATALOG_MIRROR_WINDOW', 30)
+        timeout = getattr(settings, 'CATALOG_MIRROR_TIMEOUT', 30)
+
+        for i, url in enumerate(urls):
+            last = i == len(urls) - 1
+            monitor = mirrors.Monitor(
+                reporthook, min_throughput=None if last else min_throughput,
+                window=window, throttle=self._throttle)
+
+            # Don't give up on the last mirror, there is nothing after it
+            kwargs = {} if last else {'timeout': timeout}
+
+            try:
+                urlretrieve(
+                    url, path, sha256sum=package.sha256sum,
+                    reporthook=monitor, **kwargs)
+
+            except mirrors.SlowMirror as e:
+                printerr('Downloading {0.id} from {1} is too slow: {2}'.format(
+                    package, mirrors.get_host(url), e))
+                self._mirrors.record(url, throughput=monitor.throughput)
+                self._mirrors.save()
+                continue
+
+            except (DownloadError, RequestException) as e:
+                self._mirrors.record_failure(url)
+                self._mirrors.save()
+
+                if last:
+                    raise
+
+                printerr('Could not download {0.id} from {1}: {2}'.format(
+                    package, mirrors.get_host(url), e))
+
+                if e.args and e.args[0] is DownloadCheck.checksum_mismatch:
+                    # Resuming from another mirror would not fix that
+                    os.unlink(path)
+
+                continue
+
+            self._mirrors.record(
+                url, latency=monitor.latency, throughput=monitor.throughput)
+            self._mirrors.save()
+            return
+
+    def _get_installed_checksums(self):
+        return {
+            metadata['sha256sum'] for metadata in self._installed.values()
+            if 'sha256sum' in metadata}
+
+    def _add_to_package_cache(self, package, path):
+        path = self._package_cache.add(package, path)
+
+        # Never evict what is installed, nor what we are about to install
+        keep = self._get_installed_checksums() | self._pending_checksums
+        keep.add(package.sha256sum)
+        self._package_cache.evict(keep=keep)
+
+        return path
+
+    def _adopt_cached_package(self, package, path):
+        if os.path.dirname(path) != self._local_package_cache:
+            # Additional caches are not ours to manage
+            return path
+
+        return self._add_to_package_cache(package, path)
+
+    def _fetch_package_from_peers(self, package, path, reporthook=None):
+        """Try downloading the package from other boxes on the LAN
+
+        Returns whether it was downloaded.
+        """
+        timeout = getattr(settings, 'CATALOG_PEER_TIMEOUT', 5)
+
+        # Not to lose an interrupted download from the mirrors, at path
+        tmppath = '{}.peer'.format(path)
+
+        for peer in self._peers:
+            url = peers.get_package_url(peer, package.sha256sum)
+
+            try:
+                urlretrieve(
+                    url, tmppath, sha256sum=package.sha256sum,
+                    reporthook=reporthook, timeout=timeout)
+
+            except (DownloadError, RequestException) as e:
+                printerr('Could not download {0.id} from {1}: {2}'.format(
+                    package, peer, e))
+
+                # Whatever this peer sent us, we don't want to resume it
+                if os.path.exists(tmppath):
+                    os.unlink(tmppath)
+
+                continue
+
+            os.replace(tmppath, path)
+            segmented.discard(path)
+            print('Downloaded {0.id} from {1}'.format(package, peer))
+            return True
+
+        return False
+
+    def _fetch_package(self, package, previous=None):
         def _progress(*args):
             self._progress(' {}'.format(package.id), *args)
 
+        path = self._package_cache.get(package)
+
+        if path is not None:
+            return path
+
         filename = '{0.id}-{0.version}'.format(package)
 
         for cache in self._package_caches:
@@ -589,14 +1394,14 @@ class Catalog:
 
             if os.path.isfile(path):
                 if self._verify_sha256(path, package.sha256sum):
-                    return path
+                    return self._adopt_cached_package(package, path)
 
                 try:
                     # This might be an incomplete download, try finishing it
                     urlretrieve(
                         package.url, path, sha256sum=package.sha256sum,
                         reporthook=_progress)
-                    return path
+                    return self._adopt_cached_package(package, path)
 
                 except DownloadError as e:
                     # File was too busted, could not finish the download
@@ -610,11 +1415,36 @@ class Catalog:
                     os.unlink(path)
 
         path = os.path.join(self._local_package_cache, filename)
-        urlretrieve(
-            package.url, path, sha256sum=package.sha256sum,
-            reporthook=_progress)
 
-        return path
+        if self._fetch_package_from_peers(package, path, reporthook=_progress):
+            return self._add_to_package_cache(package, path)
+
+        if segmented.is_partial(path):
+            # Resume the interrupted download
+            pass
+
+        elif (previous is not None
+                and self._fetch_package_delta(package, previous, path)):
+            return self._add_to_package_cache(package, path)
+
+        urls = self._mirrors.rank(
+            package.urls, size=self._get_package_size(package))
+
+        while True:
+            self._throttle.wait_for_window()
+
+            try:
+                if not self._fetch_package_segmented(package, path, urls):
+                    self._fetch_package_from_mirrors(
+                        package, path, urls, reporthook=_progress)
+
+            except OutsideWindow:
+                # What we got so far is kept, we'll resume from there
+                print('Pausing the download of {0.id} until the next '
+                      'download window'.format(package))
+                continue
+
+            return self._add_to_package_cache(package, path)
 
     def list_installed(self, ids):
         pkgs = self._get_packages(
@@ -667,6 +1497,7 @@ class Catalog:
         used_handlers = {}
         downloaded = []
         installed_ids = []
+        self._pending_checksums = set()
 
         for pkg in self._get_packages(ids, self._available):
             if pkg.id in self._installed:
@@ -680,6 +1511,7 @@ class Catalog:
                 printerr(e)
             else:
                 downloaded.append((pkg, download_path))
+                self._pending_checksums.add(pkg.sha256sum)
 
         for pkg, download_path in downloaded:
             handler = self._get_handler(pkg)
@@ -695,10 +1527,10 @@ class Catalog:
             installed_ids.append(pkg.id)
             self._persist_catalog()
 
+        self._pending_checksums = set()
         self._update_displayed_packages_on_home(to_add_ids=installed_ids)
 
-        for handler in used_handlers.values():
-            handler.commit()
+        commit_handlers(used_handlers.values())
 
     def remove_packages(self, ids, commit=True):
         used_handlers = {}
@@ -721,8 +1553,7 @@ class Catalog:
         if not commit:
             return
 
-        for handler in used_handlers.values():
-            handler.commit()
+        commit_handlers(used_handlers.values())
 
     def reinstall_packages(self, ids):
         self.remove_packages(ids, commit=False)
@@ -731,6 +1562,7 @@ class Catalog:
     def upgrade_packages(self, ids):
         used_handlers = {}
         downloaded = []
+        self._pending_checksums = set()
 
         for ipkg in self._get_packages(ids, self._installed):
             upkg = self._get_package(ipkg.id, self._available)
@@ -740,18 +1572,34 @@ class Catalog:
                 continue
 
             try:
-                download_path = self._fetch_package(upkg)
+                download_path = self._fetch_package(upkg, previous=ipkg)
             except DownloadError as e:
                 printerr("Failed downloading {0.id}".format(upkg))
                 printerr(e)
             else:
                 downloaded.append((ipkg, upkg, download_path))
+                self._pending_checksums.add(upkg.sha256sum)
 
         for ipkg, upkg, download_path in downloaded:
             ihandler = self._get_handler(ipkg)
             uhandler = self._get_handler(upkg)
             print('Upgrading {0.id}'.format(ipkg))
 
+            if type(ipkg) is type(upkg):
+                # The previous version stays in place until the new one is
+                # ready to replace it
+                try:
+                    uhandler.upgrade(ipkg, upkg, download_path)
+                except Exception as e:
+                    printerr("Failed upgrading {0.id}".format(ipkg))
+                    printerr(e)
+                    continue
+                used_handlers[uhandler.__class__.__name__] = uhandler
+
+                self._installed[ipkg.id] = self._available[upkg.id]
+                self._persist_catalog()
+                continue
+
             try:
                 ihandler.remove(ipkg)
             except Exception as e:
@@ -771,8 +1619,8 @@ class Catalog:
             self._installed[ipkg.id] = self._available[upkg.id]
             self._persist_catalog()
 
-        for handler in used_handlers.values():
-            handler.commit()
+        self._pending_checksums = set()
+        commit_handlers(used_handlers.values())
 
     # -- Manage local cache ---------------------------------------------------
     def _load_catalog(self):
@@ -811,49 +1659,268 @@ class Catalog:
                 self._installed = installed
 
         self._package_caches = [self._local_package_cache]
+        self._peers = list(getattr(settings, 'CATALOG_PEERS', []))
 
     def _persist_catalog(self):
         persist_to_file(self._catalog_cache, self._available)
         persist_to_file(self._installed_storage, self._installed)
 
+        # The home page lists some of the installed packages
+        fragments.bump('catalog')
+
     def add_package_cache(self, path):
         self._package_caches.append(os.path.abspath(path))
 
-    def update_cache(self):
-        self._available = {}
+    def add_peer(self, url):
+        self._peers.append(url)
+
+    def serve_package_cache(self, address, port):
+        """Serve the package cache to the other boxes on the LAN"""
+        server = peers.PackageCacheServer((address, port), self._package_cache)
+        print('Serving the package cache on {}:{}'.format(address, port))
+
+        try:
+            server.serve_forever()
+
+        finally:
+            server.server_close()
+
+    def _remote_catalog_path(self, remote):
+        return os.path.join(self._remote_catalogs, '{}.yml'.format(remote.id))
+
+    def _remote_validators_path(self, remote):
+        return os.path.join(
+            self._remote_storage, '{}.validators'.format(remote.id))
+
+    def _conditional_fetch(self, url, validators, tmpdir, reporthook=None):
+        """Download a remote file, unless it didn't change
+
+        The validators are the ETag and Last-Modified headers the server
+        sent the last time we downloaded the file. They are sent back to the
+        server so that it can tell us when nothing changed.
+
+        Returns the path to the downloaded file (None if the file did not
+        change) and the new validators.
+        """
+        headers = {}
+
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+
+        if validators.get('last-modified'):
+            headers['If-Modified-Since'] = validators['last-modified']
 
-        for remote in self._remotes.values():
-            # TODO: Get resumable.urlretrieve to accept a file-like object?
-            with tempfile.NamedTemporaryFile() as fd:
-                tmppath = fd.name
+        # Keep the extension, it tells us whether the file is compressed
+        path = os.path.join(
+            tmpdir, os.path.basename(urlparse(url).path) or 'catalog.yml')
+        response_headers = urlretrieve(
+            url, path, reporthook=reporthook, headers=headers) or {}
 
-                def _progress(*args):
-                    self._progress(' {}'.format(remote.name), *args)
+        if headers and not os.path.getsize(path):
+            # resumable.urlretrieve does not give us the status code, but a
+            # "304 Not Modified" response has an empty body, which a catalog
+            # never has.
+            return None, validators
+
+        new_validators = {}
+
+        if response_headers.get('ETag'):
+            new_validators['etag'] = response_headers['ETag']
+
+        if response_headers.get('Last-Modified'):
+            new_validators['last-modified'] = response_headers['Last-Modified']
+
+        return path, new_validators
+
+    def _fetch_remote_delta(self, url, cached, validators, tmpdir,
+                            reporthook=None):
+        """Try bringing the local copy of a remote catalog up to date
+
+        A remote can publish, along with its full catalog, the changes since
+        the previous version of the catalog. Its full catalog then looks like:
+
+            serial: 42
+            delta: catalog.delta.yml
+            all:
+              ...
+
+        And the delta file (its url is relative to the one of the remote, or
+        of the mirror we are using) looks like:
+
+            from: 41
+            serial: 42
+            all:
+              <added or modified packages>
+            removed:
+              - <removed package ids>
+
+        Returns the updated catalog, or None if the full catalog must be
+        downloaded.
+        """
+        delta_url = urljoin(url, cached['delta'])
+
+        try:
+            path, new_validators = self._conditional_fetch(
+                delta_url, validators.get(delta_url, {}), tmpdir,
+                reporthook=reporthook)
+
+        except DownloadError:
+            # The remote stopped publishing deltas
+            return None
+
+        if path is None:
+            return cached
+
+        validators[delta_url] = new_validators
+        delta = load_from_file(path)
+
+        if delta is None:
+            return None
+
+        if delta.get('serial') == cached['serial']:
+            # We already have this version
+            return cached
+
+        if delta.get('from') != cached['serial']:
+            # We missed more than one version
+            return None
+
+        catalog = dict(cached)
+        catalog['all'] = dict(cached['all'])
+        catalog['all'].update(delta.get('all') or {})
+
+        for id in delta.get('removed') or []:
+            catalog['all'].pop(id, None)
+
+        catalog['serial'] = delta['serial']
+        catalog['delta'] = delta.get('delta', cached['delta'])
+
+        # Our copy does not match the full catalog on the server any more
+        validators.pop(url, None)
+
+        return catalog
+
+    def _fetch_remote_catalog_from(self, url, cached, validators, tmpdir,
+                                   reporthook=None):
+        catalog = None
+
+        if cached is not None and 'delta' in cached and 'serial' in cached:
+            catalog = self._fetch_remote_delta(
+                url, cached, validators, tmpdir, reporthook=reporthook)
+
+        if catalog is None:
+            path, validators[url] = self._conditional_fetch(
+                url, validators.get(url, {}), tmpdir, reporthook=reporthook)
+            catalog = cached if path is None else load_from_file(path)
+
+        return catalog
+
+    def _fetch_remote_catalog(self, remote):
+        def _progress(*args):
+            self._progress(' {}'.format(remote.name), *args)
+
+        catalog_path = self._remote_catalog_path(remote)
+        validators_path = self._remote_validators_path(remote)
+
+        try:
+            cached = load_from_file(catalog_path)
+
+        except FileNotFoundError:
+            cached = None
+
+        validators = {}
+
+        if cached is not None:
+            # Only try conditional requests if we kept the previous version
+            try:
+                validators = load_from_file(validators_path) or {}
+
+            except FileNotFoundError:
+                pass
+
+        # TODO: Verify the download with sha256sum? Crypto signature?
+        with tempfile.TemporaryDirectory(dir=self._cache_root) as tmpdir:
+            urls = self._mirrors.rank(remote.urls)
+
+            for url in urls:
+                started = time.monotonic()
 
-                # TODO: Verify the download with sha256sum? Crypto signature?
                 try:
-                    urlretrieve(remote.url, tmppath, reporthook=_progress)
-                except ConnectionError:
+                    catalog = self._fetch_remote_catalog_from(
+                        url, cached, validators, tmpdir, reporthook=_progress)
+
+                except (ConnectionError, DownloadError) as e:
+                    self._mirrors.record_failure(url)
+
+                    if url != urls[-1]:
+                        printerr(
+                            'Could not fetch the catalog from {}, trying the '
+                            'next mirror'.format(mirrors.get_host(url)))
+                        continue
+
+                    if not isinstance(e, ConnectionError):
+                        raise
+
                     print("Warning: Impossible to connect to the remote"
                           " {remote.name}({remote.url}).\n"
                           "Continue anyway without this remote."
                           .format(remote=remote))
-                    continue
+                    return None
+
+                # Catalogs are small, fetching them is mostly latency
+                self._mirrors.record(
+                    url, latency=time.monotonic() - started)
+                break
+
+        if catalog is not cached:
+            persist_to_file(catalog_path, catalog)
+
+        persist_to_file(validators_path, validators)
+
+        return catalog
 
-                catalog = load_from_file(tmppath)
+    def update_cache(self):
+        self._available = {}
+        os.makedirs(self._remote_catalogs, exist_ok=True)
+
+        # Preserve the order of the remotes, the last one wins in case two of
+        # them provide the same package
+        remotes = list(self._remotes.values())
+        workers = getattr(settings, 'CATALOG_UPDATE_WORKERS', 4)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            catalogs = executor.map(self._fetch_remote_catalog, remotes)
+
+            for catalog in catalogs:
+                if catalog is None:
+                    continue
 
-                # TODO: Handle content which was removed from the remote source
+                # TODO: Handle content which was removed from the remote
+                # source
                 self._available.update(catalog['all'])
 
+        self._mirrors.save()
         self._persist_catalog()
 
-    def clear_cache(self):
-        shutil.rmtree(self._local_package_cache)
-        os.mkdir(self._local_package_cache)
+    def clear_cache(self, keep_installed=True):
+        """Clear the local cache
+
+        By default, the packages which are currently installed are kept, as
+        they are needed to reinstall them or to upgrade them efficiently.
+        """
+        keep = self._get_installed_checksums() if keep_installed else ()
+        self._package_cache.clear(keep=keep)
+
+        if os.path.isdir(self._remote_catalogs):
+            shutil.rmtree(self._remote_catalogs)
 
         self._available = {}
         self._persist_catalog()
 
+    def get_cache_stats(self):
+        return self._package_cache.get_stats(
+            keep=self._get_installed_checksums())
+
     # -- Manage remote sources ------------------------------------------------
     def _load_remotes(self):
         self._remotes = {}
@@ -870,7 +1937,7 @@ class Catalog:
 
         for path in glob(os.path.join(old_remote_cache, '*.yml')):
             r = Remote.from_file(path)
-            self.add_remote(r.id, r.name, r.url)
+            self.add_remote(r.id, r.name, r.url, mirrors=r.mirrors)
 
         if self._remotes:
             # So we did have old remotes after all...
@@ -879,12 +1946,12 @@ class Catalog:
     def list_remotes(self):
         return sorted(self._remotes.values(), key=attrgetter('id'))
 
-    def add_remote(self, id, name, url):
+    def add_remote(self, id, name, url, mirrors=None):
         remote = self._remotes.get(id)
         if remote:
             raise ExistingRemoteError(remote)
 
-        remote = Remote(id, name, url)
+        remote = Remote(id, name, url, mirrors=mirrors)
         remote.to_file(os.path.join(self._remote_storage,
                        '{}.yml'.format(id)))
         self._remotes[id] = remote
@@ -893,5 +1960,13 @@ class Catalog:
         if id not in self._remotes:
             raise ValueError('There is no "{}" remote'.format(id))
 
-        del(self._remotes[id])
+        remote = self._remotes.pop(id)
         os.unlink(os.path.join(self._remote_storage, '{}.yml'.format(id)))
+
+        for path in (self._remote_catalog_path(remote),
+                     self._remote_validators_path(remote)):
+            try:
+                os.unlink(path)
+
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,269 @@
+"""Block-level delta downloads
+
+This is a (much) simplified version of what zsync does: the remote publishes,
+next to a package, a block map listing the checksum of each fixed-size block
+of the package. We can then rebuild the new version of a package from the
+blocks of the previous version we already have (the seed), only fetching the
+blocks which changed with HTTP Range requests.
+
+Contrary to zsync, blocks are only looked up at block-aligned offsets in the
+seed, which avoids computing a rolling checksum over the whole seed in Python.
+This works well for our packages, where new content usually gets appended to
+the archives, or replaces existing content in place.
+
+The package can have mirrors, which all serve the same file and block map. If
+one of them fails, the missing blocks are fetched from the next one.
+"""
+from contextlib import closing
+from hashlib import sha256
+import os
+from urllib.parse import urljoin
+
+import requests
+from resumable import DownloadCheck, DownloadError
+import yaml
+
+
+DEFAULT_BLOCKSIZE = 1024 * 1024
+
+# In seconds, for connecting and between two chunks, not to hang forever
+TIMEOUT = 60
+
+
+def checksum(data):
+    return sha256(data).hexdigest()
+
+
+def file_checksum(path):
+    sha = sha256()
+
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(8388608)
+
+            if not data:
+                break
+
+            sha.update(data)
+
+    return sha.hexdigest()
+
+
+class BlockMap:
+    def __init__(self, blocksize, size, blocks):
+        self.blocksize = blocksize
+        self.size = size
+        self.blocks = blocks
+
+        expected = (size + blocksize - 1) // blocksize
+
+        if len(blocks) != expected:
+            raise ValueError(
+                'Invalid block map: expected {} blocks, got {}'.format(
+                    expected, len(blocks)))
+
+    def get_block_range(self, index):
+        start = index * self.blocksize
+        end = min(start + self.blocksize, self.size)
+        return start, end
+
+    @classmethod
+    def from_url(cls, url, timeout=TIMEOUT):
+        with closing(requests.get(url, timeout=timeout)) as resp:
+            try:
+                resp.raise_for_status()
+
+            except requests.exceptions.HTTPError as e:
+                raise DownloadError(e)
+
+            d = yaml.safe_load(resp.text)
+
+        try:
+            return cls(d['blocksize'], d['size'], d['blocks'])
+
+        except (KeyError, TypeError):
+            raise ValueError('Invalid block map: {}'.format(url))
+
+    @classmethod
+    def from_file(cls, path, blocksize=DEFAULT_BLOCKSIZE):
+        """Compute the block map of a file
+
+        This is what remotes need to publish alongside their packages.
+        """
+        blocks = []
+
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(blocksize)
+
+                if not data:
+                    break
+
+                blocks.append(checksum(data))
+
+        return cls(blocksize, os.path.getsize(path), blocks)
+
+    def to_file(self, path):
+        d = {'blocksize': self.blocksize, 'size': self.size,
+             'blocks': self.blocks}
+
+        with open(path, 'w') as f:
+            f.write(yaml.safe_dump(d, default_flow_style=False))
+
+
+def index_seed(path, blocksize):
+    """Map the checksums of the blocks in the seed to their offset"""
+    index = {}
+
+    with open(path, 'rb') as f:
+        offset = 0
+
+        while True:
+            data = f.read(blocksize)
+
+            if not data:
+                break
+
+            index.setdefault(checksum(data), offset)
+            offset += len(data)
+
+    return index
+
+
+def get_runs(indexes):
+    """Group consecutive block indexes, to fetch them in a single request"""
+    runs = []
+
+    for index in indexes:
+        if runs and runs[-1][1] == index - 1:
+            runs[-1][1] = index
+
+        else:
+            runs.append([index, index])
+
+    return runs
+
+
+def failover(urls, func, on_failure=None):
+    """Call func with the first of the urls, moving to the next ones on errors
+
+    The urls which failed are removed from the list, so that the next calls
+    start with the one which worked. If given, on_failure is called with each
+    url which failed and the exception it raised.
+    """
+    while True:
+        try:
+            return func(urls[0])
+
+        except (DownloadError, requests.exceptions.RequestException) as e:
+            if on_failure is not None:
+                on_failure(urls[0], e)
+
+            if len(urls) == 1:
+                raise
+
+            urls.pop(0)
+
+
+def fetch_blocks(session, url, out, blockmap, first, last, timeout=TIMEOUT,
+                 throttle=None):
+    start, _ = blockmap.get_block_range(first)
+    _, end = blockmap.get_block_range(last)
+    headers = {'Range': 'bytes={}-{}'.format(start, end - 1)}
+
+    with closing(session.get(url, headers=headers, stream=True,
+                             timeout=timeout)) as resp:
+        if resp.status_code != 206:
+            raise DownloadError(
+                'Range requests are not supported for {}'.format(url))
+
+        out.seek(start)
+        buffer = bytearray()
+        index = first
+
+        for chunk in resp.iter_content(chunk_size=65536):
+            buffer.extend(chunk)
+
+            if throttle is not None:
+                throttle(len(chunk))
+
+            while index <= last:
+                block_start, block_end = blockmap.get_block_range(index)
+                length = block_end - block_start
+
+                if len(buffer) < length:
+                    break
+
+                block = bytes(buffer[:length])
+                del buffer[:length]
+
+                if checksum(block) != blockmap.blocks[index]:
+                    raise DownloadError(DownloadCheck.checksum_mismatch)
+
+                out.write(block)
+                index += 1
+
+        if index <= last:
+            raise DownloadError(DownloadCheck.size_mismatch)
+
+
+def fetch(urls, blockmap_url, seed, path, sha256sum, timeout=TIMEOUT,
+          throttle=None, on_failure=None):
+    """Download the package at urls to path, reusing the blocks of seed
+
+    The urls are the mirrors of the package, in the order they should be
+    tried. The block map url is relative to each of them.
+
+    Returns the number of blocks which had to be downloaded.
+
+    If anything goes wrong the exception is propagated, and nothing is left
+    at path.
+    """
+    urls = list(urls)
+    blockmap = failover(
+        urls, lambda url: BlockMap.from_url(
+            urljoin(url, blockmap_url), timeout=timeout),
+        on_failure=on_failure)
+    index = index_seed(seed, blockmap.blocksize)
+    missing = []
+
+    # Do not write to path directly, a partial file there would be taken for
+    # an interrupted download, which is not what this is
+    tmppath = '{}.delta'.format(path)
+
+    try:
+        with open(seed, 'rb') as src, open(tmppath, 'wb') as out:
+            out.truncate(blockmap.size)
+
+            for i, block in enumerate(blockmap.blocks):
+                offset = index.get(block)
+
+                if offset is None:
+                    missing.append(i)
+                    continue
+
+                start, end = blockmap.get_block_range(i)
+                src.seek(offset)
+                out.seek(start)
+                out.write(src.read(end - start))
+
+            with requests.Session() as session:
+                for first, last in get_runs(missing):
+                    failover(
+                        urls, lambda url: fetch_blocks(
+                            session, url, out, blockmap, first, last,
+                            timeout=timeout, throttle=throttle),
+                        on_failure=on_failure)
+
+        if file_checksum(tmppath) != sha256sum:
+            raise DownloadError(DownloadCheck.checksum_mismatch)
+
+    except Exception:
+        if os.path.exists(tmppath):
+            os.unlink(tmppath)
+
+        raise
+
+    os.rename(tmppath, path)
+
+    return len(missing)
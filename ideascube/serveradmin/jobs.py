@@ -0,0 +1,297 @@
+"""Run catalog operations in the background
+
+Installing or upgrading packages keeps the disk busy for a long time, which
+makes the web pages slow to answer while it happens. Instead of running them
+in the foreground, catalog operations can be queued as jobs, which a worker
+then runs one after the other, with the lowest CPU and I/O priorities, so
+that serving the pages always comes first.
+
+Each job is a small file in the queue folder, which records its progress.
+A job which was running when the worker got interrupted (e.g by a reboot)
+is started again the next time the worker runs: downloads resume where they
+were left, and packages which were already installed are skipped.
+"""
+from contextlib import contextmanager
+import fcntl
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+from django.conf import settings
+import yaml
+
+from .throttle import Throttle
+from ..utils import printerr
+
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+ACTIONS = ('install', 'reinstall', 'remove', 'upgrade', 'update_cache')
+
+
+class WorkerAlreadyRunning(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, id, action, ids=None, options=None, status=PENDING,
+                 progress=None, error=None, created=None, started=None,
+                 finished=None):
+        if action not in ACTIONS:
+            raise ValueError('Unknown action: {}'.format(action))
+
+        self.id = id
+        self.action = action
+        self.ids = list(ids or [])
+        self.options = dict(options or {})
+        self.status = status
+        self.progress = progress
+        self.error = error
+        self.created = created
+        self.started = started
+        self.finished = finished
+
+    @property
+    def is_finished(self):
+        return self.status in (DONE, FAILED)
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+    def to_dict(self):
+        return {
+            'id': self.id, 'action': self.action, 'ids': self.ids,
+            'options': self.options, 'status': self.status,
+            'progress': self.progress, 'error': self.error,
+            'created': self.created, 'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class JobProgress:
+    """Record the progress of the downloads of a job
+
+    This stands in for the progress bar of the catalog. The job is saved at
+    most once per throttle seconds, not to keep the disk busy with it.
+    """
+    def __init__(self, queue, job, throttle=1):
+        self.queue = queue
+        self.job = job
+        self.throttle = throttle
+
+        self._saved = 0
+
+    def update(self, done=0, total=0, **kwargs):
+        self.job.progress = {'done': done, 'total': total}
+        now = time.monotonic()
+
+        if done >= total > 0 or now - self._saved >= self.throttle:
+            self.queue.save(self.job)
+            self._saved = now
+
+
+class JobQueue:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+        self._lockfile = None
+
+    def _get_path(self, id):
+        return os.path.join(self.root, '{}.yml'.format(id))
+
+    def get_log_path(self, job):
+        return os.path.join(self.root, '{}.log'.format(job.id))
+
+    def save(self, job):
+        path = self._get_path(job.id)
+        tmppath = '{}.tmp'.format(path)
+
+        with open(tmppath, 'w') as f:
+            f.write(yaml.safe_dump(job.to_dict(), default_flow_style=False))
+
+        # The worker and the readers of the queue must never see half of it
+        os.rename(tmppath, path)
+
+    def get(self, id):
+        try:
+            with open(self._get_path(id), 'r') as f:
+                return Job.from_dict(yaml.safe_load(f.read()))
+
+        except FileNotFoundError:
+            raise KeyError(id)
+
+    def list(self):
+        jobs = []
+
+        for name in os.listdir(self.root):
+            if name.endswith('.yml'):
+                jobs.append(self.get(name[:-4]))
+
+        return sorted(jobs, key=lambda job: (job.created, job.id))
+
+    def submit(self, action, ids=None, **options):
+        now = time.time()
+        id = '{:.0f}-{}'.format(now * 1000000, uuid.uuid4().hex[:8])
+        job = Job(id, action, ids=ids, options=options, created=now)
+        self.save(job)
+
+        return job
+
+    def get_next(self):
+        """Get the next job to run
+
+        A job which is still marked as running was interrupted, it is run
+        again before the ones which never started.
+        """
+        for job in self.list():
+            if not job.is_finished:
+                return job
+
+        return None
+
+    def remove_finished(self):
+        for job in self.list():
+            if job.is_finished:
+                os.unlink(self._get_path(job.id))
+
+                try:
+                    os.unlink(self.get_log_path(job))
+
+                except FileNotFoundError:
+                    pass
+
+    def lock(self):
+        """Make sure only one worker runs the jobs"""
+        self._lockfile = open(os.path.join(self.root, '.lock'), 'w')
+
+        try:
+            fcntl.flock(self._lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        except BlockingIOError:
+            self._lockfile.close()
+            self._lockfile = None
+            raise WorkerAlreadyRunning()
+
+    def unlock(self):
+        if self._lockfile is not None:
+            self._lockfile.close()
+            self._lockfile = None
+
+
+def get_queue():
+    return JobQueue(os.path.join(settings.CATALOG_STORAGE_ROOT, 'jobs'))
+
+
+def set_low_priority():
+    """Lower the CPU and I/O priorities of the current process
+
+    The I/O priority is inherited by the threads started afterwards, so this
+    must be called before starting any.
+    """
+    os.nice(getattr(settings, 'CATALOG_JOBS_NICE', 19))
+
+    # The idle class by default: we only get the disk when nobody else wants
+    # it. The best-effort class (2) with a low level (7) is less drastic.
+    ioclass = getattr(settings, 'CATALOG_JOBS_IONICE_CLASS', 3)
+    iolevel = getattr(settings, 'CATALOG_JOBS_IONICE_LEVEL', 7)
+    cmd = ['ionice', '-c', str(ioclass)]
+
+    if ioclass == 2:
+        cmd.extend(['-n', str(iolevel)])
+
+    cmd.extend(['-p', str(os.getpid())])
+
+    try:
+        subprocess.check_call(cmd)
+
+    except (OSError, subprocess.CalledProcessError) as e:
+        printerr('Could not lower the I/O priority: {}'.format(e))
+
+
+@contextmanager
+def redirect_output(path):
+    stdout, stderr = sys.stdout, sys.stderr
+
+    with open(path, 'a') as f:
+        sys.stdout = sys.stderr = f
+
+        try:
+            yield
+
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+
+def run_job(catalog_factory, queue, job):
+    job.status = RUNNING
+    job.started = time.time()
+    job.error = None
+    queue.save(job)
+
+    try:
+        with redirect_output(queue.get_log_path(job)):
+            # A fresh catalog for each job, the previous ones changed it. Jobs
+            # only download during the download windows, if there are any.
+            catalog = catalog_factory(
+                bar=JobProgress(queue, job),
+                throttle=Throttle.from_settings(pause=True))
+
+            for path in job.options.get('package_caches', []):
+                catalog.add_package_cache(path)
+
+            for url in job.options.get('peers', []):
+                catalog.add_peer(url)
+
+            if job.action == 'update_cache':
+                catalog.update_cache()
+
+            else:
+                getattr(catalog, '{}_packages'.format(job.action))(job.ids)
+
+    except Exception as e:
+        job.status = FAILED
+        job.error = str(e)
+
+    else:
+        job.status = DONE
+
+    job.finished = time.time()
+    queue.save(job)
+
+    return job
+
+
+def run(catalog_factory, queue, once=False, poll=5):
+    """Run the queued jobs, one after the other
+
+    Unless once is True, this waits for new jobs forever.
+    """
+    queue.lock()
+
+    try:
+        set_low_priority()
+
+        while True:
+            job = queue.get_next()
+
+            if job is None:
+                if once:
+                    break
+
+                time.sleep(poll)
+                continue
+
+            print('Running job {0.id}: {0.action} {1}'.format(
+                job, ' '.join(job.ids)))
+            job = run_job(catalog_factory, queue, job)
+            print('Job {0.id} is {0.status}'.format(job))
+
+    finally:
+        queue.unlock()
@@ -1,7 +1,11 @@
 import argparse
+from datetime import datetime
+import os
 
 from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
 
+from ideascube.serveradmin import jobs, peers
 from ideascube.serveradmin.catalog import (Catalog,
                                            NoSuchPackage,
                                            ExistingRemoteError)
@@ -31,6 +35,15 @@ class Command(BaseCommand):
             '--package-cache', action='append', metavar='PATH', default=[],
             help='The path to an existing directory where downloaded packages'
                  ' can be found, in addition to the default package cache')
+        package_cache.add_argument(
+            '--peer', action='append', metavar='URL', default=[],
+            help='The url of another box serving its package cache, to try '
+                 'before downloading packages from the remote sources')
+
+        background = argparse.ArgumentParser('background', add_help=False)
+        background.add_argument(
+            '--background', action='store_true',
+            help='Queue the operation, for the jobs worker to run it')
 
         # -- Manage content ---------------------------------------------------
         list = subs.add_parser(
@@ -56,22 +69,24 @@ class Command(BaseCommand):
         list.set_defaults(filter='all', func=self.list_packages)
 
         install = subs.add_parser(
-            'install', parents=[package_cache, required_ids],
+            'install', parents=[background, package_cache, required_ids],
             help='Install packages')
         install.set_defaults(func=self.install_packages)
 
         reinstall = subs.add_parser(
-            'reinstall', parents=[package_cache, required_ids],
+            'reinstall', parents=[background, package_cache, required_ids],
             help='Reinstall packages')
         reinstall.set_defaults(func=self.reinstall_packages)
 
         remove = subs.add_parser(
-            'remove', parents=[required_ids], help='Remove packages')
+            'remove', parents=[background, required_ids],
+            help='Remove packages')
         remove.set_defaults(func=self.remove_packages)
 
         upgrade = subs.add_parser(
             'upgrade', aliases=['update'],
-            parents=[package_cache, optional_ids], help='Upgrade packages')
+            parents=[background, package_cache, optional_ids],
+            help='Upgrade packages')
         upgrade.set_defaults(func=self.upgrade_packages)
 
         # -- Manage local cache -----------------------------------------------
@@ -80,12 +95,51 @@ class Command(BaseCommand):
         cachesubs = cache.add_subparsers(title='Commands', dest='cachecmd')
         cachesubs.required = True
 
-        update = cachesubs.add_parser('update', help='Update the local cache')
+        update = cachesubs.add_parser(
+            'update', parents=[background], help='Update the local cache')
         update.set_defaults(func=self.update_cache)
 
         clear = cachesubs.add_parser('clear', help='Clear the local cache')
+        clear.add_argument(
+            '--all', action='store_true',
+            help='Also remove the cached packages which are installed')
         clear.set_defaults(func=self.clear_cache)
 
+        stats = cachesubs.add_parser(
+            'stats', help='Show statistics about the package cache')
+        stats.set_defaults(func=self.show_cache_stats)
+
+        serve = cachesubs.add_parser(
+            'serve', help='Serve the package cache to other boxes')
+        serve.add_argument(
+            '--bind', default='0.0.0.0', metavar='ADDRESS',
+            help='The address to listen on (default: %(default)s)')
+        serve.add_argument(
+            '--port', type=int, default=peers.DEFAULT_PORT,
+            help='The port to listen on (default: %(default)s)')
+        serve.set_defaults(func=self.serve_cache)
+
+        # -- Manage background jobs -------------------------------------------
+        job = subs.add_parser('jobs', help='Manage background jobs')
+
+        jobsubs = job.add_subparsers(title='Commands', dest='jobcmd')
+        jobsubs.required = True
+
+        list = jobsubs.add_parser('list', help='List the background jobs')
+        list.set_defaults(func=self.list_jobs)
+
+        run = jobsubs.add_parser(
+            'run', help='Run the background jobs, with a low priority')
+        run.add_argument(
+            '--once', action='store_true',
+            help='Exit when there are no more jobs to run, instead of '
+                 'waiting for new ones')
+        run.set_defaults(func=self.run_jobs)
+
+        clear = jobsubs.add_parser(
+            'clear', help='Forget about the finished background jobs')
+        clear.set_defaults(func=self.clear_jobs)
+
         # -- Manage remote sources --------------------------------------------
         remote = subs.add_parser('remotes', help='Manage remote sources')
 
@@ -99,6 +153,9 @@ class Command(BaseCommand):
         add.add_argument('id', help='The id for the new remote source')
         add.add_argument('name', help='The name for the new remote source')
         add.add_argument('url', help='The url for the new remote source')
+        add.add_argument(
+            '--mirror', action='append', dest='mirrors', metavar='URL',
+            help='A mirror of the remote source, can be repeated')
         add.set_defaults(func=self.add_remote)
 
         rm = remotesubs.add_parser('remove', help='Remove a remote source')
@@ -167,10 +224,16 @@ class Command(BaseCommand):
                     print(fmt.format(pkg))
 
     def install_packages(self, options):
+        if options['background']:
+            return self.submit_job('install', options)
+
         if options['package_cache'] is not None:
             for path in options['package_cache']:
                 self.catalog.add_package_cache(path)
 
+        for url in options['peer']:
+            self.catalog.add_peer(url)
+
         try:
             self.catalog.install_packages(options['ids'])
 
@@ -178,6 +241,9 @@ class Command(BaseCommand):
             raise CommandError('No such package: {}'.format(e))
 
     def remove_packages(self, options):
+        if options['background']:
+            return self.submit_job('remove', options)
+
         try:
             self.catalog.remove_packages(options['ids'])
 
@@ -185,6 +251,12 @@ class Command(BaseCommand):
             raise CommandError('No such package: {}'.format(e))
 
     def reinstall_packages(self, options):
+        if options['background']:
+            return self.submit_job('reinstall', options)
+
+        for url in options['peer']:
+            self.catalog.add_peer(url)
+
         try:
             self.catalog.reinstall_packages(options['ids'])
 
@@ -192,10 +264,16 @@ class Command(BaseCommand):
             raise CommandError('No such package: {}'.format(e))
 
     def upgrade_packages(self, options):
+        if options['background']:
+            return self.submit_job('upgrade', options)
+
         if options['package_cache'] is not None:
             for path in options['package_cache']:
                 self.catalog.add_package_cache(path)
 
+        for url in options['peer']:
+            self.catalog.add_peer(url)
+
         try:
             self.catalog.upgrade_packages(options['ids'])
 
@@ -204,10 +282,82 @@ class Command(BaseCommand):
 
     # -- Manage local cache ---------------------------------------------------
     def update_cache(self, options):
+        if options['background']:
+            return self.submit_job('update_cache', options)
+
         self.catalog.update_cache()
 
     def clear_cache(self, options):
-        self.catalog.clear_cache()
+        self.catalog.clear_cache(keep_installed=not options['all'])
+
+    def serve_cache(self, options):
+        try:
+            self.catalog.serve_package_cache(options['bind'], options['port'])
+
+        except KeyboardInterrupt:
+            pass
+
+    def show_cache_stats(self, options):
+        stats = self.catalog.get_cache_stats()
+
+        if stats['hit_rate'] is None:
+            hit_rate = 'n/a'
+
+        else:
+            hit_rate = '{:.0%}'.format(stats['hit_rate'])
+
+        if stats['quota'] is None:
+            quota = 'none'
+
+        else:
+            quota = filesizeformat(stats['quota'])
+
+        print('{:>20} : {}'.format('Packages', stats['objects']))
+        print('{:>20} : {}'.format('Size', filesizeformat(stats['size'])))
+        print('{:>20} : {}'.format('Quota', quota))
+        print('{:>20} : {}'.format(
+            'Reclaimable', filesizeformat(stats['reclaimable'])))
+        print('{:>20} : {} ({} hits, {} misses)'.format(
+            'Hit rate', hit_rate, stats['hits'], stats['misses']))
+
+    # -- Manage background jobs -----------------------------------------------
+    def submit_job(self, action, options):
+        job = jobs.get_queue().submit(
+            action, ids=options.get('ids'),
+            package_caches=[
+                os.path.abspath(p) for p in options.get('package_cache', [])],
+            peers=options.get('peer', []))
+        print('Queued job {}'.format(job.id))
+
+    def list_jobs(self, options):
+        for job in jobs.get_queue().list():
+            created = datetime.fromtimestamp(job.created)
+            status = job.status
+
+            if job.status == jobs.RUNNING and job.progress:
+                done, total = job.progress['done'], job.progress['total']
+
+                if total > 0:
+                    status = '{} ({:.0%})'.format(status, done / total)
+
+            print('{0:%Y-%m-%d %H:%M}  {1.id:25}  {2:16}  {1.action:12} {3}'
+                  .format(created, job, status, ' '.join(job.ids)))
+
+            if job.error:
+                print('    {}'.format(job.error))
+
+    def run_jobs(self, options):
+        try:
+            jobs.run(Catalog, jobs.get_queue(), once=options['once'])
+
+        except jobs.WorkerAlreadyRunning:
+            raise CommandError('The jobs are already being run')
+
+        except KeyboardInterrupt:
+            pass
+
+    def clear_jobs(self, options):
+        jobs.get_queue().remove_finished()
 
     # -- Manage remote sources ------------------------------------------------
     def list_remotes(self, options):
@@ -215,10 +365,13 @@ class Command(BaseCommand):
             left = '[{0.id}] {0.name}'.format(remote)
             print('{0:>35} : {1.url}'.format(left, remote))
 
+            for mirror in remote.mirrors:
+                print('{0:>35} : {1}'.format('mirror', mirror))
+
     def add_remote(self, options):
         try:
             self.catalog.add_remote(options['id'], options['name'],
-                                    options['url'])
+                                    options['url'], mirrors=options['mirrors'])
         except ExistingRemoteError as e:
             if e.remote.url != options['url']:
                 raise CommandError(
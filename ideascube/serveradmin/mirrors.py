@@ -0,0 +1,188 @@
+"""Rank mirrors by how fast they actually are from here
+
+Remotes and packages can list mirrors besides their main url. Each time we
+download something, we measure the latency (the time until the first bytes
+arrive) and the throughput of the server we got it from. These measurements
+are kept per host, in a small table which is persisted between runs, and are
+used to try the fastest mirrors first.
+
+Downloads are monitored while they happen, so that we can give up on a mirror
+whose throughput collapses and resume the download from the next one.
+"""
+from threading import Lock
+import time
+from urllib.parse import urlparse
+
+from . import statefile
+
+
+# How much a new measurement weighs against the previous ones
+SMOOTHING = 0.3
+
+
+class SlowMirror(Exception):
+    pass
+
+
+def get_host(url):
+    url = urlparse(url)
+    return '{}://{}'.format(url.scheme, url.netloc)
+
+
+class MirrorStats:
+    def __init__(self, path, failure_penalty=3600):
+        self.path = path
+        self.failure_penalty = failure_penalty
+
+        self._lock = Lock()
+        self._hosts = self._load()
+
+        # Other processes can update the file, only save what we measured
+        self._changed = set()
+
+    def _load(self):
+        return statefile.load(self.path) or {}
+
+    def save(self):
+        with statefile.locked(self.path), self._lock:
+            hosts = self._load()
+
+            for host in self._changed:
+                hosts[host] = self._hosts[host]
+
+            statefile.save(self.path, hosts)
+            self._hosts = hosts
+            self._changed.clear()
+
+    def get(self, url):
+        with self._lock:
+            return dict(self._hosts.get(get_host(url), {}))
+
+    def _smooth(self, stats, key, value):
+        if value is None:
+            return
+
+        previous = stats.get(key)
+
+        if previous is None:
+            stats[key] = value
+
+        else:
+            stats[key] = previous * (1 - SMOOTHING) + value * SMOOTHING
+
+    def record(self, url, latency=None, throughput=None):
+        with self._lock:
+            host = get_host(url)
+            self._changed.add(host)
+            stats = self._hosts.setdefault(host, {})
+            self._smooth(stats, 'latency', latency)
+            self._smooth(stats, 'throughput', throughput)
+
+    def record_failure(self, url):
+        with self._lock:
+            host = get_host(url)
+            self._changed.add(host)
+            stats = self._hosts.setdefault(host, {})
+            stats['failures'] = stats.get('failures', 0) + 1
+            stats['failed'] = time.time()
+
+    def _get_rank(self, url, size, now):
+        stats = self._hosts.get(get_host(url), {})
+        failed = now - stats.get('failed', 0) < self.failure_penalty
+
+        # Mirrors we never measured are estimated to be instant, so that they
+        # get tried and measured once
+        estimate = stats.get('latency', 0)
+
+        if size and stats.get('throughput'):
+            estimate += size / stats['throughput']
+
+        return failed, estimate
+
+    def rank(self, urls, size=0):
+        """Sort the urls, the fastest mirror first
+
+        Mirrors which failed recently come last. The sort is stable, so
+        mirrors we know nothing about keep the order they were given in.
+        """
+        now = time.time()
+
+        with self._lock:
+            return sorted(urls, key=lambda url: self._get_rank(url, size, now))
+
+
+class Monitor:
+    """Measure a download as it happens
+
+    Instances are used as the reporthook of resumable.urlretrieve. If a
+    minimum throughput is given, SlowMirror is raised when the download went
+    slower than that for a whole window of time.
+
+    The download can also be throttled, the time spent waiting for the
+    throttle is not held against the mirror.
+    """
+    def __init__(self, reporthook=None, min_throughput=None, window=10,
+                 throttle=None):
+        self.reporthook = reporthook
+        self.min_throughput = min_throughput
+        self.window = window
+        self.throttle = throttle
+
+        self.started = time.monotonic()
+        self.latency = None
+        self.received = 0
+
+        self._throttled = 0
+        self._window_started = None
+        self._window_received = 0
+        self._window_throttled = 0
+
+    @property
+    def throughput(self):
+        if self.latency is None:
+            return None
+
+        elapsed = (
+            time.monotonic() - self.started - self.latency - self._throttled)
+
+        if elapsed <= 0 or not self.received:
+            return None
+
+        return self.received / elapsed
+
+    def __call__(self, i, chunk_size, total):
+        now = time.monotonic()
+
+        if self.latency is None:
+            self.latency = now - self.started
+            self._window_started = now
+
+        self.received += chunk_size
+        self._window_received += chunk_size
+
+        if self.reporthook is not None:
+            self.reporthook(i, chunk_size, total)
+
+        self._check_throughput(now)
+
+        if self.throttle is not None:
+            waited = self.throttle(chunk_size)
+            self._throttled += waited
+            self._window_throttled += waited
+
+    def _check_throughput(self, now):
+        elapsed = now - self._window_started - self._window_throttled
+
+        if (self.min_throughput is None or elapsed <= 0
+                or elapsed < self.window):
+            return
+
+        throughput = self._window_received / elapsed
+
+        if throughput < self.min_throughput:
+            raise SlowMirror(
+                'Throughput fell to {:.0f} bytes/s'.format(throughput))
+
+        self._window_started = now
+        self._window_received = 0
+        self._window_throttled = 0
@@ -0,0 +1,196 @@
+"""A content-addressed cache for downloaded packages
+
+Each package is stored once, under its sha256 checksum, in the 'objects'
+folder. The '{id}-{version}' names the rest of the catalog code knows about
+are symbolic links to those objects, so that identical archives published
+under different ids are only stored (and downloaded) once.
+
+The cache can be given a disk quota. When it is exceeded, the least recently
+used objects are evicted, except those we must keep, e.g the packages which
+are currently installed: they are needed to reinstall them, and as seeds for
+delta upgrades.
+"""
+import os
+import shutil
+
+from . import statefile
+
+
+class PackageCache:
+    def __init__(self, root, quota=None):
+        self.root = root
+        self.quota = quota
+
+        self._objects = os.path.join(root, 'objects')
+        os.makedirs(self._objects, exist_ok=True)
+
+        self._stats_path = os.path.join(root, 'stats.yml')
+
+    def get_object_path(self, sha256sum):
+        return os.path.join(self._objects, sha256sum)
+
+    def _get_alias_path(self, package):
+        return os.path.join(self.root, '{0.id}-{0.version}'.format(package))
+
+    def _link(self, package, sha256sum):
+        alias = self._get_alias_path(package)
+        target = os.path.join('objects', sha256sum)
+
+        if os.path.islink(alias) and os.readlink(alias) == target:
+            return alias
+
+        if os.path.lexists(alias):
+            os.unlink(alias)
+
+        os.symlink(target, alias)
+        return alias
+
+    def _touch(self, sha256sum):
+        # Access times are unreliable (noatime, relatime), so we track the
+        # last use of an object with its modification time instead
+        os.utime(self.get_object_path(sha256sum))
+
+    def _load_stats(self):
+        return statefile.load(self._stats_path) or {'hits': 0, 'misses': 0}
+
+    def _record(self, hit):
+        # The peer server and the catalog workers all record their requests
+        with statefile.locked(self._stats_path):
+            stats = self._load_stats()
+            stats['hits' if hit else 'misses'] += 1
+            statefile.save(self._stats_path, stats)
+
+    def _list_objects(self):
+        objects = []
+
+        for name in os.listdir(self._objects):
+            stat = os.stat(self.get_object_path(name))
+            objects.append((name, stat.st_size, stat.st_mtime))
+
+        return objects
+
+    def _list_aliases(self, sha256sum):
+        aliases = []
+
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+
+            if (os.path.islink(path)
+                    and os.path.basename(os.readlink(path)) == sha256sum):
+                aliases.append(path)
+
+        return aliases
+
+    def get(self, package, record=True):
+        """Get the path to the package, if we have it
+
+        Objects were verified when they were added to the cache, so they are
+        not verified again.
+        """
+        sha256sum = package.sha256sum
+        found = os.path.isfile(self.get_object_path(sha256sum))
+
+        if record:
+            self._record(hit=found)
+
+        if not found:
+            alias = self._get_alias_path(package)
+
+            if os.path.islink(alias):
+                # Its object was evicted, don't let anybody write through it
+                os.unlink(alias)
+
+            return None
+
+        self._touch(sha256sum)
+        return self._link(package, sha256sum)
+
+    def add(self, package, path):
+        """Add a downloaded package to the cache
+
+        The file at path must already have been verified. It is moved to the
+        cache, and the path to the package in the cache is returned.
+        """
+        sha256sum = package.sha256sum
+        object_path = self.get_object_path(sha256sum)
+
+        if os.path.isfile(object_path):
+            # We already had the same content under another name
+            if os.path.realpath(path) != object_path:
+                os.unlink(path)
+
+        else:
+            os.rename(path, object_path)
+
+        self._touch(sha256sum)
+        return self._link(package, sha256sum)
+
+    def remove(self, sha256sum):
+        for alias in self._list_aliases(sha256sum):
+            os.unlink(alias)
+
+        os.unlink(self.get_object_path(sha256sum))
+
+    def evict(self, keep=()):
+        """Evict the least recently used objects until we are within quota
+
+        Objects in keep are never evicted. Returns the evicted checksums.
+        """
+        if self.quota is None:
+            return []
+
+        objects = self._list_objects()
+        total = sum(size for _, size, _ in objects)
+        evicted = []
+
+        for sha256sum, size, _ in sorted(objects, key=lambda o: o[2]):
+            if total <= self.quota:
+                break
+
+            if sha256sum in keep:
+                continue
+
+            self.remove(sha256sum)
+            total -= size
+            evicted.append(sha256sum)
+
+        return evicted
+
+    def clear(self, keep=()):
+        """Remove everything from the cache, except the objects in keep"""
+        keep_paths = {
+            self._objects, self._stats_path,
+            statefile.get_lock_path(self._stats_path)}
+
+        for sha256sum in keep:
+            keep_paths.update(self._list_aliases(sha256sum))
+
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+
+            if path in keep_paths:
+                continue
+
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+
+            else:
+                os.unlink(path)
+
+        for sha256sum, _, _ in self._list_objects():
+            if sha256sum not in keep:
+                os.unlink(self.get_object_path(sha256sum))
+
+    def get_stats(self, keep=()):
+        stats = self._load_stats()
+        objects = self._list_objects()
+        requests = stats['hits'] + stats['misses']
+
+        stats['objects'] = len(objects)
+        stats['size'] = sum(size for _, size, _ in objects)
+        stats['reclaimable'] = sum(
+            size for sha256sum, size, _ in objects if sha256sum not in keep)
+        stats['hit_rate'] = stats['hits'] / requests if requests else None
+        stats['quota'] = self.quota
+
+        return stats
@@ -0,0 +1,105 @@
+"""Share the package cache with the other boxes on the LAN
+
+Packages in the cache are stored under their sha256 checksum, which is also
+how they are published here: a box serving its cache answers requests for
+/packages/<sha256sum>, and other boxes can try it before downloading a
+package from the internet.
+
+Peers are not trusted: what they send is always verified against the
+checksum in the catalog.
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import os
+import re
+from socketserver import ThreadingMixIn
+
+
+DEFAULT_PORT = 8090
+
+OBJECT_PATH = re.compile(r'^/packages/([0-9a-f]{64})$')
+BYTE_RANGE = re.compile(r'^bytes=(\d+)-(\d*)$')
+
+
+def get_package_url(peer, sha256sum):
+    return '{}/packages/{}'.format(peer.rstrip('/'), sha256sum)
+
+
+class PackageRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'ideascube-package-cache'
+
+    def send_head(self):
+        match = OBJECT_PATH.match(self.path)
+
+        if match is None:
+            self.send_error(404)
+            return None, 0
+
+        path = self.server.cache.get_object_path(match.group(1))
+
+        try:
+            f = open(path, 'rb')
+
+        except FileNotFoundError:
+            self.send_error(404)
+            return None, 0
+
+        size = os.fstat(f.fileno()).st_size
+        start, end = 0, size - 1
+        match = BYTE_RANGE.match(self.headers.get('Range', ''))
+
+        if match is not None:
+            start = int(match.group(1))
+
+            if match.group(2):
+                end = min(int(match.group(2)), end)
+
+            if start >= size or end < start:
+                # That's how resumable knows the download was complete
+                f.close()
+                self.send_error(416)
+                return None, 0
+
+            self.send_response(206)
+            self.send_header(
+                'Content-Range', 'bytes {}-{}/{}'.format(start, end, size))
+
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+
+        f.seek(start)
+        return f, end - start + 1
+
+    def do_HEAD(self):
+        f, _ = self.send_head()
+
+        if f is not None:
+            f.close()
+
+    def do_GET(self):
+        f, length = self.send_head()
+
+        if f is None:
+            return
+
+        with f:
+            while length > 0:
+                data = f.read(min(length, 65536))
+
+                if not data:
+                    break
+
+                self.wfile.write(data)
+                length -= len(data)
+
+
+class PackageCacheServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, cache):
+        super().__init__(address, PackageRequestHandler)
+        self.cache = cache
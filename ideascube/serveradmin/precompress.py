@@ -0,0 +1,87 @@
+"""Compress the files of static sites once, when they are installed
+
+With gzip_static, nginx serves the '.gz' sibling of a file when there is one
+and the client accepts it, instead of compressing the file again for every
+request, which is expensive on the low-power boxes.
+
+zlib releases the GIL while it compresses, so the files are compressed in a
+pool of threads.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import zlib
+
+
+COMPRESSIBLE_EXTENSIONS = {
+    '.css', '.csv', '.htm', '.html', '.js', '.json', '.map', '.md', '.svg',
+    '.txt', '.xhtml', '.xml',
+}
+
+# Smaller files are not worth it, the headers would weigh more than the gain
+MIN_SIZE = 1024
+
+
+def is_compressible(path):
+    return os.path.splitext(path)[1].lower() in COMPRESSIBLE_EXTENSIONS
+
+
+def compress_file(path, level=9):
+    """Write the compressed version of the file next to it
+
+    The compressed file is only kept if it is actually smaller. Returns
+    whether it was kept.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    # wbits=31 makes a gzip stream instead of a zlib one
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    compressed = compressor.compress(data) + compressor.flush()
+
+    if len(compressed) >= len(data):
+        return False
+
+    gzpath = '{}.gz'.format(path)
+    tmppath = '{}.tmp'.format(gzpath)
+
+    with open(tmppath, 'wb') as f:
+        f.write(compressed)
+
+    # nginx does not care, but other tools expect both to be the same age
+    stat = os.stat(path)
+    os.utime(tmppath, (stat.st_atime, stat.st_mtime))
+    os.rename(tmppath, gzpath)
+
+    return True
+
+
+def list_compressible_files(root):
+    for dirpath, _, filenames in os.walk(root):
+        names = set(filenames)
+
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+
+            if (not is_compressible(name)
+                    or '{}.gz'.format(name) in names
+                    or os.path.islink(path)
+                    or os.path.getsize(path) < MIN_SIZE):
+                continue
+
+            yield path
+
+
+def precompress(root, level=9, workers=None):
+    """Compress all the compressible files in root
+
+    Returns how many compressed files were written.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            lambda path: compress_file(path, level=level),
+            list_compressible_files(root))
+
+        return sum(results)
@@ -0,0 +1,235 @@
+"""Parallel segmented downloads
+
+Over high-latency links, a single TCP connection can not use all the
+available bandwidth. For big files, we split the download in segments which
+are fetched concurrently with HTTP Range requests, each of them writing at
+its own offset in a preallocated (sparse) file.
+
+The progress of each segment is saved regularly next to the partial file, so
+that an interrupted download only needs to fetch what is missing.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from hashlib import sha256
+import os
+import threading
+
+import requests
+from resumable import DownloadCheck, DownloadError
+import yaml
+
+
+# Save the state of the download every time a segment got that much data
+CHECKPOINT_SIZE = 16 * 1024 * 1024
+
+# In seconds, for connecting and between two chunks, not to hang forever
+TIMEOUT = 60
+
+
+def get_size(url):
+    """Get the size of the file at url
+
+    Returns None if the server does not support Range requests for it, as we
+    can't download it in segments anyway.
+    """
+    with closing(requests.head(
+            url, allow_redirects=True, timeout=TIMEOUT)) as resp:
+        if resp.status_code != 200:
+            return None
+
+        if resp.headers.get('Accept-Ranges') != 'bytes':
+            return None
+
+        try:
+            return int(resp.headers['Content-Length'])
+
+        except (KeyError, ValueError):
+            return None
+
+
+def split(size, count):
+    """Split size bytes in count segments of [start, end, done] bytes"""
+    length = size // count
+    segments = []
+
+    for i in range(count):
+        start = i * length
+        end = size if i == count - 1 else start + length
+        segments.append([start, end, 0])
+
+    return segments
+
+
+class Download:
+    def __init__(self, url, path, size, segments, throttle=None):
+        self.url = url
+        self.path = path
+        self.size = size
+        self.throttle = throttle
+
+        self._tmppath = '{}.part'.format(path)
+        self._statepath = '{}.segments'.format(path)
+        self._lock = threading.Lock()
+        self._progress = None
+
+        self.segments = self._load_state(segments)
+
+        # What each segment wrote and synced to the disk, by start offset
+        self._synced = {start: done for start, _, done in self.segments}
+
+    @property
+    def done(self):
+        return sum(done for _, _, done in self.segments)
+
+    def _load_state(self, count):
+        try:
+            with open(self._statepath, 'r') as f:
+                state = yaml.safe_load(f.read())
+
+        except FileNotFoundError:
+            state = None
+
+        # The url may have changed, when the download is resumed from another
+        # mirror. They all serve the same file, and we verify it at the end.
+        if (state is not None and os.path.isfile(self._tmppath)
+                and state.get('size') == self.size):
+            return state['segments']
+
+        # Start from scratch, with a preallocated sparse file
+        with open(self._tmppath, 'wb') as f:
+            f.truncate(self.size)
+
+        return split(self.size, count)
+
+    def _save_state(self):
+        # Only record what actually made it to the disk, in all the segments
+        segments = [[start, end, self._synced[start]]
+                    for start, end, _ in self.segments]
+        state = {'url': self.url, 'size': self.size, 'segments': segments}
+        tmpstate = '{}.tmp'.format(self._statepath)
+
+        with open(tmpstate, 'w') as f:
+            f.write(yaml.safe_dump(state, default_flow_style=False))
+
+        os.rename(tmpstate, self._statepath)
+
+    def _fetch_segment(self, segment):
+        start, end, done = segment
+
+        if start + done >= end:
+            return
+
+        headers = {'Range': 'bytes={}-{}'.format(start + done, end - 1)}
+
+        with open(self._tmppath, 'r+b') as f, closing(requests.get(
+                self.url, headers=headers, stream=True,
+                timeout=TIMEOUT)) as resp:
+            if resp.status_code != 206:
+                raise DownloadError(
+                    'Range requests are not supported for {}'.format(
+                        self.url))
+
+            f.seek(start + done)
+            unsaved = 0
+
+            try:
+                for chunk in resp.iter_content(chunk_size=65536):
+                    chunk = chunk[:end - start - segment[2]]
+
+                    if not chunk:
+                        break
+
+                    f.write(chunk)
+                    unsaved += len(chunk)
+
+                    with self._lock:
+                        segment[2] += len(chunk)
+
+                        if self._progress is not None:
+                            self._progress(self.done, self.size)
+
+                    if unsaved >= CHECKPOINT_SIZE:
+                        f.flush()
+                        os.fsync(f.fileno())
+                        unsaved = 0
+
+                        with self._lock:
+                            self._synced[start] = segment[2]
+                            self._save_state()
+
+                    if self.throttle is not None:
+                        self.throttle(len(chunk))
+
+            finally:
+                # Whatever happened, keep what we got for the next attempt
+                f.flush()
+                os.fsync(f.fileno())
+
+                with self._lock:
+                    self._synced[start] = segment[2]
+                    self._save_state()
+
+        if start + segment[2] < end:
+            raise DownloadError(DownloadCheck.size_mismatch)
+
+    def run(self, sha256sum, progress=None):
+        self._progress = progress
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(self.segments)) as ex:
+                # Consume the results, to raise any exception which happened
+                list(ex.map(self._fetch_segment, self.segments))
+
+        except requests.exceptions.RequestException as e:
+            # Keep the partial download, we'll resume it next time
+            raise DownloadError(e)
+
+        sha = sha256()
+
+        with open(self._tmppath, 'rb') as f:
+            while True:
+                data = f.read(8388608)
+
+                if not data:
+                    break
+
+                sha.update(data)
+
+        try:
+            os.unlink(self._statepath)
+
+        except FileNotFoundError:
+            pass
+
+        if sha.hexdigest() != sha256sum:
+            os.unlink(self._tmppath)
+            raise DownloadError(DownloadCheck.checksum_mismatch)
+
+        os.rename(self._tmppath, self.path)
+
+
+def is_partial(path):
+    """Whether there is an interrupted segmented download for path"""
+    return os.path.isfile('{}.segments'.format(path))
+
+
+def discard(path):
+    """Remove what is left of an interrupted segmented download for path"""
+    for leftover in ('{}.part', '{}.segments'):
+        try:
+            os.unlink(leftover.format(path))
+
+        except FileNotFoundError:
+            pass
+
+
+def urlretrieve(url, path, size, sha256sum, segments=4, progress=None,
+                throttle=None):
+    """Download url to path, in segments fetched concurrently
+
+    The download resumes where it was interrupted, if it was. If given,
+    throttle is called with the size of each chunk received, and can wait to
+    slow the download down.
+    """
+    download = Download(url, path, size, segments, throttle=throttle)
+    download.run(sha256sum, progress=progress)
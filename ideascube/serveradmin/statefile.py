@@ -0,0 +1,55 @@
+"""Small YAML files holding state shared between processes
+
+Catalog workers, background jobs and the peer server can all update the same
+state files at the same time. Updates are serialized with a lock file next to
+the state file, and written to a temporary file which is then renamed over
+the previous one, so that readers never see a truncated file.
+"""
+from contextlib import contextmanager
+import fcntl
+import os
+import tempfile
+
+import yaml
+
+
+def get_lock_path(path):
+    return '{}.lock'.format(path)
+
+
+@contextmanager
+def locked(path):
+    """Hold the lock of the state file at path, waiting for it if needed"""
+    with open(get_lock_path(path), 'w') as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        yield
+
+
+def load(path):
+    try:
+        with open(path, 'r') as f:
+            return yaml.safe_load(f.read())
+
+    except FileNotFoundError:
+        return None
+
+
+def save(path, data):
+    """Replace the content of the state file at path
+
+    The caller should be holding its lock, if other processes can update it.
+    """
+    directory, name = os.path.split(path)
+    fd, tmppath = tempfile.mkstemp(dir=directory, prefix='.{}.'.format(name))
+
+    try:
+        with open(fd, 'w') as f:
+            # Like a file created with open(), not private as with mkstemp
+            os.fchmod(f.fileno(), 0o644)
+            f.write(yaml.safe_dump(data, default_flow_style=False))
+
+        os.replace(tmppath, path)
+
+    except Exception:
+        os.unlink(tmppath)
+        raise
@@ -33,6 +33,9 @@ class Manager(object):
     def restart(self, unit_id):
         systemctl('restart', unit_id)
 
+    def reload(self, unit_id):
+        systemctl('reload', unit_id)
+
 
 class Unit(object):
     def __init__(self, path):
@@ -65,6 +68,10 @@ class Unit(object):
     def active(self):
         return self.ActiveState == 'active'
 
+    @property
+    def can_reload(self):
+        return self.CanReload
+
 
 class NoSuchUnit(Exception):
     pass
@@ -78,6 +85,9 @@ def dbus_to_python(obj):
     if isinstance(obj, dbus.String):
         return str(obj)
 
+    if isinstance(obj, dbus.Boolean):
+        return bool(obj)
+
     # Add support for other DBus types as we need them
     raise ValueError("Can't handle value: %r" % obj)
 
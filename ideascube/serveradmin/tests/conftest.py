@@ -1,5 +1,9 @@
-import pytest
+from http.server import BaseHTTPRequestHandler, HTTPServer
 import os
+import re
+import threading
+
+import pytest
 
 from ..backup import Backup
 
@@ -41,3 +45,105 @@ def csv_writer():
     if os.path.exists(CSV_PATH):
         os.remove(CSV_PATH)
 
+
+class RangeHTTPRequestHandler(BaseHTTPRequestHandler):
+    """Serve files from the server root, honouring Range requests"""
+    def send_head(self):
+        self.server.requests.append(
+            (self.command, self.path, self.headers.get('Range')))
+        path = os.path.join(self.server.root.strpath, self.path.lstrip('/'))
+
+        try:
+            f = open(path, 'rb')
+
+        except FileNotFoundError:
+            self.send_error(404)
+            return None, 0
+
+        size = os.fstat(f.fileno()).st_size
+        start, end = 0, size - 1
+        byterange = self.headers.get('Range')
+
+        if byterange is not None:
+            match = re.fullmatch(r'bytes=(\d+)-(\d*)', byterange)
+            start = int(match.group(1))
+
+            if match.group(2):
+                end = min(int(match.group(2)), end)
+
+            if start >= size:
+                f.close()
+                self.send_error(416)
+                return None, 0
+
+            self.send_response(206)
+            self.send_header(
+                'Content-Range', 'bytes {}-{}/{}'.format(start, end, size))
+
+        else:
+            self.send_response(200)
+
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+
+        f.seek(start)
+        return f, end - start + 1
+
+    def do_HEAD(self):
+        f, _ = self.send_head()
+
+        if f is not None:
+            f.close()
+
+    def do_GET(self):
+        f, length = self.send_head()
+
+        if f is not None:
+            if self.path.startswith(tuple(self.server.dying)):
+                # Die right before the end of the transfer
+                length -= 1024
+                self.close_connection = True
+
+            with f:
+                self.wfile.write(f.read(length))
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.yield_fixture()
+def http_server(tmpdir):
+    server = HTTPServer(('127.0.0.1', 0), RangeHTTPRequestHandler)
+    server.root = tmpdir.mkdir('http')
+    server.url = 'http://127.0.0.1:{}/'.format(server.server_port)
+    server.requests = []
+    server.dying = []
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.yield_fixture()
+def peer_server(tmpdir):
+    from ideascube.serveradmin.packagecache import PackageCache
+    from ideascube.serveradmin.peers import PackageCacheServer
+
+    cache = PackageCache(tmpdir.mkdir('peer').strpath)
+    server = PackageCacheServer(('127.0.0.1', 0), cache)
+    server.url = 'http://127.0.0.1:{}/'.format(server.server_port)
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
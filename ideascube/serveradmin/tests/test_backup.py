@@ -58,6 +58,7 @@ def test_list(monkeypatch, settings):
     ('bztar', '.tar.bz2'),
     ('gztar', '.tar.gz'),
 ])
+@pytest.mark.django_db
 @pytest.mark.usefixtures('backup_root')
 def test_create_tarfile(monkeypatch, settings, format, extension):
     filename = 'edoardo-0.0.0-201501231405' + extension
@@ -103,6 +104,7 @@ def test_create_zipfile_must_fail(monkeypatch, tmpdir):
     ('.tar.gz'),
     ('.tar.bz2'),
 ])
+@pytest.mark.django_db
 def test_restore(monkeypatch, settings, extension):
     monkeypatch.setattr('ideascube.serveradmin.backup.Backup.ROOT', DATA_ROOT)
     dbpath = os.path.join(settings.BACKUPED_ROOT, 'default.sqlite')
@@ -114,6 +116,76 @@ def test_restore(monkeypatch, settings, extension):
     os.remove(dbpath)
 
 
+@pytest.mark.django_db
+def test_create_fails_if_the_database_stays_busy(
+        monkeypatch, settings, tmpdir):
+    backups = tmpdir.mkdir('backups')
+    monkeypatch.setattr('ideascube.serveradmin.backup.Backup.ROOT',
+                        backups.strpath)
+    dbpath = os.path.join(settings.BACKUPED_ROOT, 'default.sqlite')
+    monkeypatch.setattr(
+        'ideascube.serveradmin.backup.get_database_path', lambda: dbpath)
+    monkeypatch.setattr(
+        'ideascube.serveradmin.backup.checkpoint',
+        lambda connection, mode: (1, 10, 5))
+    monkeypatch.setattr('ideascube.serveradmin.backup.time.sleep',
+                        lambda seconds: None)
+
+    with open(dbpath + '-wal', 'w') as f:
+        f.write('uncheckpointed transactions')
+
+    with pytest.raises(RuntimeError):
+        Backup.create()
+
+    assert backups.listdir() == []
+
+
+@pytest.mark.django_db
+def test_restore_removes_the_write_ahead_log(monkeypatch, settings):
+    monkeypatch.setattr('ideascube.serveradmin.backup.Backup.ROOT', DATA_ROOT)
+    dbpath = os.path.join(settings.BACKUPED_ROOT, 'default.sqlite')
+    monkeypatch.setattr(
+        'ideascube.serveradmin.backup.get_database_path', lambda: dbpath)
+
+    for suffix in ('', '-wal', '-shm'):
+        with open(dbpath + suffix, 'w') as f:
+            f.write('current')
+
+    backup = Backup('musasa-0.1.0-201501241620.tar')
+    backup.restore()
+
+    with open(dbpath, 'rb') as f:
+        assert f.read(6) == b'SQLite'
+
+    assert not os.path.exists(dbpath + '-wal')
+    assert not os.path.exists(dbpath + '-shm')
+
+
+@pytest.mark.django_db
+def test_restore_invalidates_the_caches(monkeypatch, settings, user):
+    from ideascube import fragments
+    from ideascube.configuration import get_config, set_config
+    from ideascube.configuration.models import Configuration
+
+    monkeypatch.setattr('ideascube.serveradmin.backup.Backup.ROOT', DATA_ROOT)
+    monkeypatch.setattr(
+        'ideascube.serveradmin.backup.get_database_path', lambda: None)
+
+    set_config('server', 'site-name', 'Before', user)
+    assert get_config('server', 'site-name') == 'Before'
+    version = fragments.get_versions(['library.book'])
+
+    # As if the restored database had another value, without any signal
+    Configuration.objects.update(value='After')
+
+    backup = Backup('musasa-0.1.0-201501241620.tar')
+    backup.restore()
+    os.remove(os.path.join(settings.BACKUPED_ROOT, 'default.sqlite'))
+
+    assert get_config('server', 'site-name') == 'After'
+    assert fragments.get_versions(['library.book']) != version
+
+
 @pytest.mark.parametrize('extension', [
     ('.zip'),
     ('.tar'),
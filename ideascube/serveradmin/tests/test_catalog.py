@@ -5,6 +5,7 @@ import zipfile
 from py.path import local as Path
 import pytest
 from resumable import DownloadCheck, DownloadError
+import yaml
 
 from ideascube.mediacenter.models import Document
 
@@ -83,7 +84,8 @@ def install_dir(tmpdir):
 # This is starting to look a lot like adding file:// support to
 # resumable.urlretrieve...
 # TODO: Do they want it upstream?
-def fake_urlretrieve(url, path, reporthook=None, sha256sum=None):
+def fake_urlretrieve(
+        url, path, reporthook=None, sha256sum=None, headers=None):
     assert url.startswith('file://')
 
     src = url[7:]
@@ -107,6 +109,8 @@ def fake_urlretrieve(url, path, reporthook=None, sha256sum=None):
         if sha256sum != checksum:
             raise DownloadError(DownloadCheck.checksum_mismatch)
 
+    return {}
+
 
 def test_remote_from_file(input_file):
     from ideascube.serveradmin.catalog import InvalidFile, Remote
@@ -307,6 +311,50 @@ def test_remove_zippedzim(zippedzim_path, install_dir):
     assert index.join('{}.zim.idx'.format(p.id)).check(exists=False)
 
 
+def test_upgrade_zippedzim(tmpdir, testdatadir, zippedzim_path, install_dir):
+    from ideascube.serveradmin.catalog import ZippedZim
+
+    old = ZippedZim('wikipedia.tum', {'version': '2015-08'})
+    old.install(zippedzim_path.strpath, install_dir.strpath)
+
+    # Pretend the previous version had a file the new one doesn't have
+    data = install_dir.join('data')
+    data.join('content', 'wikipedia.tum.zimaa').write('')
+
+    path = tmpdir.join('wikipedia.tum-2015-09')
+    testdatadir.join('catalog', 'wikipedia.tum-2015-09').copy(path)
+    new = ZippedZim('wikipedia.tum', {'version': '2015-09'})
+    new.upgrade(old, path.strpath, install_dir.strpath)
+
+    assert sorted(p.basename for p in install_dir.listdir()) == ['data']
+    assert data.join('content', 'wikipedia.tum.zim').check(file=True)
+    assert data.join('content', 'wikipedia.tum.zimaa').check(exists=False)
+    assert data.join('index', 'wikipedia.tum.zim.idx').check(dir=True)
+    assert 'date="2015-09-10"' in data.join(
+        'library', 'wikipedia.tum.zim.xml').read()
+
+
+def test_upgrade_invalid_zippedzim_keeps_previous(
+        tmpdir, testdatadir, zippedzim_path, install_dir):
+    from ideascube.serveradmin.catalog import ZippedZim, InvalidFile
+
+    old = ZippedZim('wikipedia.tum', {'version': '2015-08'})
+    old.install(zippedzim_path.strpath, install_dir.strpath)
+
+    path = tmpdir.join('wikipedia.tum-2015-09')
+    path.write('this is not a zip file')
+    new = ZippedZim('wikipedia.tum', {'version': '2015-09'})
+
+    with pytest.raises(InvalidFile):
+        new.upgrade(old, path.strpath, install_dir.strpath)
+
+    data = install_dir.join('data')
+    assert sorted(p.basename for p in install_dir.listdir()) == ['data']
+    assert data.join('content', 'wikipedia.tum.zim').check(file=True)
+    assert 'date="2015-08-10"' in data.join(
+        'library', 'wikipedia.tum.zim.xml').read()
+
+
 def test_install_staticsite(staticsite_path, install_dir):
     from ideascube.serveradmin.catalog import StaticSite
 
@@ -322,6 +370,27 @@ def test_install_staticsite(staticsite_path, install_dir):
         assert 'static content' in f.read()
 
 
+@pytest.mark.parametrize('enabled', [True, False])
+def test_install_staticsite_precompresses(
+        settings, tmpdir, install_dir, enabled):
+    from ideascube.serveradmin.catalog import StaticSite
+
+    settings.CATALOG_STATIC_SITE_PRECOMPRESS = enabled
+
+    path = tmpdir.join('site.zip')
+
+    with zipfile.ZipFile(path.strpath, 'w') as z:
+        z.writestr('index.html', '<p>static content</p>' * 1000)
+        z.writestr('logo.png', b'\x89PNG' * 1000)
+
+    p = StaticSite('site', {'url': 'https://foo.fr/site.zip'})
+    p.install(path.strpath, install_dir.strpath)
+
+    root = install_dir.join('site')
+    assert root.join('index.html.gz').check(file=True) is enabled
+    assert root.join('logo.png.gz').check(exists=False)
+
+
 def test_remove_staticsite(staticsite_path, install_dir):
     from ideascube.serveradmin.catalog import StaticSite
 
@@ -335,6 +404,22 @@ def test_remove_staticsite(staticsite_path, install_dir):
     assert root.check(exists=False)
 
 
+def test_upgrade_staticsite(staticsite_path, install_dir):
+    from ideascube.serveradmin.catalog import StaticSite
+
+    old = StaticSite('w2eu', {'version': '2016-02-26'})
+    old.install(staticsite_path.strpath, install_dir.strpath)
+    install_dir.join('w2eu', 'removed.html').write('old content')
+
+    new = StaticSite('w2eu', {'version': '2016-02-27'})
+    new.upgrade(old, staticsite_path.strpath, install_dir.strpath)
+
+    root = install_dir.join('w2eu')
+    assert 'static content' in root.join('index.html').read()
+    assert root.join('removed.html').check(exists=False)
+    assert sorted(p.basename for p in install_dir.listdir()) == ['w2eu']
+
+
 @pytest.mark.usefixtures('db')
 def test_install_zippedmedia(zippedmedia_path, install_dir):
     from ideascube.serveradmin.catalog import ZippedMedias
@@ -526,6 +611,88 @@ def test_kiwix_commits_after_remove(settings, zippedzim_path, mocker):
     manager().restart.assert_not_called()
 
 
+@pytest.mark.usefixtures('db', 'systemuser')
+def test_kiwix_commits_incrementally(settings, zippedzim_path, mocker):
+    from ideascube.serveradmin.catalog import Kiwix, ZippedZim
+
+    manager = mocker.patch('ideascube.serveradmin.catalog.SystemManager')
+
+    p = ZippedZim('wikipedia.tum', {
+        'url': 'https://foo.fr/wikipedia_tum_all_nopic_2015-08.zim'})
+    h = Kiwix()
+    h.install(p, zippedzim_path.strpath)
+    h.commit()
+    assert manager().get_service.call_count == 1
+
+    # This was not installed in a transaction, the library does not know it
+    install_root = Path(settings.CATALOG_KIWIX_INSTALL_DIR)
+    libdir = install_root.join('data', 'library')
+    libdir.join('wikipedia.tum.zim.xml').copy(libdir.join('other.zim.xml'))
+
+    # Nothing changed
+    h.commit()
+    assert manager().get_service.call_count == 1
+
+    h.remove(p)
+    h.commit()
+    assert manager().get_service.call_count == 2
+
+    library = install_root.join('library.xml')
+    assert library.read_text('utf-8') == (
+        "<?xml version='1.0' encoding='utf-8'?>\n<library/>")
+
+    # A full rebuild happens when there is no library
+    library.remove()
+    h.commit()
+
+    assert 'path="data/content/other.zim"' in library.read_text('utf-8')
+    assert manager().get_service.call_count == 3
+    assert install_root.join('library.xml.tmp').check(exists=False)
+
+
+@pytest.mark.usefixtures('db', 'systemuser')
+@pytest.mark.parametrize('can_reload', [True, False])
+def test_kiwix_reloads_service(settings, zippedzim_path, mocker, can_reload):
+    from ideascube.serveradmin.catalog import Kiwix, ZippedZim
+
+    manager = mocker.patch('ideascube.serveradmin.catalog.SystemManager')
+    manager().get_service().can_reload = can_reload
+    manager().get_service().Id = 'kiwix-server.service'
+
+    p = ZippedZim('wikipedia.tum', {
+        'url': 'https://foo.fr/wikipedia_tum_all_nopic_2015-08.zim'})
+    h = Kiwix()
+    h.install(p, zippedzim_path.strpath)
+    h.commit()
+
+    if can_reload:
+        manager().reload.assert_called_once_with('kiwix-server.service')
+        manager().restart.assert_not_called()
+
+    else:
+        manager().restart.assert_called_once_with('kiwix-server.service')
+        manager().reload.assert_not_called()
+
+
+@pytest.mark.usefixtures('db', 'systemuser')
+def test_kiwix_monitors_library(settings, zippedzim_path, mocker):
+    from ideascube.serveradmin.catalog import Kiwix, ZippedZim
+
+    settings.CATALOG_KIWIX_MONITORS_LIBRARY = True
+    manager = mocker.patch('ideascube.serveradmin.catalog.SystemManager')
+
+    p = ZippedZim('wikipedia.tum', {
+        'url': 'https://foo.fr/wikipedia_tum_all_nopic_2015-08.zim'})
+    h = Kiwix()
+    h.install(p, zippedzim_path.strpath)
+    h.commit()
+
+    install_root = Path(settings.CATALOG_KIWIX_INSTALL_DIR)
+    assert 'path="data/content/wikipedia.tum.zim"' in install_root.join(
+        'library.xml').read_text('utf-8')
+    manager().get_service.assert_not_called()
+
+
 def test_nginx_installs_zippedzim(settings, staticsite_path):
     from ideascube.serveradmin.catalog import Nginx, StaticSite
 
@@ -573,6 +740,7 @@ def test_nginx_commits_after_install(settings, staticsite_path, mocker):
     available_dir = root.mkdir('sites-available')
     enabled_dir = root.mkdir('sites-enabled')
 
+    settings.CATALOG_NGINX_TEST_COMMAND = ['true']
     manager = mocker.patch('ideascube.serveradmin.catalog.SystemManager')
 
     p = StaticSite('w2eu', {
@@ -583,13 +751,141 @@ def test_nginx_commits_after_install(settings, staticsite_path, mocker):
 
     conffile = available_dir.join('w2eu')
     with conffile.open() as f:
-        assert 'server_name w2eu.' in f.read()
+        config = f.read()
+        assert 'server_name w2eu.' in config
+        assert 'gzip_static on;' in config
     symlink = enabled_dir.join('w2eu')
     assert symlink.check(exists=True)
     assert symlink.realpath() == conffile
 
     manager().get_service.assert_called_once_with('nginx')
-    manager().restart.call_count == 1
+    assert manager().reload.call_count == 1
+    manager().restart.assert_not_called()
+
+
+@pytest.mark.usefixtures('db', 'systemuser')
+def test_nginx_commits_after_upgrade(settings, staticsite_path, mocker):
+    from ideascube.serveradmin.catalog import (
+        Nginx, StaticSite, commit_handlers)
+
+    Nginx.root = os.path.join(settings.STORAGE_ROOT, 'nginx')
+    root = Path(Nginx.root).mkdir()
+    available_dir = root.mkdir('sites-available')
+    enabled_dir = root.mkdir('sites-enabled')
+
+    settings.CATALOG_NGINX_TEST_COMMAND = ['true']
+    manager = mocker.patch('ideascube.serveradmin.catalog.SystemManager')
+
+    old = StaticSite('w2eu', {
+        'url': 'https://foo.fr/w2eu-2016-02-26.zim'})
+    new = StaticSite('w2eu', {
+        'url': 'https://foo.fr/w2eu-2017-01-01.zim'})
+    h = Nginx()
+    h.install(old, staticsite_path.strpath)
+    commit_handlers([h])
+
+    h.upgrade(old, new, staticsite_path.strpath)
+    commit_handlers([h])
+
+    conffile = available_dir.join('w2eu')
+    assert 'server_name w2eu.' in conffile.read()
+    symlink = enabled_dir.join('w2eu')
+    assert symlink.realpath() == conffile
+
+    assert manager().reload.call_count == 2
+    manager().restart.assert_not_called()
+
+
+@pytest.mark.usefixtures('db', 'systemuser')
+def test_nginx_does_not_reload_invalid_config(
+        settings, staticsite_path, mocker, capsys):
+    from ideascube.serveradmin.catalog import Nginx, StaticSite
+
+    Nginx.root = os.path.join(settings.STORAGE_ROOT, 'nginx')
+    root = Path(Nginx.root).mkdir()
+    available_dir = root.mkdir('sites-available')
+    enabled_dir = root.mkdir('sites-enabled')
+    available_dir.join('old').write('old config')
+    enabled_dir.join('old').mksymlinkto(available_dir.join('old'))
+
+    settings.CATALOG_NGINX_TEST_COMMAND = [
+        'sh', '-c', 'echo "invalid directive"; exit 1']
+    manager = mocker.patch('ideascube.serveradmin.catalog.SystemManager')
+
+    old = StaticSite('old', {'url': 'https://foo.fr/old.zim'})
+    new = StaticSite('w2eu', {'url': 'https://foo.fr/w2eu-2016-02-26.zim'})
+    h = Nginx()
+    h.install(new, staticsite_path.strpath)
+    h._removed.append(old)
+    h.commit()
+
+    # nginx keeps running with the previous configuration
+    assert sorted(os.listdir(available_dir.strpath)) == ['old']
+    assert available_dir.join('old').read() == 'old config'
+    assert sorted(os.listdir(enabled_dir.strpath)) == ['old']
+    assert enabled_dir.join('old').realpath() == available_dir.join('old')
+
+    manager().get_service.assert_not_called()
+
+    out, err = capsys.readouterr()
+    assert 'invalid directive' in err
+
+
+@pytest.mark.usefixtures('db', 'systemuser')
+@pytest.mark.parametrize('command, message', [
+    (['sh', '-c',
+      'echo "open() \\"/run/nginx.pid\\" failed (13: Permission denied)"; '
+      'exit 1'],
+     'Permission denied'),
+    (['/no/such/nginx', '-t'], 'No such file or directory'),
+    ], ids=['permission-denied', 'missing-command'])
+def test_nginx_does_not_reload_unchecked_config(
+        settings, staticsite_path, mocker, capsys, command, message):
+    from ideascube.serveradmin.catalog import Nginx, StaticSite
+
+    Nginx.root = os.path.join(settings.STORAGE_ROOT, 'nginx')
+    root = Path(Nginx.root).mkdir()
+    available_dir = root.mkdir('sites-available')
+    enabled_dir = root.mkdir('sites-enabled')
+
+    settings.CATALOG_NGINX_TEST_COMMAND = command
+    manager = mocker.patch('ideascube.serveradmin.catalog.SystemManager')
+
+    p = StaticSite('w2eu', {'url': 'https://foo.fr/w2eu-2016-02-26.zim'})
+    h = Nginx()
+    h.install(p, staticsite_path.strpath)
+    h.commit()
+
+    assert os.listdir(available_dir.strpath) == []
+    assert os.listdir(enabled_dir.strpath) == []
+    manager().get_service.assert_not_called()
+
+    out, err = capsys.readouterr()
+    assert message in err
+
+
+def test_commit_handlers_coalesces_service_reloads(mocker):
+    from ideascube.serveradmin.catalog import Handler, commit_handlers
+
+    manager = mocker.patch('ideascube.serveradmin.catalog.SystemManager')
+    manager().get_service.side_effect = lambda name: mocker.Mock(Id=name)
+
+    class Reloader(Handler):
+        def commit(self):
+            self.reload_service('nginx')
+            self.reload_service('kiwix-server')
+            super().commit()
+
+    class Restarter(Handler):
+        def commit(self):
+            self.restart_service('kiwix-server')
+            self.reload_service('nginx')
+            super().commit()
+
+    commit_handlers([Reloader(), Restarter(), Reloader()])
+
+    manager().reload.assert_called_once_with('nginx')
+    manager().restart.assert_called_once_with('kiwix-server')
 
 
 @pytest.mark.usefixtures('db', 'systemuser')
@@ -602,6 +898,7 @@ def test_nginx_commits_after_remove(settings, staticsite_path, mocker):
     available_dir = root.mkdir('sites-available')
     enabled_dir = root.mkdir('sites-enabled')
 
+    settings.CATALOG_NGINX_TEST_COMMAND = ['true']
     manager = mocker.patch('ideascube.serveradmin.catalog.SystemManager')
     manager().get_service.side_effect = NoSuchUnit
 
@@ -678,6 +975,152 @@ def test_mediacenter_installs_zippedmedia(settings, zippedmedia_path):
         assert dirname == install_root.join('test-media').strpath
 
 
+@pytest.mark.usefixtures('db')
+def test_mediacenter_installs_zippedmedia_in_batches(
+        tmpdir, settings, capsys, zippedmedia_path):
+    from ideascube.serveradmin.catalog import MediaCenter, ZippedMedias
+
+    settings.CATALOG_MEDIA_BATCH_SIZE = 2
+
+    path = tmpdir.join('batched-media.zip')
+    medias = [
+        {'title': 'my video', 'summary': 'video', 'credits': 'BSF',
+         'path': 'a-video.mp4', 'preview': 'an-image.jpg', 'tags': 'tag1'},
+        {'title': 'missing', 'summary': 'missing', 'credits': 'BSF',
+         'path': 'no-such-file.mp4'},
+        {'title': 'my doc', 'summary': 'doc', 'credits': 'BSF',
+         'path': 'a-pdf.pdf', 'tags': 'tag1, tag2'},
+        {'title': 'my image', 'summary': 'image', 'credits': 'BSF',
+         'path': 'an-image.jpg', 'tags': 'tag2'},
+    ]
+
+    with zipfile.ZipFile(zippedmedia_path.strpath) as orig, \
+            zipfile.ZipFile(path.strpath, mode='w') as new:
+        for name in orig.namelist():
+            if name != 'manifest.yml':
+                new.writestr(name, orig.read(name))
+
+        new.writestr('manifest.yml', yaml.safe_dump({'medias': medias}))
+
+    p = ZippedMedias('test-media', {
+        'url': 'https://foo.fr/test-media.zip'})
+    h = MediaCenter()
+    h.install(p, path.strpath)
+
+    _, err = capsys.readouterr()
+    assert 'Cannot install media missing from package test-media' in err
+
+    assert Document.objects.count() == 3
+    video = Document.objects.get(title='my video')
+    assert video.kind == Document.VIDEO
+    assert video.preview.name == 'catalog/test-media/an-image.jpg'
+    assert video.original.name == 'catalog/test-media/a-video.mp4'
+    assert list(video.tags.names()) == ['tag1']
+
+    documents_tag2 = Document.objects.search(tags=['tag2'])
+    assert set(d.title for d in documents_tag2) == {'my doc', 'my image'}
+
+
+@pytest.mark.usefixtures('db')
+def test_mediacenter_batches_stay_below_the_sqlite_limits(
+        settings, mocker, zippedmedia_path):
+    from ideascube.serveradmin.catalog import MediaCenter, ZippedMedias
+
+    settings.CATALOG_MEDIA_BATCH_SIZE = 5000
+    mocker.patch('ideascube.serveradmin.catalog.MAX_MEDIA_BATCH_SIZE', 2)
+    spy = mocker.spy(Document.objects, 'bulk_create_with_tags')
+
+    p = ZippedMedias('test-media', {
+        'url': 'https://foo.fr/test-media.zip'})
+    MediaCenter().install(p, zippedmedia_path.strpath)
+
+    assert Document.objects.count() == 3
+    assert [len(c[0][0]) for c in spy.call_args_list] == [2, 1]
+
+
+@pytest.mark.usefixtures('db')
+def test_mediacenter_does_not_hide_bugs(mocker, zippedmedia_path):
+    from ideascube.serveradmin.catalog import MediaCenter, ZippedMedias
+
+    mocker.patch(
+        'ideascube.serveradmin.catalog.ZippedMedias._install_media',
+        side_effect=TypeError('Oops'))
+
+    p = ZippedMedias('test-media', {
+        'url': 'https://foo.fr/test-media.zip'})
+
+    with pytest.raises(TypeError):
+        MediaCenter().install(p, zippedmedia_path.strpath)
+
+
+@pytest.mark.usefixtures('db', 'cleansearch')
+def test_upgrade_zippedmedia(tmpdir, settings, mocker, zippedmedia_path):
+    from ideascube.search.models import Search
+    from ideascube.serveradmin import zipextract
+    from ideascube.serveradmin.catalog import ZippedMedias
+
+    install_dir = Path(settings.CATALOG_MEDIACENTER_INSTALL_DIR)
+
+    old = ZippedMedias('test-media', {'version': '1'})
+    old.install(zippedmedia_path.strpath, install_dir.strpath)
+
+    video = Document.objects.get(title='my video')
+    doc = Document.objects.get(title='my doc')
+    image = Document.objects.get(title='my image')
+
+    with zipfile.ZipFile(zippedmedia_path.strpath) as z:
+        medias = yaml.safe_load(z.read('manifest.yml'))['medias']
+        video_content = z.read('a-video.mp4')
+        pdf_content = z.read('a-pdf.pdf')
+
+    # The video does not change, the doc gets a new summary, the image is
+    # removed and a new doc is added
+    medias[1]['summary'] = 'updated summary'
+    medias[2] = {
+        'title': 'my new doc', 'summary': 'new', 'credits': 'BSF',
+        'path': 'a-new.pdf', 'kind': 'pdf', 'tags': 'tag5'}
+
+    path = tmpdir.join('test-media-2.zip')
+
+    with zipfile.ZipFile(path.strpath, mode='w') as z:
+        z.writestr('manifest.yml', yaml.safe_dump({'medias': medias}))
+        z.writestr('a-video.mp4', video_content)
+        z.writestr('a-pdf.pdf', pdf_content)
+        z.writestr('a-new.pdf', b'new pdf')
+
+    spy_index = mocker.spy(Document, 'index')
+    spy_extract = mocker.spy(zipextract, 'extractall')
+
+    new = ZippedMedias('test-media', {'version': '2'})
+    new.upgrade(old, path.strpath, install_dir.strpath)
+
+    root = install_dir.join('test-media')
+    assert sorted(p.basename for p in root.listdir()) == [
+        'a-new.pdf', 'a-pdf.pdf', 'a-video.mp4', 'manifest.yml']
+    assert sorted(
+        info.filename for info in spy_extract.call_args[1]['members']) == [
+        'a-new.pdf', 'manifest.yml']
+
+    assert Document.objects.count() == 3
+    assert Document.objects.get(id=video.id).modified_at == video.modified_at
+    assert Document.objects.get(id=doc.id).summary == 'updated summary'
+    assert not Document.objects.filter(id=image.id).exists()
+
+    new_doc = Document.objects.get(title='my new doc')
+    assert new_doc.original.name == 'catalog/test-media/a-new.pdf'
+    assert list(new_doc.tags.names()) == ['tag5']
+    assert list(Document.objects.get(id=doc.id).tags.names()) == [
+        'tag1', 'tag4']
+
+    assert spy_index.call_count == 0
+    assert Search.objects.count() == 3
+    assert set(Document.objects.search('updated')) == {
+        Document.objects.get(id=doc.id)}
+    assert set(Document.objects.search(tags=['tag5'])) == {new_doc}
+    assert set(d.title for d in Document.objects.search(tags=['tag2'])) == {
+        'my video'}
+
+
 @pytest.mark.usefixtures('db')
 def test_mediacenter_removes_zippedmedia(tmpdir, settings, zippedmedia_path):
     from ideascube.serveradmin.catalog import MediaCenter, ZippedMedias
@@ -745,129 +1188,707 @@ def test_catalog_add_remotes():
     assert remote.name == 'Content provided by Foo'
     assert remote.url == 'http://foo.fr/catalog.yml'
 
-    c.add_remote('bar', 'Content provided by Bar', 'http://bar.fr/catalog.yml')
-    remotes = c.list_remotes()
-    assert len(remotes) == 2
+    c.add_remote('bar', 'Content provided by Bar', 'http://bar.fr/catalog.yml')
+    remotes = c.list_remotes()
+    assert len(remotes) == 2
+
+    remote = remotes[0]
+    assert remote.id == 'bar'
+    assert remote.name == 'Content provided by Bar'
+    assert remote.url == 'http://bar.fr/catalog.yml'
+
+    remote = remotes[1]
+    assert remote.id == 'foo'
+    assert remote.name == 'Content provided by Foo'
+    assert remote.url == 'http://foo.fr/catalog.yml'
+
+    with pytest.raises(ExistingRemoteError) as exc:
+        c.add_remote('foo', 'Content by Foo', 'http://foo.fr/catalog.yml')
+
+    assert 'foo' in exc.exconly()
+
+
+def test_catalog_remove_remote(settings):
+    from ideascube.serveradmin.catalog import Catalog
+
+    params = {
+        'id': 'foo', 'name': 'Content provided by Foo',
+        'url': 'http://foo.fr/catalog.yml'}
+
+    remotes_dir = Path(settings.CATALOG_STORAGE_ROOT).mkdir('remotes')
+    remotes_dir.join('foo.yml').write(
+        'id: {id}\nname: {name}\nurl: {url}'.format(**params))
+
+    c = Catalog()
+    c.remove_remote(params['id'])
+    remotes = c.list_remotes()
+    assert len(remotes) == 0
+    assert remotes_dir.listdir() == []
+
+    with pytest.raises(ValueError) as exc:
+        c.remove_remote(params['id'])
+
+    assert params['id'] in exc.exconly()
+
+
+def test_catalog_update_cache(tmpdir, monkeypatch):
+    from ideascube.serveradmin.catalog import Catalog
+
+    monkeypatch.setattr(
+        'ideascube.serveradmin.catalog.urlretrieve', fake_urlretrieve)
+
+    remote_catalog_file = tmpdir.mkdir('source').join('catalog.yml')
+    remote_catalog_file.write(
+        'all:\n  foovideos:\n    name: Videos from Foo')
+
+    c = Catalog()
+    assert c._available == {}
+    assert c._installed == {}
+
+    c.add_remote(
+        'foo', 'Content from Foo',
+        'file://{}'.format(remote_catalog_file.strpath))
+    c.update_cache()
+    assert c._available == {'foovideos': {'name': 'Videos from Foo'}}
+    assert c._installed == {}
+
+    c = Catalog()
+    assert c._available == {'foovideos': {'name': 'Videos from Foo'}}
+    assert c._installed == {}
+
+def test_catalog_update_cache_progress_from_threads(
+        tmpdir, settings, monkeypatch):
+    import threading
+    import time
+    from ideascube.serveradmin.catalog import Catalog
+
+    class CheckingBar:
+        def __init__(self):
+            self.updating = False
+            self.updates = 0
+            self.overlaps = 0
+
+        def update(self, done, total):
+            if self.updating:
+                self.overlaps += 1
+
+            self.updating = True
+            time.sleep(0.01)
+            self.updates += 1
+            self.updating = False
+
+    barrier = threading.Barrier(4, timeout=5)
+
+    def slow_urlretrieve(url, path, reporthook=None, **kwargs):
+        # Make sure all the remotes report their progress together
+        barrier.wait()
+        return fake_urlretrieve(url, path, reporthook=reporthook, **kwargs)
+
+    monkeypatch.setattr(
+        'ideascube.serveradmin.catalog.urlretrieve', slow_urlretrieve)
+    settings.CATALOG_UPDATE_WORKERS = 4
+
+    bar = CheckingBar()
+    c = Catalog(bar=bar)
+    sourcedir = tmpdir.mkdir('source')
+
+    for i in range(4):
+        remote_catalog_file = sourcedir.join('catalog{}.yml'.format(i))
+        remote_catalog_file.write(
+            'all:\n  videos{0}:\n    name: Videos {0}'.format(i))
+        c.add_remote(
+            'remote{}'.format(i), 'Remote {}'.format(i),
+            'file://{}'.format(remote_catalog_file.strpath))
+
+    c.update_cache()
+    assert len(c._available) == 4
+    assert bar.updates == 4
+    assert bar.overlaps == 0
+
+
+def test_catalog_update_cache_no_fail_if_remote_unavailable(mocker):
+    from ideascube.serveradmin.catalog import Catalog
+    from requests import ConnectionError
+
+    mocker.patch('ideascube.serveradmin.catalog.urlretrieve',
+                 side_effect=ConnectionError)
+
+    c = Catalog()
+
+    c.add_remote(
+        'foo', 'Content from Foo',
+        'http://exemple.com/not_existing')
+    c.update_cache()
+
+
+def test_catalog_update_cache_compressed(tmpdir, monkeypatch):
+    import gzip
+    import lzma
+    from ideascube.serveradmin.catalog import Catalog
+
+    monkeypatch.setattr(
+        'ideascube.serveradmin.catalog.urlretrieve', fake_urlretrieve)
+
+    sourcedir = tmpdir.mkdir('source')
+    gz_catalog_file = sourcedir.join('foo.yml.gz')
+    xz_catalog_file = sourcedir.join('bar.yml.xz')
+
+    with gzip.open(gz_catalog_file.strpath, 'wt') as f:
+        f.write('all:\n  foovideos:\n    name: Videos from Foo')
+
+    with lzma.open(xz_catalog_file.strpath, 'wt') as f:
+        f.write('all:\n  barvideos:\n    name: Videos from Bar')
+
+    c = Catalog()
+    c.add_remote(
+        'foo', 'Content from Foo', 'file://{}'.format(gz_catalog_file.strpath))
+    c.add_remote(
+        'bar', 'Content from Bar', 'file://{}'.format(xz_catalog_file.strpath))
+    c.update_cache()
+    assert c._available == {
+        'foovideos': {'name': 'Videos from Foo'},
+        'barvideos': {'name': 'Videos from Bar'},
+    }
+
+
+def test_catalog_update_cache_not_modified(tmpdir, mocker):
+    from ideascube.serveradmin.catalog import Catalog
+
+    remote_catalog_file = tmpdir.mkdir('source').join('catalog.yml')
+    remote_catalog_file.write(
+        'all:\n  foovideos:\n    name: Videos from Foo')
+
+    def fake_conditional_urlretrieve(url, path, reporthook=None, headers=None):
+        if headers.get('If-None-Match') == '"v1"':
+            # Not modified, the body is empty
+            open(path, 'w').close()
+
+        else:
+            fake_urlretrieve(url, path)
+
+        return {'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Aug 2016 00:00:00'}
+
+    spy_urlretrieve = mocker.patch(
+        'ideascube.serveradmin.catalog.urlretrieve',
+        side_effect=fake_conditional_urlretrieve)
+
+    c = Catalog()
+    c.add_remote(
+        'foo', 'Content from Foo',
+        'file://{}'.format(remote_catalog_file.strpath))
+    c.update_cache()
+    assert c._available == {'foovideos': {'name': 'Videos from Foo'}}
+    assert spy_urlretrieve.call_args[1]['headers'] == {}
+    assert spy_urlretrieve.call_args[1]['reporthook'] is not None
+
+    c = Catalog()
+    c.update_cache()
+    assert c._available == {'foovideos': {'name': 'Videos from Foo'}}
+    assert spy_urlretrieve.call_args[1]['headers'] == {
+        'If-None-Match': '"v1"',
+        'If-Modified-Since': 'Mon, 01 Aug 2016 00:00:00',
+    }
+
+
+def test_catalog_update_cache_with_delta(tmpdir, monkeypatch):
+    from ideascube.serveradmin.catalog import Catalog
+
+    monkeypatch.setattr(
+        'ideascube.serveradmin.catalog.urlretrieve', fake_urlretrieve)
+
+    sourcedir = tmpdir.mkdir('source')
+    remote_catalog_file = sourcedir.join('catalog.yml')
+    remote_catalog_file.write(
+        'serial: 1\n'
+        'delta: catalog.delta.yml\n'
+        'all:\n'
+        '  foovideos:\n    name: Videos from Foo\n'
+        '  foobooks:\n    name: Books from Foo\n')
+    sourcedir.join('catalog.delta.yml').write('from: 0\nserial: 1\n')
+
+    c = Catalog()
+    c.add_remote(
+        'foo', 'Content from Foo',
+        'file://{}'.format(remote_catalog_file.strpath))
+    c.update_cache()
+    assert c._available == {
+        'foovideos': {'name': 'Videos from Foo'},
+        'foobooks': {'name': 'Books from Foo'},
+    }
+
+    # Break the full catalog, to be sure only the delta is downloaded
+    remote_catalog_file.write('')
+    sourcedir.join('catalog.delta.yml').write(
+        'from: 1\n'
+        'serial: 2\n'
+        'all:\n'
+        '  foovideos:\n    name: More videos from Foo\n'
+        'removed:\n'
+        '  - foobooks\n')
+    c.update_cache()
+    assert c._available == {'foovideos': {'name': 'More videos from Foo'}}
+
+    # The delta was already applied
+    c.update_cache()
+    assert c._available == {'foovideos': {'name': 'More videos from Foo'}}
+
+    # We missed a version, download the full catalog
+    remote_catalog_file.write(
+        'serial: 4\n'
+        'delta: catalog.delta.yml\n'
+        'all:\n'
+        '  foovideos:\n    name: Even more videos from Foo\n')
+    sourcedir.join('catalog.delta.yml').write('from: 3\nserial: 4\n')
+    c.update_cache()
+    assert c._available == {
+        'foovideos': {'name': 'Even more videos from Foo'}}
+
+
+def test_catalog_clear_cache(tmpdir, monkeypatch):
+    from ideascube.serveradmin.catalog import Catalog
+
+    monkeypatch.setattr(
+        'ideascube.serveradmin.catalog.urlretrieve', fake_urlretrieve)
+
+    remote_catalog_file = tmpdir.mkdir('source').join('catalog.yml')
+    remote_catalog_file.write(
+        'all:\n  foovideos:\n    name: Videos from Foo')
+
+    c = Catalog()
+    c.add_remote(
+        'foo', 'Content from Foo',
+        'file://{}'.format(remote_catalog_file.strpath))
+    c.update_cache()
+    assert c._available == {'foovideos': {'name': 'Videos from Foo'}}
+    assert c._installed == {}
+
+    c.clear_cache()
+    assert c._available == {}
+    assert c._installed == {}
+
+
+@pytest.mark.usefixtures('db', 'systemuser')
+def test_catalog_install_package(tmpdir, settings, testdatadir, mocker):
+    from ideascube.serveradmin.catalog import Catalog
+
+    installdir = Path(settings.CATALOG_KIWIX_INSTALL_DIR)
+    sourcedir = tmpdir.mkdir('source')
+
+    zippedzim = testdatadir.join('catalog', 'wikipedia.tum-2015-08')
+    path = sourcedir.join('wikipedia_tum_all_nopic_2015-08.zim')
+    zippedzim.copy(path)
+
+    remote_catalog_file = sourcedir.join('catalog.yml')
+    with remote_catalog_file.open(mode='w') as f:
+        f.write('all:\n')
+        f.write('  wikipedia.tum:\n')
+        f.write('    version: 2015-08\n')
+        f.write('    size: 200KB\n')
+        f.write('    url: file://{}\n'.format(path))
+        f.write(
+            '    sha256sum: 335d00b53350c63df45486c5433205f068ad90e33c208064b'
+            '212c29a30109c54\n')
+        f.write('    type: zipped-zim\n')
+        f.write('    handler: kiwix\n')
+
+    mocker.patch('ideascube.serveradmin.catalog.SystemManager')
+    mocker.patch(
+        'ideascube.serveradmin.catalog.urlretrieve',
+        side_effect=fake_urlretrieve)
+
+    c = Catalog()
+    c.add_remote(
+        'foo', 'Content from Foo',
+        'file://{}'.format(remote_catalog_file.strpath))
+    c.update_cache()
+    c.install_packages(['wikipedia.tum'])
+
+    library = installdir.join('library.xml')
+    assert library.check(exists=True)
+
+    with library.open(mode='r') as f:
+        libdata = f.read()
+
+        assert 'path="data/content/wikipedia.tum.zim"' in libdata
+        assert 'indexPath="data/index/wikipedia.tum.zim.idx"' in libdata
+
+
+@pytest.mark.usefixtures('db', 'systemuser')
+def test_catalog_install_package_segmented(
+        settings, testdatadir, mocker, http_server):
+    from ideascube.serveradmin.catalog import Catalog
+
+    settings.CATALOG_SEGMENTED_DOWNLOAD_THRESHOLD = 100000
+    settings.CATALOG_DOWNLOAD_SEGMENTS = 3
+
+    installdir = Path(settings.CATALOG_KIWIX_INSTALL_DIR)
+
+    testdatadir.join('catalog', 'wikipedia.tum-2015-08').copy(
+        http_server.root.join('wikipedia.tum-2015-08'))
+
+    remote_catalog_file = http_server.root.join('catalog.yml')
+    with remote_catalog_file.open(mode='w') as f:
+        f.write('all:\n')
+        f.write('  wikipedia.tum:\n')
+        f.write('    version: 2015-08\n')
+        f.write('    size: 201331\n')
+        f.write('    url: {}wikipedia.tum-2015-08\n'.format(http_server.url))
+        f.write(
+            '    sha256sum: 335d00b53350c63df45486c5433205f068ad90e33c208064b'
+            '212c29a30109c54\n')
+        f.write('    type: zipped-zim\n')
+        f.write('    handler: kiwix\n')
+
+    mocker.patch('ideascube.serveradmin.catalog.SystemManager')
+
+    c = Catalog()
+    c.add_remote(
+        'foo', 'Content from Foo', '{}catalog.yml'.format(http_server.url))
+    c.update_cache()
+    c.install_packages(['wikipedia.tum'])
+
+    library = installdir.join('library.xml')
+    assert 'path="data/content/wikipedia.tum.zim"' in library.read_text(
+        'utf-8')
+
+    package_requests = [
+        r for r in http_server.requests
+        if r[:2] == ('GET', '/wikipedia.tum-2015-08')]
+    assert len(package_requests) == 3
+    assert all(r[2] is not None for r in package_requests)
+
+
+@pytest.mark.usefixtures('db', 'systemuser')
+def test_catalog_install_package_segmented_mirror_failover(
+        settings, testdatadir, mocker, http_server):
+    from ideascube.serveradmin.catalog import Catalog
+
+    settings.CATALOG_SEGMENTED_DOWNLOAD_THRESHOLD = 100000
+    settings.CATALOG_DOWNLOAD_SEGMENTS = 3
+
+    installdir = Path(settings.CATALOG_KIWIX_INSTALL_DIR)
+
+    zippedzim = testdatadir.join('catalog', 'wikipedia.tum-2015-08')
+    zippedzim.copy(http_server.root.mkdir('dying').join(
+        'wikipedia.tum-2015-08'))
+    zippedzim.copy(http_server.root.join('wikipedia.tum-2015-08'))
+    http_server.dying.append('/dying/')
+
+    remote_catalog_file = http_server.root.join('catalog.yml')
+    with remote_catalog_file.open(mode='w') as f:
+        f.write('all:\n')
+        f.write('  wikipedia.tum:\n')
+        f.write('    version: 2015-08\n')
+        f.write('    size: 201331\n')
+        f.write('    url: {}dying/wikipedia.tum-2015-08\n'.format(
+            http_server.url))
+        f.write('    mirrors:\n')
+        f.write('      - {}wikipedia.tum-2015-08\n'.format(http_server.url))
+        f.write(
+            '    sha256sum: 335d00b53350c63df45486c5433205f068ad90e33c208064b'
+            '212c29a30109c54\n')
+        f.write('    type: zipped-zim\n')
+        f.write('    handler: kiwix\n')
+
+    mocker.patch('ideascube.serveradmin.catalog.SystemManager')
+
+    c = Catalog()
+    c.add_remote(
+        'foo', 'Content from Foo', '{}catalog.yml'.format(http_server.url))
+    c.update_cache()
+    c.install_packages(['wikipedia.tum'])
+
+    library = installdir.join('library.xml')
+    assert 'path="data/content/wikipedia.tum.zim"' in library.read_text(
+        'utf-8')
+
+    # The second mirror only sent what the first one did not
+    ranges = [
+        r[2] for r in http_server.requests
+        if r[:2] == ('GET', '/wikipedia.tum-2015-08')]
+    assert len(ranges) == 3
+    received = 0
+
+    for byterange in ranges:
+        start, end = byterange[len('bytes='):].split('-')
+        received += int(end) - int(start) + 1
+
+    assert received < 201331 / 2
+
+
+@pytest.mark.usefixtures('db', 'systemuser')
+def test_catalog_install_small_package_not_segmented(
+        settings, testdatadir, mocker, http_server):
+    from ideascube.serveradmin.catalog import Catalog
+
+    settings.CATALOG_SEGMENTED_DOWNLOAD_THRESHOLD = 300000
+    settings.CATALOG_DOWNLOAD_SEGMENTS = 3
+
+    testdatadir.join('catalog', 'wikipedia.tum-2015-08').copy(
+        http_server.root.join('wikipedia.tum-2015-08'))
+
+    remote_catalog_file = http_server.root.join('catalog.yml')
+    with remote_catalog_file.open(mode='w') as f:
+        f.write('all:\n')
+        f.write('  wikipedia.tum:\n')
+        f.write('    version: 2015-08\n')
+        f.write('    size: 201331\n')
+        f.write('    url: {}wikipedia.tum-2015-08\n'.format(http_server.url))
+        f.write(
+            '    sha256sum: 335d00b53350c63df45486c5433205f068ad90e33c208064b'
+            '212c29a30109c54\n')
+        f.write('    type: zipped-zim\n')
+        f.write('    handler: kiwix\n')
+
+    mocker.patch('ideascube.serveradmin.catalog.SystemManager')
+
+    c = Catalog()
+    c.add_remote(
+        'foo', 'Content from Foo', '{}catalog.yml'.format(http_server.url))
+    c.update_cache()
+    c.install_packages(['wikipedia.tum'])
+
+    # The package size in the catalog is enough to know it is too small
+    package_requests = [
+        r for r in http_server.requests
+        if r[1] == '/wikipedia.tum-2015-08']
+    assert package_requests == [('GET', '/wikipedia.tum-2015-08', None)]
 
-    remote = remotes[0]
-    assert remote.id == 'bar'
-    assert remote.name == 'Content provided by Bar'
-    assert remote.url == 'http://bar.fr/catalog.yml'
 
-    remote = remotes[1]
-    assert remote.id == 'foo'
-    assert remote.name == 'Content provided by Foo'
-    assert remote.url == 'http://foo.fr/catalog.yml'
+@pytest.mark.usefixtures('db', 'systemuser')
+@pytest.mark.parametrize('corrupted', [False, True], ids=['good', 'corrupted'])
+def test_catalog_install_package_from_peer(
+        settings, testdatadir, mocker, http_server, peer_server, corrupted):
+    from ideascube.serveradmin.catalog import Catalog
 
-    with pytest.raises(ExistingRemoteError) as exc:
-        c.add_remote('foo', 'Content by Foo', 'http://foo.fr/catalog.yml')
+    installdir = Path(settings.CATALOG_KIWIX_INSTALL_DIR)
+    sha256sum = (
+        '335d00b53350c63df45486c5433205f068ad90e33c208064b212c29a30109c54')
 
-    assert 'foo' in exc.exconly()
+    testdatadir.join('catalog', 'wikipedia.tum-2015-08').copy(
+        http_server.root.join('wikipedia.tum-2015-08'))
 
+    peer_object = Path(peer_server.cache.get_object_path(sha256sum))
 
-def test_catalog_remove_remote(settings):
-    from ideascube.serveradmin.catalog import Catalog
+    if corrupted:
+        peer_object.write_binary(b'not the package')
 
-    params = {
-        'id': 'foo', 'name': 'Content provided by Foo',
-        'url': 'http://foo.fr/catalog.yml'}
+    else:
+        testdatadir.join('catalog', 'wikipedia.tum-2015-08').copy(peer_object)
 
-    remotes_dir = Path(settings.CATALOG_STORAGE_ROOT).mkdir('remotes')
-    remotes_dir.join('foo.yml').write(
-        'id: {id}\nname: {name}\nurl: {url}'.format(**params))
+    remote_catalog_file = http_server.root.join('catalog.yml')
+    with remote_catalog_file.open(mode='w') as f:
+        f.write('all:\n')
+        f.write('  wikipedia.tum:\n')
+        f.write('    version: 2015-08\n')
+        f.write('    size: 200KB\n')
+        f.write('    url: {}wikipedia.tum-2015-08\n'.format(http_server.url))
+        f.write('    sha256sum: {}\n'.format(sha256sum))
+        f.write('    type: zipped-zim\n')
+        f.write('    handler: kiwix\n')
+
+    mocker.patch('ideascube.serveradmin.catalog.SystemManager')
 
     c = Catalog()
-    c.remove_remote(params['id'])
-    remotes = c.list_remotes()
-    assert len(remotes) == 0
+    c.add_remote(
+        'foo', 'Content from Foo', '{}catalog.yml'.format(http_server.url))
+    c.update_cache()
+    c.add_peer(peer_server.url)
+    c.install_packages(['wikipedia.tum'])
 
-    with pytest.raises(ValueError) as exc:
-        c.remove_remote(params['id'])
+    library = installdir.join('library.xml')
+    assert 'path="data/content/wikipedia.tum.zim"' in library.read_text(
+        'utf-8')
 
-    assert params['id'] in exc.exconly()
+    package_requests = [
+        r for r in http_server.requests
+        if r[:2] == ('GET', '/wikipedia.tum-2015-08')]
+    assert len(package_requests) == (1 if corrupted else 0)
 
 
-def test_catalog_update_cache(tmpdir, monkeypatch):
+@pytest.mark.usefixtures('db', 'systemuser')
+def test_catalog_install_keeps_the_batch_in_the_cache(
+        tmpdir, settings, testdatadir, mocker):
     from ideascube.serveradmin.catalog import Catalog
 
-    monkeypatch.setattr(
-        'ideascube.serveradmin.catalog.urlretrieve', fake_urlretrieve)
+    installdir = Path(settings.CATALOG_KIWIX_INSTALL_DIR)
+    sourcedir = tmpdir.mkdir('source')
+    remote_catalog_file = sourcedir.join('catalog.yml')
 
-    remote_catalog_file = tmpdir.mkdir('source').join('catalog.yml')
-    remote_catalog_file.write(
-        'all:\n  foovideos:\n    name: Videos from Foo')
+    with remote_catalog_file.open(mode='w') as f:
+        f.write('all:\n')
 
-    c = Catalog()
-    assert c._available == {}
-    assert c._installed == {}
+        for id, version, sha256sum in (
+                ('wikipedia.tum', '2015-08', '335d00b53350c63df45486c543320'
+                 '5f068ad90e33c208064b212c29a30109c54'),
+                ('wikipedia.other', '2015-09', 'f8794e3c8676258b0b594ad6e46'
+                 '4177dda8d66dbcbb04b301d78fd4c9cf2c3dd')):
+            path = sourcedir.join('{}-{}'.format(id, version))
+            testdatadir.join(
+                'catalog', 'wikipedia.tum-{}'.format(version)).copy(path)
+            f.write('  {}:\n'.format(id))
+            f.write('    version: {}\n'.format(version))
+            f.write('    size: 200KB\n')
+            f.write('    url: file://{}\n'.format(path))
+            f.write('    sha256sum: {}\n'.format(sha256sum))
+            f.write('    type: zipped-zim\n')
+            f.write('    handler: kiwix\n')
+
+    # Each package alone is over the quota
+    settings.CATALOG_CACHE_QUOTA = 1
+    mocker.patch('ideascube.serveradmin.catalog.SystemManager')
+    mocker.patch(
+        'ideascube.serveradmin.catalog.urlretrieve',
+        side_effect=fake_urlretrieve)
 
+    c = Catalog()
     c.add_remote(
         'foo', 'Content from Foo',
         'file://{}'.format(remote_catalog_file.strpath))
     c.update_cache()
-    assert c._available == {'foovideos': {'name': 'Videos from Foo'}}
-    assert c._installed == {}
+    c.install_packages(['wikipedia.tum', 'wikipedia.other'])
+
+    assert sorted(c._installed) == ['wikipedia.other', 'wikipedia.tum']
+    library = installdir.join('library.xml').read_text('utf-8')
+    assert 'path="data/content/wikipedia.tum.zim"' in library
+    assert 'path="data/content/wikipedia.other.zim"' in library
+
+
+@pytest.mark.usefixtures('db', 'systemuser')
+def test_catalog_failed_peer_keeps_partial_download(tmpdir, peer_server):
+    from ideascube.serveradmin.catalog import Catalog, ZippedZim
+
+    p = ZippedZim('wikipedia.tum', {
+        'version': '2015-08', 'sha256sum': 'abcd',
+        'url': 'https://foo.fr/wikipedia.tum-2015-08'})
+    path = tmpdir.join('wikipedia.tum-2015-08')
+    path.write_binary(b'the beginning of the package')
 
     c = Catalog()
-    assert c._available == {'foovideos': {'name': 'Videos from Foo'}}
-    assert c._installed == {}
+    c.add_peer(peer_server.url)
 
-def test_catalog_update_cache_no_fail_if_remote_unavailable(mocker):
+    assert not c._fetch_package_from_peers(p, path.strpath)
+    assert path.read_binary() == b'the beginning of the package'
+    assert tmpdir.join('wikipedia.tum-2015-08.peer').check(exists=False)
+
+
+def write_mirrored_catalog(http_server, urls):
+    remote_catalog_file = http_server.root.join('catalog.yml')
+    with remote_catalog_file.open(mode='w') as f:
+        f.write('all:\n')
+        f.write('  wikipedia.tum:\n')
+        f.write('    version: 2015-08\n')
+        f.write('    size: 200KB\n')
+        f.write('    url: {}\n'.format(urls[0]))
+        f.write('    mirrors:\n')
+
+        for url in urls[1:]:
+            f.write('      - {}\n'.format(url))
+
+        f.write(
+            '    sha256sum: 335d00b53350c63df45486c5433205f068ad90e33c208064b'
+            '212c29a30109c54\n')
+        f.write('    type: zipped-zim\n')
+        f.write('    handler: kiwix\n')
+
+
+@pytest.mark.usefixtures('db', 'systemuser')
+def test_catalog_install_package_mirror_failover(
+        settings, testdatadir, mocker, http_server):
     from ideascube.serveradmin.catalog import Catalog
-    from requests import ConnectionError
 
-    mocker.patch('ideascube.serveradmin.catalog.urlretrieve',
-                 side_effect=ConnectionError)
+    installdir = Path(settings.CATALOG_KIWIX_INSTALL_DIR)
 
-    c = Catalog()
+    testdatadir.join('catalog', 'wikipedia.tum-2015-08').copy(
+        http_server.root.join('wikipedia.tum-2015-08'))
+
+    # Nothing listens on port 1
+    broken = 'http://127.0.0.2:1/wikipedia.tum-2015-08'
+    working = '{}wikipedia.tum-2015-08'.format(http_server.url)
+    write_mirrored_catalog(http_server, [broken, working])
+
+    mocker.patch('ideascube.serveradmin.catalog.SystemManager')
 
+    c = Catalog()
     c.add_remote(
-        'foo', 'Content from Foo',
-        'http://exemple.com/not_existing')
+        'foo', 'Content from Foo', '{}catalog.yml'.format(http_server.url))
     c.update_cache()
+    c.install_packages(['wikipedia.tum'])
 
+    library = installdir.join('library.xml')
+    assert 'path="data/content/wikipedia.tum.zim"' in library.read_text(
+        'utf-8')
 
-def test_catalog_clear_cache(tmpdir, monkeypatch):
+    # Next time, we'll try the working mirror first
+    c = Catalog()
+    assert c._mirrors.rank([broken, working]) == [working, broken]
+    assert c._mirrors.get(working)['throughput'] > 0
+
+
+@pytest.mark.usefixtures('db', 'systemuser')
+def test_catalog_install_package_mirror_too_slow(
+        settings, testdatadir, mocker, http_server):
     from ideascube.serveradmin.catalog import Catalog
 
-    monkeypatch.setattr(
-        'ideascube.serveradmin.catalog.urlretrieve', fake_urlretrieve)
+    # Every mirror is too slow, except the last one which we never give up on
+    settings.CATALOG_MIRROR_MIN_THROUGHPUT = 1024 ** 5
+    settings.CATALOG_MIRROR_WINDOW = 0
 
-    remote_catalog_file = tmpdir.mkdir('source').join('catalog.yml')
-    remote_catalog_file.write(
-        'all:\n  foovideos:\n    name: Videos from Foo')
+    installdir = Path(settings.CATALOG_KIWIX_INSTALL_DIR)
+
+    testdatadir.join('catalog', 'wikipedia.tum-2015-08').copy(
+        http_server.root.join('wikipedia.tum-2015-08'))
+    http_server.root.mkdir('mirror')
+    testdatadir.join('catalog', 'wikipedia.tum-2015-08').copy(
+        http_server.root.join('mirror', 'wikipedia.tum-2015-08'))
+
+    slow = '{}wikipedia.tum-2015-08'.format(http_server.url)
+    other = slow.replace('127.0.0.1', 'localhost').replace(
+        'wikipedia', 'mirror/wikipedia')
+    write_mirrored_catalog(http_server, [slow, other])
+
+    mocker.patch('ideascube.serveradmin.catalog.SystemManager')
 
     c = Catalog()
     c.add_remote(
-        'foo', 'Content from Foo',
-        'file://{}'.format(remote_catalog_file.strpath))
+        'foo', 'Content from Foo', '{}catalog.yml'.format(http_server.url))
     c.update_cache()
-    assert c._available == {'foovideos': {'name': 'Videos from Foo'}}
-    assert c._installed == {}
+    c.install_packages(['wikipedia.tum'])
 
-    c.clear_cache()
-    assert c._available == {}
-    assert c._installed == {}
+    library = installdir.join('library.xml')
+    assert 'path="data/content/wikipedia.tum.zim"' in library.read_text(
+        'utf-8')
+
+    # The download was resumed from the other mirror
+    package_requests = [
+        r for r in http_server.requests
+        if r[0] == 'GET' and r[1].endswith('/wikipedia.tum-2015-08')]
+    assert len(package_requests) == 2
+    assert package_requests[0][1] != package_requests[1][1]
+    assert package_requests[0][2] is None
+    assert package_requests[1][2] is not None
 
 
 @pytest.mark.usefixtures('db', 'systemuser')
-def test_catalog_install_package(tmpdir, settings, testdatadir, mocker):
+def test_catalog_install_package_pauses_outside_window(
+        settings, testdatadir, mocker, http_server, capsys):
+    from datetime import datetime
+
     from ideascube.serveradmin.catalog import Catalog
+    from ideascube.serveradmin.throttle import Throttle
 
     installdir = Path(settings.CATALOG_KIWIX_INSTALL_DIR)
-    sourcedir = tmpdir.mkdir('source')
 
-    zippedzim = testdatadir.join('catalog', 'wikipedia.tum-2015-08')
-    path = sourcedir.join('wikipedia_tum_all_nopic_2015-08.zim')
-    zippedzim.copy(path)
+    testdatadir.join('catalog', 'wikipedia.tum-2015-08').copy(
+        http_server.root.join('wikipedia.tum-2015-08'))
 
-    remote_catalog_file = sourcedir.join('catalog.yml')
+    remote_catalog_file = http_server.root.join('catalog.yml')
     with remote_catalog_file.open(mode='w') as f:
         f.write('all:\n')
         f.write('  wikipedia.tum:\n')
         f.write('    version: 2015-08\n')
         f.write('    size: 200KB\n')
-        f.write('    url: file://{}\n'.format(path))
+        f.write('    url: {}wikipedia.tum-2015-08\n'.format(http_server.url))
         f.write(
             '    sha256sum: 335d00b53350c63df45486c5433205f068ad90e33c208064b'
             '212c29a30109c54\n')
@@ -875,25 +1896,66 @@ def test_catalog_install_package(tmpdir, settings, testdatadir, mocker):
         f.write('    handler: kiwix\n')
 
     mocker.patch('ideascube.serveradmin.catalog.SystemManager')
-    mocker.patch(
-        'ideascube.serveradmin.catalog.urlretrieve',
-        side_effect=fake_urlretrieve)
 
-    c = Catalog()
+    # The window ends right after the first chunk was received
+    clock = {'calls': 0, 'now': datetime(2016, 10, 1, 23, 0)}
+    sleeps = []
+
+    def now():
+        clock['calls'] += 1
+
+        if clock['calls'] == 2:
+            clock['now'] = datetime(2016, 10, 2, 7, 0)
+
+        return clock['now']
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        clock['now'] = datetime(2016, 10, 2, 22, 0)
+
+    throttle = Throttle(
+        windows=['22:00-06:00'], pause=True, now=now, sleep=sleep)
+
+    c = Catalog(throttle=throttle)
     c.add_remote(
-        'foo', 'Content from Foo',
-        'file://{}'.format(remote_catalog_file.strpath))
+        'foo', 'Content from Foo', '{}catalog.yml'.format(http_server.url))
     c.update_cache()
     c.install_packages(['wikipedia.tum'])
 
     library = installdir.join('library.xml')
-    assert library.check(exists=True)
+    assert 'path="data/content/wikipedia.tum.zim"' in library.read_text(
+        'utf-8')
 
-    with library.open(mode='r') as f:
-        libdata = f.read()
+    out, _ = capsys.readouterr()
+    assert 'Pausing the download of wikipedia.tum' in out
+    assert sleeps == [15 * 3600]
+
+    # The download resumed where it was paused
+    package_requests = [
+        r for r in http_server.requests
+        if r[:2] == ('GET', '/wikipedia.tum-2015-08')]
+    assert len(package_requests) == 2
+    assert package_requests[0][2] is None
+    assert package_requests[1][2] is not None
 
-        assert 'path="data/content/wikipedia.tum.zim"' in libdata
-        assert 'indexPath="data/index/wikipedia.tum.zim.idx"' in libdata
+
+def test_catalog_update_cache_mirror_failover(settings, mocker, http_server):
+    from ideascube.serveradmin.catalog import Catalog
+
+    http_server.root.join('catalog.yml').write(
+        'all:\n  foovideos:\n    name: Videos from Foo\n')
+
+    c = Catalog()
+    c.add_remote(
+        'foo', 'Content from Foo', 'http://127.0.0.2:1/catalog.yml',
+        mirrors=['{}catalog.yml'.format(http_server.url)])
+    c.update_cache()
+    assert c._available == {'foovideos': {'name': 'Videos from Foo'}}
+
+    # The remote remembers its mirrors
+    c = Catalog()
+    assert c.list_remotes()[0].mirrors == [
+        '{}catalog.yml'.format(http_server.url)]
 
 
 @pytest.mark.usefixtures('db', 'systemuser')
@@ -1092,6 +2154,66 @@ def test_catalog_install_package_already_downloaded(
     assert spy_urlretrieve.call_count == 1
 
 
+@pytest.mark.usefixtures('db', 'systemuser')
+def test_catalog_clear_cache_keeps_installed_packages(
+        tmpdir, settings, testdatadir, mocker):
+    from ideascube.serveradmin.catalog import Catalog
+
+    packagesdir = Path(settings.CATALOG_CACHE_ROOT).join('packages')
+    sourcedir = tmpdir.mkdir('source')
+
+    zippedzim = testdatadir.join('catalog', 'wikipedia.tum-2015-08')
+    path = sourcedir.join('wikipedia_tum_all_nopic_2015-08.zim')
+    zippedzim.copy(path)
+
+    remote_catalog_file = sourcedir.join('catalog.yml')
+    with remote_catalog_file.open(mode='w') as f:
+        f.write('all:\n')
+        f.write('  wikipedia.tum:\n')
+        f.write('    version: 2015-08\n')
+        f.write('    size: 200KB\n')
+        f.write('    url: file://{}\n'.format(path))
+        f.write(
+            '    sha256sum: 335d00b53350c63df45486c5433205f068ad90e33c208064b'
+            '212c29a30109c54\n')
+        f.write('    type: zipped-zim\n')
+        f.write('    handler: kiwix\n')
+
+    mocker.patch('ideascube.serveradmin.catalog.SystemManager')
+    spy_urlretrieve = mocker.patch(
+        'ideascube.serveradmin.catalog.urlretrieve',
+        side_effect=fake_urlretrieve)
+
+    c = Catalog()
+    c.add_remote(
+        'foo', 'Content from Foo',
+        'file://{}'.format(remote_catalog_file.strpath))
+    c.update_cache()
+    c.install_packages(['wikipedia.tum'])
+    assert packagesdir.join('wikipedia.tum-2015-08').check(link=True)
+
+    stats = c.get_cache_stats()
+    assert stats['objects'] == 1
+    assert stats['misses'] == 1
+    assert stats['reclaimable'] == 0
+
+    c.clear_cache()
+    assert packagesdir.join('wikipedia.tum-2015-08').check(file=True)
+
+    # Reinstalling does not download the package again
+    c.update_cache()
+    c.reinstall_packages(['wikipedia.tum'])
+    package_downloads = [
+        call for call in spy_urlretrieve.call_args_list
+        if call[0][0] == 'file://{}'.format(path)]
+    assert len(package_downloads) == 1
+    assert c.get_cache_stats()['hits'] == 1
+
+    c.clear_cache(keep_installed=False)
+    assert packagesdir.join('wikipedia.tum-2015-08').check(exists=False)
+    assert packagesdir.join('objects').listdir() == []
+
+
 @pytest.mark.usefixtures('db', 'systemuser')
 def test_catalog_install_package_already_in_additional_cache(
         tmpdir, settings, testdatadir, mocker):
@@ -1583,6 +2705,74 @@ def test_catalog_update_package(tmpdir, settings, testdatadir, mocker):
         assert 'date="2015-09-10"' in libdata
 
 
+@pytest.mark.usefixtures('db', 'systemuser')
+@pytest.mark.parametrize('blockmap, ranges', [
+    ('wikipedia.tum-2015-09.blocks', True),
+    ('no-such-file.blocks', False),
+    ], ids=['delta', 'fallback'])
+def test_catalog_update_package_with_delta(
+        settings, testdatadir, mocker, http_server, blockmap, ranges):
+    from ideascube.serveradmin.catalog import Catalog
+    from ideascube.serveradmin.delta import BlockMap
+
+    installdir = Path(settings.CATALOG_KIWIX_INSTALL_DIR)
+
+    testdatadir.join('catalog', 'wikipedia.tum-2015-08').copy(
+        http_server.root.join('wikipedia.tum-2015-08'))
+
+    remote_catalog_file = http_server.root.join('catalog.yml')
+    with remote_catalog_file.open(mode='w') as f:
+        f.write('all:\n')
+        f.write('  wikipedia.tum:\n')
+        f.write('    version: 2015-08\n')
+        f.write('    size: 200KB\n')
+        f.write('    url: {}wikipedia.tum-2015-08\n'.format(http_server.url))
+        f.write(
+            '    sha256sum: 335d00b53350c63df45486c5433205f068ad90e33c208064b'
+            '212c29a30109c54\n')
+        f.write('    type: zipped-zim\n')
+        f.write('    handler: kiwix\n')
+
+    mocker.patch('ideascube.serveradmin.catalog.SystemManager')
+
+    c = Catalog()
+    c.add_remote(
+        'foo', 'Content from Foo', '{}catalog.yml'.format(http_server.url))
+    c.update_cache()
+    c.install_packages(['wikipedia.tum'])
+
+    new = http_server.root.join('wikipedia.tum-2015-09')
+    testdatadir.join('catalog', 'wikipedia.tum-2015-09').copy(new)
+    BlockMap.from_file(new.strpath, blocksize=4096).to_file(
+        http_server.root.join('wikipedia.tum-2015-09.blocks').strpath)
+
+    with remote_catalog_file.open(mode='w') as f:
+        f.write('all:\n')
+        f.write('  wikipedia.tum:\n')
+        f.write('    version: 2015-09\n')
+        f.write('    size: 200KB\n')
+        f.write('    url: {}wikipedia.tum-2015-09\n'.format(http_server.url))
+        f.write('    blockmap: {}\n'.format(blockmap))
+        f.write(
+            '    sha256sum: f8794e3c8676258b0b594ad6e464177dda8d66dbcbb04b301'
+            'd78fd4c9cf2c3dd\n')
+        f.write('    type: zipped-zim\n')
+        f.write('    handler: kiwix\n')
+
+    c.update_cache()
+    del http_server.requests[:]
+    c.upgrade_packages(['wikipedia.tum'])
+
+    library = installdir.join('library.xml')
+    assert 'date="2015-09-10"' in library.read_text('utf-8')
+
+    package_requests = [
+        r for r in http_server.requests
+        if r[:2] == ('GET', '/wikipedia.tum-2015-09')]
+    assert len(package_requests) > 0
+    assert all((r[2] is not None) == ranges for r in package_requests)
+
+
 @pytest.mark.usefixtures('db', 'systemuser')
 def test_catalog_update_package_glob(tmpdir, settings, testdatadir, mocker):
     from ideascube.serveradmin.catalog import Catalog
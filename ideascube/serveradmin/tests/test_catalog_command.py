@@ -9,12 +9,14 @@ import pytest
 import yaml
 
 
-def fake_urlretrieve(url, path, reporthook=None):
+def fake_urlretrieve(url, path, reporthook=None, headers=None):
     assert url.startswith('file://')
 
     src = url[7:]
     shutil.copyfile(src, path)
 
+    return {}
+
 
 def test_no_command(tmpdir, capsys):
     with pytest.raises(SystemExit):
@@ -309,6 +311,22 @@ def test_clear_cache(tmpdir, settings, capsys, monkeypatch):
     assert err.strip() == ''
 
 
+def test_cache_stats(settings, capsys):
+    settings.CATALOG_CACHE_QUOTA = 1024 * 1024
+
+    call_command('catalog', 'cache', 'stats')
+
+    out, err = capsys.readouterr()
+    assert out.rstrip().split('\n') == [
+        '            Packages : 0',
+        '                Size : 0\xa0bytes',
+        '               Quota : 1.0\xa0MB',
+        '         Reclaimable : 0\xa0bytes',
+        '            Hit rate : n/a (0 hits, 0 misses)',
+    ]
+    assert err.strip() == ''
+
+
 def test_split_cache(tmpdir, settings, monkeypatch):
     monkeypatch.setattr(
         'ideascube.serveradmin.catalog.urlretrieve', fake_urlretrieve)
@@ -413,3 +431,49 @@ def test_list_with_unknown_package_must_no_fail(
     assert out.strip() == ('Not handled packages\n'
                            ' foovideos             0             '
                            '0kb      UNKNOWNTYPE     Videos from Foo')
+
+
+def test_background_jobs(tmpdir, settings, capsys, mocker):
+    mocker.patch('os.nice')
+    mocker.patch('subprocess.check_call')
+    mocker.patch(
+        'ideascube.serveradmin.catalog.urlretrieve', fake_urlretrieve)
+
+    remote_catalog_file = tmpdir.mkdir('source').join('catalog.yml')
+    remote_catalog_file.write('all:\n  foovideos:\n    name: Videos from Foo')
+    call_command(
+        'catalog', 'remotes', 'add', 'foo', 'Content from Foo',
+        'file://{}'.format(remote_catalog_file.strpath))
+    remote_catalog_file.write('all:\n  barvideos:\n    name: Videos from Bar')
+    capsys.readouterr()
+
+    call_command('catalog', 'cache', 'update', '--background')
+    out, err = capsys.readouterr()
+    assert out.startswith('Queued job ')
+    assert err.strip() == ''
+
+    # Nothing happened yet
+    catalog = yaml.safe_load(
+        Path(settings.CATALOG_CACHE_ROOT).join('catalog.yml').read())
+    assert list(catalog) == ['foovideos']
+
+    call_command('catalog', 'jobs', 'list')
+    out, err = capsys.readouterr()
+    assert 'pending' in out
+    assert 'update_cache' in out
+
+    call_command('catalog', 'jobs', 'run', '--once')
+    capsys.readouterr()
+
+    catalog = yaml.safe_load(
+        Path(settings.CATALOG_CACHE_ROOT).join('catalog.yml').read())
+    assert list(catalog) == ['barvideos']
+
+    call_command('catalog', 'jobs', 'list')
+    out, err = capsys.readouterr()
+    assert 'done' in out
+
+    call_command('catalog', 'jobs', 'clear')
+    call_command('catalog', 'jobs', 'list')
+    out, err = capsys.readouterr()
+    assert out == ''
@@ -0,0 +1,189 @@
+from hashlib import sha256
+
+import pytest
+from resumable import DownloadError
+
+
+@pytest.fixture
+def seed_and_package(tmpdir):
+    seed = tmpdir.join('package-1')
+    seed.write_binary(b'a' * 4096 + b'b' * 4096 + b'c' * 4096)
+
+    package = tmpdir.join('package-2')
+    package.write_binary(b'a' * 4096 + b'B' * 4096 + b'c' * 4096 + b'd' * 10)
+
+    return seed, package
+
+
+def test_blockmap_from_file(seed_and_package):
+    from ideascube.serveradmin.delta import BlockMap
+
+    _, package = seed_and_package
+    blockmap = BlockMap.from_file(package.strpath, blocksize=4096)
+
+    assert blockmap.blocksize == 4096
+    assert blockmap.size == 4096 * 3 + 10
+    assert blockmap.blocks == [
+        sha256(b'a' * 4096).hexdigest(),
+        sha256(b'B' * 4096).hexdigest(),
+        sha256(b'c' * 4096).hexdigest(),
+        sha256(b'd' * 10).hexdigest(),
+    ]
+    assert blockmap.get_block_range(3) == (4096 * 3, 4096 * 3 + 10)
+
+
+def test_blockmap_to_file(tmpdir, seed_and_package):
+    from ideascube.serveradmin.delta import BlockMap
+
+    _, package = seed_and_package
+    blockmap = BlockMap.from_file(package.strpath, blocksize=4096)
+    blockmap.to_file(tmpdir.join('package-2.blocks').strpath)
+
+    content = tmpdir.join('package-2.blocks').read()
+    assert 'blocksize: 4096' in content
+    assert 'size: 12298' in content
+
+
+def test_invalid_blockmap():
+    from ideascube.serveradmin.delta import BlockMap
+
+    with pytest.raises(ValueError):
+        BlockMap(4096, 4097, ['only-one-block'])
+
+
+def test_get_runs():
+    from ideascube.serveradmin.delta import get_runs
+
+    assert get_runs([]) == []
+    assert get_runs([1, 2, 3, 5, 7, 8]) == [[1, 3], [5, 5], [7, 8]]
+
+
+def test_fetch(tmpdir, http_server, seed_and_package):
+    from ideascube.serveradmin.delta import BlockMap, fetch
+
+    seed, package = seed_and_package
+    package.copy(http_server.root.join('package'))
+    BlockMap.from_file(package.strpath, blocksize=4096).to_file(
+        http_server.root.join('package.blocks').strpath)
+    sha256sum = sha256(package.read_binary()).hexdigest()
+
+    path = tmpdir.join('downloaded')
+    fetched = fetch(
+        [http_server.url + 'package'], 'package.blocks', seed.strpath,
+        path.strpath, sha256sum)
+
+    assert fetched == 2
+    assert path.read_binary() == package.read_binary()
+    assert http_server.requests == [
+        ('GET', '/package.blocks', None),
+        ('GET', '/package', 'bytes=4096-8191'),
+        ('GET', '/package', 'bytes=12288-12297'),
+    ]
+
+
+def test_fetch_corrupted_block(tmpdir, http_server, seed_and_package):
+    from ideascube.serveradmin.delta import BlockMap, fetch
+
+    seed, package = seed_and_package
+    BlockMap.from_file(package.strpath, blocksize=4096).to_file(
+        http_server.root.join('package.blocks').strpath)
+    sha256sum = sha256(package.read_binary()).hexdigest()
+
+    # The served file does not match its block map
+    http_server.root.join('package').write_binary(b'x' * (4096 * 3 + 10))
+
+    path = tmpdir.join('downloaded')
+
+    with pytest.raises(DownloadError):
+        fetch(
+            [http_server.url + 'package'], 'package.blocks', seed.strpath,
+            path.strpath, sha256sum)
+
+    assert path.check(exists=False)
+    assert tmpdir.join('downloaded.delta').check(exists=False)
+
+
+def test_fetch_missing_blockmap(tmpdir, http_server, seed_and_package):
+    from ideascube.serveradmin.delta import fetch
+
+    seed, package = seed_and_package
+    package.copy(http_server.root.join('package'))
+    sha256sum = sha256(package.read_binary()).hexdigest()
+
+    path = tmpdir.join('downloaded')
+
+    with pytest.raises(DownloadError):
+        fetch(
+            [http_server.url + 'package'], 'package.blocks', seed.strpath,
+            path.strpath, sha256sum)
+
+    assert path.check(exists=False)
+
+
+def test_fetch_throttled(tmpdir, http_server, seed_and_package):
+    from ideascube.serveradmin.delta import BlockMap, fetch
+
+    seed, package = seed_and_package
+    package.copy(http_server.root.join('package'))
+    BlockMap.from_file(package.strpath, blocksize=4096).to_file(
+        http_server.root.join('package.blocks').strpath)
+    sha256sum = sha256(package.read_binary()).hexdigest()
+    throttled = []
+
+    path = tmpdir.join('downloaded')
+    fetch(
+        [http_server.url + 'package'], 'package.blocks', seed.strpath,
+        path.strpath, sha256sum, throttle=throttled.append)
+
+    assert sum(throttled) == 4096 + 10
+
+
+def test_fetch_mirror_failover(tmpdir, http_server, seed_and_package):
+    from ideascube.serveradmin.delta import BlockMap, fetch
+
+    seed, package = seed_and_package
+    package.copy(http_server.root.join('package'))
+    BlockMap.from_file(package.strpath, blocksize=4096).to_file(
+        http_server.root.join('package.blocks').strpath)
+    sha256sum = sha256(package.read_binary()).hexdigest()
+
+    # The first mirror has the block map, but it lost the package
+    broken = http_server.root.mkdir('broken')
+    http_server.root.join('package.blocks').copy(broken.join('package.blocks'))
+
+    failures = []
+    path = tmpdir.join('downloaded')
+    fetched = fetch(
+        [http_server.url + 'broken/package', http_server.url + 'package'],
+        'package.blocks', seed.strpath, path.strpath, sha256sum,
+        on_failure=lambda url, e: failures.append(url))
+
+    assert fetched == 2
+    assert path.read_binary() == package.read_binary()
+    assert failures == [http_server.url + 'broken/package']
+    assert http_server.requests == [
+        ('GET', '/broken/package.blocks', None),
+        ('GET', '/broken/package', 'bytes=4096-8191'),
+        ('GET', '/package', 'bytes=4096-8191'),
+        ('GET', '/package', 'bytes=12288-12297'),
+    ]
+
+
+def test_fetch_all_mirrors_fail(tmpdir, http_server, seed_and_package):
+    from ideascube.serveradmin.delta import fetch
+
+    seed, package = seed_and_package
+    sha256sum = sha256(package.read_binary()).hexdigest()
+    failures = []
+
+    path = tmpdir.join('downloaded')
+
+    with pytest.raises(DownloadError):
+        fetch(
+            [http_server.url + 'a/package', http_server.url + 'b/package'],
+            'package.blocks', seed.strpath, path.strpath, sha256sum,
+            on_failure=lambda url, e: failures.append(url))
+
+    assert failures == [
+        http_server.url + 'a/package', http_server.url + 'b/package']
+    assert path.check(exists=False)
@@ -0,0 +1,139 @@
+import pytest
+
+
+@pytest.fixture
+def queue(tmpdir):
+    from ideascube.serveradmin.jobs import JobQueue
+
+    return JobQueue(tmpdir.join('jobs').strpath)
+
+
+def test_submit(queue):
+    from ideascube.serveradmin.jobs import PENDING
+
+    job = queue.submit('install', ids=['foo', 'bar'], peers=['http://box'])
+
+    assert queue.list()[0].to_dict() == job.to_dict()
+    assert job.status == PENDING
+    assert job.ids == ['foo', 'bar']
+    assert job.options == {'peers': ['http://box']}
+
+
+def test_submit_unknown_action(queue):
+    with pytest.raises(ValueError):
+        queue.submit('frobnicate')
+
+
+def test_get_next(queue):
+    from ideascube.serveradmin.jobs import DONE, RUNNING
+
+    first = queue.submit('update_cache')
+    second = queue.submit('install', ids=['foo'])
+    third = queue.submit('remove', ids=['bar'])
+
+    first.status = DONE
+    queue.save(first)
+    assert queue.get_next().id == second.id
+
+    # The worker was interrupted while running the third one
+    third.status = RUNNING
+    queue.save(third)
+    second.status = DONE
+    queue.save(second)
+    assert queue.get_next().id == third.id
+
+    third.status = DONE
+    queue.save(third)
+    assert queue.get_next() is None
+
+
+def test_remove_finished(queue):
+    from ideascube.serveradmin.jobs import FAILED
+
+    failed = queue.submit('install', ids=['foo'])
+    failed.status = FAILED
+    queue.save(failed)
+    pending = queue.submit('install', ids=['bar'])
+
+    queue.remove_finished()
+
+    assert [job.id for job in queue.list()] == [pending.id]
+
+
+def test_only_one_worker(queue):
+    from ideascube.serveradmin.jobs import JobQueue, WorkerAlreadyRunning
+
+    queue.lock()
+
+    with pytest.raises(WorkerAlreadyRunning):
+        JobQueue(queue.root).lock()
+
+    queue.unlock()
+    JobQueue(queue.root).lock()
+
+
+def test_run_job(queue, mocker):
+    from ideascube.serveradmin.jobs import DONE, JobProgress, run_job
+
+    def install_packages(ids):
+        print('Installing', *ids)
+        catalog._bar.update(done=10, total=10)
+
+    catalog = mocker.Mock()
+    catalog.install_packages.side_effect = install_packages
+
+    def factory(bar, **kwargs):
+        catalog._bar = bar
+        return catalog
+
+    job = queue.submit(
+        'install', ids=['foo'], package_caches=['/media/usb'],
+        peers=['http://box'])
+    job = run_job(factory, queue, job)
+
+    assert isinstance(catalog._bar, JobProgress)
+    catalog.add_package_cache.assert_called_once_with('/media/usb')
+    catalog.add_peer.assert_called_once_with('http://box')
+    catalog.install_packages.assert_called_once_with(['foo'])
+
+    job = queue.get(job.id)
+    assert job.status == DONE
+    assert job.progress == {'done': 10, 'total': 10}
+    assert job.started <= job.finished
+
+    with open(queue.get_log_path(job)) as f:
+        assert f.read() == 'Installing foo\n'
+
+
+def test_run_job_fails(queue, mocker):
+    from ideascube.serveradmin.catalog import NoSuchPackage
+    from ideascube.serveradmin.jobs import FAILED, run_job
+
+    catalog = mocker.Mock()
+    catalog.remove_packages.side_effect = NoSuchPackage('foo')
+
+    job = queue.submit('remove', ids=['foo'])
+    run_job(lambda **kwargs: catalog, queue, job)
+
+    job = queue.get(job.id)
+    assert job.status == FAILED
+    assert job.error == 'foo'
+
+
+def test_run(queue, mocker):
+    from ideascube.serveradmin.jobs import DONE, run
+
+    nice = mocker.patch('os.nice')
+    check_call = mocker.patch('subprocess.check_call')
+    catalog = mocker.Mock()
+
+    queue.submit('update_cache')
+    queue.submit('upgrade', ids=['*'])
+    run(lambda **kwargs: catalog, queue, once=True)
+
+    assert [job.status for job in queue.list()] == [DONE, DONE]
+    catalog.update_cache.assert_called_once_with()
+    catalog.upgrade_packages.assert_called_once_with(['*'])
+
+    nice.assert_called_once_with(19)
+    assert check_call.call_args[0][0][:3] == ['ionice', '-c', '3']
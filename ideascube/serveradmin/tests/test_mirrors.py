@@ -0,0 +1,108 @@
+import pytest
+
+
+@pytest.fixture
+def stats(tmpdir):
+    from ideascube.serveradmin.mirrors import MirrorStats
+
+    return MirrorStats(tmpdir.join('mirrors.yml').strpath)
+
+
+def test_get_host():
+    from ideascube.serveradmin.mirrors import get_host
+
+    assert get_host('http://foo.org:8080/path/catalog.yml') == (
+        'http://foo.org:8080')
+
+
+def test_rank_unknown_mirrors_keep_their_order(stats):
+    urls = ['http://foo.org/pkg', 'http://bar.org/pkg', 'http://baz.org/pkg']
+
+    assert stats.rank(urls) == urls
+
+
+def test_rank_by_latency(stats):
+    stats.record('http://foo.org/catalog.yml', latency=0.5)
+    stats.record('http://bar.org/catalog.yml', latency=0.1)
+
+    assert stats.rank(['http://foo.org/pkg', 'http://bar.org/pkg']) == [
+        'http://bar.org/pkg', 'http://foo.org/pkg']
+
+
+def test_rank_by_throughput(stats):
+    # bar answers faster, but foo is much faster for a big package
+    stats.record('http://foo.org/pkg', latency=0.5, throughput=10000000)
+    stats.record('http://bar.org/pkg', latency=0.1, throughput=100000)
+    urls = ['http://foo.org/pkg', 'http://bar.org/pkg']
+
+    assert stats.rank(urls, size=1000) == [
+        'http://bar.org/pkg', 'http://foo.org/pkg']
+    assert stats.rank(urls, size=100000000) == [
+        'http://foo.org/pkg', 'http://bar.org/pkg']
+
+
+def test_rank_failed_last(stats):
+    stats.record('http://foo.org/pkg', latency=0.1)
+    stats.record_failure('http://foo.org/pkg')
+    stats.record('http://bar.org/pkg', latency=2)
+
+    assert stats.rank(['http://foo.org/pkg', 'http://bar.org/pkg']) == [
+        'http://bar.org/pkg', 'http://foo.org/pkg']
+
+    # After a while, we give it another chance
+    stats.failure_penalty = 0
+    assert stats.rank(['http://foo.org/pkg', 'http://bar.org/pkg']) == [
+        'http://foo.org/pkg', 'http://bar.org/pkg']
+
+
+def test_measurements_are_smoothed_and_persisted(tmpdir, stats):
+    from ideascube.serveradmin.mirrors import MirrorStats
+
+    stats.record('http://foo.org/pkg', latency=1, throughput=1000)
+    stats.record('http://foo.org/other', latency=2)
+    stats.save()
+
+    stats = MirrorStats(stats.path)
+    measured = stats.get('http://foo.org/')
+    assert measured['latency'] == pytest.approx(1.3)
+    assert measured['throughput'] == 1000
+
+
+def test_save_keeps_what_others_measured(stats):
+    from ideascube.serveradmin.mirrors import MirrorStats
+
+    other = MirrorStats(stats.path)
+    stats.record('http://foo.org/pkg', latency=1)
+    other.record('http://bar.org/pkg', latency=2)
+    other.save()
+    stats.save()
+
+    stats = MirrorStats(stats.path)
+    assert stats.get('http://foo.org/')['latency'] == 1
+    assert stats.get('http://bar.org/')['latency'] == 2
+
+
+def test_monitor(mocker):
+    from ideascube.serveradmin.mirrors import Monitor, SlowMirror
+
+    now = mocker.patch('time.monotonic', return_value=100)
+    reported = []
+    monitor = Monitor(
+        lambda *args: reported.append(args), min_throughput=1000, window=10)
+
+    now.return_value = 101
+    monitor(0, 5000, 100000)
+    assert monitor.latency == 1
+
+    # Fast enough
+    now.return_value = 111
+    monitor(1, 10000, 100000)
+    assert monitor.throughput == 1500
+
+    # Then it collapses
+    now.return_value = 125
+    with pytest.raises(SlowMirror):
+        monitor(2, 1000, 100000)
+
+    assert reported == [
+        (0, 5000, 100000), (1, 10000, 100000), (2, 1000, 100000)]
@@ -0,0 +1,149 @@
+from hashlib import sha256
+import os
+
+import pytest
+
+
+def make_package(id, version, content):
+    from ideascube.serveradmin.catalog import Package
+
+    return Package(id, {
+        'version': version, 'sha256sum': sha256(content).hexdigest()})
+
+
+@pytest.fixture
+def cache(tmpdir):
+    from ideascube.serveradmin.packagecache import PackageCache
+
+    return PackageCache(tmpdir.mkdir('packages').strpath)
+
+
+def test_add_and_get(tmpdir, cache):
+    package = make_package('foo', '1.0', b'foo content')
+    downloaded = tmpdir.join('foo-1.0')
+    downloaded.write_binary(b'foo content')
+
+    path = cache.add(package, downloaded.strpath)
+
+    assert downloaded.check(exists=False)
+    assert path == os.path.join(cache.root, 'foo-1.0')
+    assert os.path.islink(path)
+    assert open(path, 'rb').read() == b'foo content'
+    assert cache.get(package) == path
+
+
+def test_get_missing(tmpdir, cache):
+    package = make_package('foo', '1.0', b'foo content')
+
+    assert cache.get(package) is None
+    assert cache.get_stats()['misses'] == 1
+
+
+def test_identical_packages_are_stored_once(tmpdir, cache):
+    foo = make_package('foo', '1.0', b'same content')
+    bar = make_package('bar', '2.0', b'same content')
+
+    tmpdir.join('foo-1.0').write_binary(b'same content')
+    tmpdir.join('bar-2.0').write_binary(b'same content')
+    cache.add(foo, tmpdir.join('foo-1.0').strpath)
+    cache.add(bar, tmpdir.join('bar-2.0').strpath)
+
+    assert tmpdir.join('bar-2.0').check(exists=False)
+    assert len(os.listdir(os.path.join(cache.root, 'objects'))) == 1
+    assert cache.get_stats()['size'] == len(b'same content')
+
+    # The second one is found even though it was never downloaded as such
+    baz = make_package('baz', '3.0', b'same content')
+    assert cache.get(baz) == os.path.join(cache.root, 'baz-3.0')
+
+
+def test_evict_least_recently_used(tmpdir, cache):
+    packages = []
+
+    for i, id in enumerate(('foo', 'bar', 'baz')):
+        content = id.encode() * 10
+        package = make_package(id, '1.0', content)
+        path = tmpdir.join(id)
+        path.write_binary(content)
+        cache.add(package, path.strpath)
+        os.utime(
+            os.path.join(cache.root, 'objects', package.sha256sum),
+            (1000 + i, 1000 + i))
+        packages.append(package)
+
+    foo, bar, baz = packages
+
+    # Each object is 30 bytes, we need to evict one
+    cache.quota = 60
+    evicted = cache.evict(keep={foo.sha256sum})
+
+    assert evicted == [bar.sha256sum]
+    assert cache.get(foo) is not None
+    assert cache.get(bar) is None
+    assert cache.get(baz) is not None
+    assert not os.path.lexists(os.path.join(cache.root, 'bar-1.0'))
+
+
+def test_evict_without_quota(tmpdir, cache):
+    package = make_package('foo', '1.0', b'foo content')
+    tmpdir.join('foo').write_binary(b'foo content')
+    cache.add(package, tmpdir.join('foo').strpath)
+
+    assert cache.evict() == []
+    assert cache.get(package) is not None
+
+
+def test_clear_keeps_some(tmpdir, cache):
+    foo = make_package('foo', '1.0', b'foo content')
+    bar = make_package('bar', '1.0', b'bar content')
+    tmpdir.join('foo').write_binary(b'foo content')
+    tmpdir.join('bar').write_binary(b'bar content')
+    cache.add(foo, tmpdir.join('foo').strpath)
+    cache.add(bar, tmpdir.join('bar').strpath)
+
+    # Some leftover from an interrupted download
+    tmpdir.join('packages', 'baz-1.0.part').write_binary(b'baz')
+
+    cache.clear(keep={foo.sha256sum})
+
+    assert sorted(os.listdir(cache.root)) == ['foo-1.0', 'objects']
+    assert cache.get(foo) is not None
+    assert cache.get(bar) is None
+
+
+def test_stats(tmpdir, cache):
+    foo = make_package('foo', '1.0', b'foo content')
+    bar = make_package('bar', '1.0', b'bar content!')
+
+    assert cache.get_stats() == {
+        'hits': 0, 'misses': 0, 'objects': 0, 'size': 0, 'reclaimable': 0,
+        'hit_rate': None, 'quota': None}
+
+    cache.get(foo)
+    tmpdir.join('foo').write_binary(b'foo content')
+    tmpdir.join('bar').write_binary(b'bar content!')
+    cache.add(foo, tmpdir.join('foo').strpath)
+    cache.add(bar, tmpdir.join('bar').strpath)
+    cache.get(foo)
+    cache.get(bar)
+    cache.get(foo, record=False)
+
+    assert cache.get_stats(keep={foo.sha256sum}) == {
+        'hits': 2, 'misses': 1, 'objects': 2, 'size': 23, 'reclaimable': 12,
+        'hit_rate': 2 / 3, 'quota': None}
+
+
+def test_stats_recorded_concurrently(cache):
+    from concurrent.futures import ThreadPoolExecutor
+    from ideascube.serveradmin.packagecache import PackageCache
+
+    package = make_package('foo', '1.0', b'foo content')
+
+    def get(_):
+        # As would the peer server and the catalog, each with its own cache
+        PackageCache(cache.root).get(package)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(get, range(100)))
+
+    assert cache.get_stats()['misses'] == 100
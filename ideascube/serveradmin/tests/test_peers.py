@@ -0,0 +1,61 @@
+from hashlib import sha256
+
+import requests
+
+
+def add_package(tmpdir, cache, content):
+    from ideascube.serveradmin.catalog import Package
+
+    sha256sum = sha256(content).hexdigest()
+    package = Package('foo', {'version': '1.0', 'sha256sum': sha256sum})
+    path = tmpdir.join('foo-1.0')
+    path.write_binary(content)
+    cache.add(package, path.strpath)
+
+    return sha256sum
+
+
+def test_get_package_url():
+    from ideascube.serveradmin.peers import get_package_url
+
+    assert get_package_url('http://box:8090', 'abcd') == (
+        'http://box:8090/packages/abcd')
+    assert get_package_url('http://box:8090/', 'abcd') == (
+        'http://box:8090/packages/abcd')
+
+
+def test_serve_package(tmpdir, peer_server):
+    from ideascube.serveradmin.peers import get_package_url
+
+    sha256sum = add_package(tmpdir, peer_server.cache, b'foo content')
+    url = get_package_url(peer_server.url, sha256sum)
+
+    resp = requests.get(url)
+    assert resp.status_code == 200
+    assert resp.content == b'foo content'
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+
+    resp = requests.get(url, headers={'Range': 'bytes=4-'})
+    assert resp.status_code == 206
+    assert resp.content == b'content'
+    assert resp.headers['Content-Range'] == 'bytes 4-10/11'
+
+    resp = requests.get(url, headers={'Range': 'bytes=11-'})
+    assert resp.status_code == 416
+
+    resp = requests.get(url, headers={'Range': 'bytes=8-4'})
+    assert resp.status_code == 416
+
+
+def test_serve_only_packages(tmpdir, peer_server):
+    from ideascube.serveradmin.peers import get_package_url
+
+    add_package(tmpdir, peer_server.cache, b'foo content')
+
+    for path in ('foo-1.0', 'stats.yml', 'packages/../stats.yml',
+                 'packages/foo-1.0'):
+        resp = requests.get(peer_server.url + path)
+        assert resp.status_code == 404
+
+    resp = requests.get(get_package_url(peer_server.url, 'a' * 64))
+    assert resp.status_code == 404
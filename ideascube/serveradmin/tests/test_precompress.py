@@ -0,0 +1,48 @@
+import gzip
+import os
+
+
+def test_compress_file(tmpdir):
+    from ideascube.serveradmin.precompress import compress_file
+
+    path = tmpdir.join('index.html')
+    path.write_binary(b'<p>Hello</p>' * 1000)
+
+    assert compress_file(path.strpath)
+
+    gzpath = tmpdir.join('index.html.gz')
+    assert gzip.decompress(gzpath.read_binary()) == b'<p>Hello</p>' * 1000
+    assert gzpath.mtime() == path.mtime()
+
+
+def test_compress_file_not_smaller(tmpdir):
+    from ideascube.serveradmin.precompress import compress_file
+
+    path = tmpdir.join('random.js')
+    path.write_binary(os.urandom(4096))
+
+    assert not compress_file(path.strpath)
+    assert tmpdir.join('random.js.gz').check(exists=False)
+
+
+def test_precompress(tmpdir):
+    from ideascube.serveradmin.precompress import precompress
+
+    root = tmpdir.mkdir('site')
+    root.join('index.html').write('<p>Hello</p>' * 1000)
+    root.mkdir('static').join('style.css').write('p {color: red}\n' * 1000)
+    root.join('static', 'photo.jpg').write_binary(b'\xff' * 10000)
+    root.join('small.html').write('<p>Hello</p>')
+
+    # Shipped compressed already
+    root.join('app.js').write('var foo;\n' * 1000)
+    root.join('app.js.gz').write_binary(gzip.compress(b'shipped'))
+
+    assert precompress(root.strpath, workers=2) == 2
+
+    assert root.join('index.html.gz').check(file=True)
+    assert root.join('static', 'style.css.gz').check(file=True)
+    assert root.join('static', 'photo.jpg.gz').check(exists=False)
+    assert root.join('small.html.gz').check(exists=False)
+    assert gzip.decompress(root.join('app.js.gz').read_binary()) == (
+        b'shipped')
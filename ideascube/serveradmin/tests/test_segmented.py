@@ -0,0 +1,102 @@
+from hashlib import sha256
+
+import pytest
+from resumable import DownloadError
+import yaml
+
+
+@pytest.fixture
+def remote_file(http_server):
+    path = http_server.root.join('package')
+    path.write_binary(bytes(range(256)) * 40)
+
+    return path
+
+
+def test_split():
+    from ideascube.serveradmin.segmented import split
+
+    assert split(10, 3) == [[0, 3, 0], [3, 6, 0], [6, 10, 0]]
+    assert split(10, 1) == [[0, 10, 0]]
+
+
+def test_get_size(http_server, remote_file):
+    from ideascube.serveradmin.segmented import get_size
+
+    assert get_size(http_server.url + 'package') == 10240
+    assert get_size(http_server.url + 'no-such-package') is None
+
+
+def test_urlretrieve(tmpdir, http_server, remote_file):
+    from ideascube.serveradmin.segmented import urlretrieve
+
+    sha256sum = sha256(remote_file.read_binary()).hexdigest()
+    path = tmpdir.join('downloaded')
+    progress = []
+
+    urlretrieve(
+        http_server.url + 'package', path.strpath, 10240, sha256sum,
+        segments=3, progress=lambda done, total: progress.append(done))
+
+    assert path.read_binary() == remote_file.read_binary()
+    assert tmpdir.join('downloaded.part').check(exists=False)
+    assert tmpdir.join('downloaded.segments').check(exists=False)
+    assert sorted(r[2] for r in http_server.requests) == [
+        'bytes=0-3412', 'bytes=3413-6825', 'bytes=6826-10239']
+    assert progress[-1] == 10240
+
+
+def test_urlretrieve_resumes(tmpdir, http_server, remote_file):
+    from ideascube.serveradmin.segmented import is_partial, urlretrieve
+
+    content = remote_file.read_binary()
+    sha256sum = sha256(content).hexdigest()
+    url = http_server.url + 'package'
+    path = tmpdir.join('downloaded')
+
+    # Simulate an interrupted download, where the first segment completed
+    # and the second one got 100 bytes
+    partial = bytearray(10240)
+    partial[0:5120] = content[0:5120]
+    partial[5120:5220] = content[5120:5220]
+    tmpdir.join('downloaded.part').write_binary(bytes(partial))
+    tmpdir.join('downloaded.segments').write(yaml.safe_dump({
+        'url': url, 'size': 10240,
+        'segments': [[0, 5120, 5120], [5120, 10240, 100]]}))
+    assert is_partial(path.strpath)
+
+    urlretrieve(url, path.strpath, 10240, sha256sum, segments=2)
+
+    assert path.read_binary() == content
+    assert not is_partial(path.strpath)
+    assert http_server.requests == [('GET', '/package', 'bytes=5220-10239')]
+
+
+def test_urlretrieve_invalid_checksum(tmpdir, http_server, remote_file):
+    from ideascube.serveradmin.segmented import urlretrieve
+
+    path = tmpdir.join('downloaded')
+
+    with pytest.raises(DownloadError):
+        urlretrieve(
+            http_server.url + 'package', path.strpath, 10240, 'wrong',
+            segments=3)
+
+    assert path.check(exists=False)
+    assert tmpdir.join('downloaded.part').check(exists=False)
+    assert tmpdir.join('downloaded.segments').check(exists=False)
+
+
+def test_state_only_records_synced_bytes(tmpdir, http_server, remote_file):
+    from ideascube.serveradmin.segmented import Download
+
+    path = tmpdir.join('downloaded')
+    download = Download(http_server.url + 'package', path.strpath, 10240, 2)
+
+    # The second segment got bytes which were not synced yet
+    download.segments[1][2] = 100
+    download._synced[0] = 5120
+    download._save_state()
+
+    state = yaml.safe_load(tmpdir.join('downloaded.segments').read())
+    assert state['segments'] == [[0, 5120, 5120], [5120, 10240, 0]]
@@ -118,6 +118,23 @@ def test_restart_service(mocker):
     manager.restart('NetworkManager.service')
 
 
+def test_reload_service(mocker):
+    from ideascube.serveradmin.systemd import Manager
+
+    mocker.patch(
+        'ideascube.serveradmin.systemd.dbus.SystemBus', side_effect=FakeBus)
+    popen = mocker.patch(
+        'ideascube.serveradmin.systemd.subprocess.Popen', side_effect=FakePopen)
+    mocker.patch(
+        'ideascube.serveradmin.systemd.subprocess.PIPE', side_effect=BytesIO)
+
+    manager = Manager()
+    manager.reload('NetworkManager.service')
+
+    assert popen.call_args[0][0] == [
+        'pkexec', 'systemctl', 'reload', 'NetworkManager.service']
+
+
 def test_unit(mocker):
     from ideascube.serveradmin.systemd import Unit
 
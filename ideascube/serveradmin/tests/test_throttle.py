@@ -0,0 +1,135 @@
+from datetime import datetime, time
+
+import pytest
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket():
+    from ideascube.serveradmin.throttle import TokenBucket
+
+    clock = FakeClock()
+    bucket = TokenBucket(1000, clock=clock, sleep=clock.sleep)
+
+    # The bucket starts full
+    assert bucket.consume(1000) == 0
+
+    assert bucket.consume(500) == 0.5
+    assert clock.sleeps == [0.5]
+
+    # Tokens came back while we were away, but no more than the capacity
+    clock.now += 10
+    assert bucket.consume(1000) == 0
+    assert bucket.consume(2000) == 2
+
+
+def test_token_bucket_borrow():
+    from ideascube.serveradmin.throttle import TokenBucket
+
+    clock = FakeClock()
+    bucket = TokenBucket(1000, capacity=0, clock=clock, sleep=lambda s: None)
+
+    # Concurrent consumers queue up
+    assert bucket.consume(1000) == 1
+    assert bucket.consume(1000) == 2
+
+
+@pytest.mark.parametrize('window, when, expected', [
+    ('22:00-06:00', time(23, 0), True),
+    ('22:00-06:00', time(3, 0), True),
+    ('22:00-06:00', time(6, 0), False),
+    ('22:00-06:00', time(12, 0), False),
+    ('12:00-14:00', time(12, 0), True),
+    ('12:00-14:00', time(14, 30), False),
+    ('00:00-00:00', time(14, 30), True),
+])
+def test_time_window(window, when, expected):
+    from ideascube.serveradmin.throttle import TimeWindow
+
+    assert (when in TimeWindow.parse(window)) is expected
+
+
+def test_time_window_invalid():
+    from ideascube.serveradmin.throttle import TimeWindow
+
+    with pytest.raises(ValueError):
+        TimeWindow.parse('22h-6h')
+
+
+def test_time_window_next_start():
+    from ideascube.serveradmin.throttle import TimeWindow
+
+    window = TimeWindow.parse('22:00-06:00')
+
+    assert window.get_next_start(datetime(2016, 10, 1, 12, 0)) == (
+        datetime(2016, 10, 1, 22, 0))
+    assert window.get_next_start(datetime(2016, 10, 1, 23, 0)) == (
+        datetime(2016, 10, 2, 22, 0))
+
+
+def test_throttle_full_speed_in_window():
+    from ideascube.serveradmin.throttle import Throttle
+
+    sleeps = []
+    throttle = Throttle(
+        rate=1000, windows=['22:00-06:00'],
+        now=lambda: datetime(2016, 10, 1, 23, 0), sleep=sleeps.append)
+
+    assert throttle(10000) == 0
+    assert sleeps == []
+
+
+def test_throttle_limited_outside_window():
+    from ideascube.serveradmin.throttle import Throttle
+
+    sleeps = []
+    throttle = Throttle(
+        rate=1000, windows=['22:00-06:00'],
+        now=lambda: datetime(2016, 10, 1, 12, 0), sleep=sleeps.append)
+
+    throttle(1000)
+    assert throttle(1000) > 0
+    assert len(sleeps) == 1
+
+
+def test_throttle_pause_outside_window():
+    from ideascube.serveradmin.throttle import OutsideWindow, Throttle
+
+    now = datetime(2016, 10, 1, 12, 0)
+    sleeps = []
+    throttle = Throttle(
+        windows=['22:00-06:00'], pause=True, now=lambda: now,
+        sleep=sleeps.append)
+
+    with pytest.raises(OutsideWindow):
+        throttle(1000)
+
+    def sleep(seconds):
+        nonlocal now
+        sleeps.append(seconds)
+        now = datetime(2016, 10, 1, 22, 0)
+
+    throttle._sleep = sleep
+    throttle.wait_for_window()
+    assert sleeps == [10 * 3600]
+    assert throttle(1000) == 0
+
+
+def test_throttle_no_pause_without_windows():
+    from ideascube.serveradmin.throttle import Throttle
+
+    throttle = Throttle(pause=True, sleep=lambda s: 1 / 0)
+
+    throttle.wait_for_window()
+    assert throttle(1000) == 0
@@ -0,0 +1,93 @@
+import os
+import zipfile
+
+import pytest
+
+
+@pytest.fixture
+def archive(tmpdir):
+    path = tmpdir.join('archive.zip')
+
+    with zipfile.ZipFile(path.strpath, 'w') as z:
+        z.writestr('data/', '')
+        z.writestr(
+            'data/content/stored.zim', b'stored' * 10000,
+            compress_type=zipfile.ZIP_STORED)
+        z.writestr(
+            'data/library/deflated.xml', b'deflated' * 10000,
+            compress_type=zipfile.ZIP_DEFLATED)
+        z.writestr(
+            'data/content/empty.zim', b'', compress_type=zipfile.ZIP_STORED)
+        z.writestr(
+            '../../evil', b'evil', compress_type=zipfile.ZIP_STORED)
+
+    return path
+
+
+def test_get_data_offset(archive):
+    from ideascube.serveradmin.zipextract import get_data_offset
+
+    with zipfile.ZipFile(archive.strpath) as z:
+        info = z.getinfo('data/content/stored.zim')
+
+    with archive.open('rb') as f:
+        f.seek(get_data_offset(f, info))
+        assert f.read(info.file_size) == b'stored' * 10000
+
+
+def test_extractall(tmpdir, archive):
+    from ideascube.serveradmin.zipextract import extractall
+
+    outdir = tmpdir.mkdir('out')
+
+    with zipfile.ZipFile(archive.strpath) as z:
+        extractall(z, outdir.strpath)
+
+    assert outdir.join('data', 'content', 'stored.zim').read_binary() == (
+        b'stored' * 10000)
+    assert outdir.join('data', 'library', 'deflated.xml').read_binary() == (
+        b'deflated' * 10000)
+    assert outdir.join('data', 'content', 'empty.zim').read_binary() == b''
+    assert outdir.join('evil').read_binary() == b'evil'
+    assert tmpdir.join('evil').check(exists=False)
+
+
+def test_extractall_members(tmpdir, archive):
+    from ideascube.serveradmin.zipextract import extractall
+
+    outdir = tmpdir.mkdir('out')
+
+    with zipfile.ZipFile(archive.strpath) as z:
+        extractall(z, outdir.strpath, members=['data/content/stored.zim'])
+
+    assert outdir.join('data', 'content', 'stored.zim').check(file=True)
+    assert outdir.join('data', 'library').check(exists=False)
+
+
+@pytest.mark.parametrize(
+    'unsupported',
+    [
+        ('_reflink',),
+        ('_reflink', '_copy_file_range'),
+        ('_reflink', '_copy_file_range', '_sendfile'),
+    ],
+    ids=['copy_file_range', 'sendfile', 'read-write'])
+def test_copy_range_fallbacks(tmpdir, mocker, unsupported):
+    from ideascube.serveradmin import zipextract
+
+    def fail(src, dst, offset, length):
+        # Pretend we got interrupted in the middle
+        os.write(dst, b'garbage')
+        raise OSError('Not supported')
+
+    for name in unsupported:
+        mocker.patch.object(zipextract, name, side_effect=fail)
+
+    src = tmpdir.join('src')
+    src.write_binary(b'header' + b'x' * 100000 + b'footer')
+    dst = tmpdir.join('dst')
+
+    with src.open('rb') as s, dst.open('wb') as d:
+        zipextract.copy_range(s.fileno(), d.fileno(), 6, 100000)
+
+    assert dst.read_binary() == b'x' * 100000
@@ -0,0 +1,136 @@
+"""Shape the bandwidth used by the catalog downloads
+
+Boxes often share a slow uplink with everything else happening around them.
+Downloads can be limited to a maximum rate, with a token bucket shared by
+all the transfers of the catalog, e.g the segments of a download.
+
+Download windows (e.g 22:00-06:00) can also be defined, during which there
+is no limit. Background jobs go further: they only download during the
+windows, pausing when one ends and resuming when the next one starts, from
+the partial files which were left.
+"""
+from datetime import datetime, timedelta
+from threading import Lock
+import time
+
+from django.conf import settings
+
+
+class OutsideWindow(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None, clock=time.monotonic,
+                 sleep=time.sleep):
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = Lock()
+        self._tokens = self.capacity
+        self._last = clock()
+
+    def consume(self, amount):
+        """Take amount tokens, waiting until they are available
+
+        Tokens can be borrowed, concurrent consumers then all wait for their
+        turn. Returns how long we waited.
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+
+        if wait > 0:
+            self._sleep(wait)
+
+        return wait
+
+
+class TimeWindow:
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def parse(cls, window):
+        """Parse a 'HH:MM-HH:MM' window, which may span midnight"""
+        try:
+            start, end = (
+                datetime.strptime(t.strip(), '%H:%M').time()
+                for t in window.split('-'))
+
+        except ValueError:
+            raise ValueError('Invalid time window: {}'.format(window))
+
+        return cls(start, end)
+
+    def __contains__(self, when):
+        if self.start == self.end:
+            # The whole day
+            return True
+
+        if self.start < self.end:
+            return self.start <= when < self.end
+
+        return when >= self.start or when < self.end
+
+    def get_next_start(self, now):
+        start = datetime.combine(now.date(), self.start)
+
+        if start <= now:
+            start += timedelta(days=1)
+
+        return start
+
+
+class Throttle:
+    def __init__(self, rate=None, windows=(), pause=False, now=datetime.now,
+                 sleep=time.sleep):
+        self.windows = [TimeWindow.parse(w) for w in windows]
+        self.pause = pause and bool(self.windows)
+
+        self._bucket = TokenBucket(rate, sleep=sleep) if rate else None
+        self._now = now
+        self._sleep = sleep
+
+    @classmethod
+    def from_settings(cls, pause=False):
+        return cls(
+            rate=getattr(settings, 'CATALOG_DOWNLOAD_RATE', None),
+            windows=getattr(settings, 'CATALOG_DOWNLOAD_WINDOWS', ()),
+            pause=pause)
+
+    def in_window(self):
+        now = self._now().time()
+        return any(now in window for window in self.windows)
+
+    def wait_for_window(self):
+        """Wait for the next download window, if we must"""
+        while self.pause and not self.in_window():
+            now = self._now()
+            start = min(w.get_next_start(now) for w in self.windows)
+            self._sleep(max((start - now).total_seconds(), 1))
+
+    def __call__(self, amount):
+        """Account for amount bytes which were just received
+
+        This waits as long as needed to respect the rate limit, and returns
+        how long it waited. It raises OutsideWindow if we must pause until
+        the next download window.
+        """
+        if self.windows and self.in_window():
+            return 0
+
+        if self.pause:
+            raise OutsideWindow()
+
+        if self._bucket is None:
+            return 0
+
+        return self._bucket.consume(amount)
@@ -3,12 +3,12 @@ from subprocess import call
 import batinfo
 from django.conf import settings
 from django.contrib import messages
-from django.http import StreamingHttpResponse
 from django.shortcuts import render
 from django.utils.translation import ugettext as _
 
 from ideascube.configuration import get_config, set_config
 from ideascube.decorators import staff_member_required
+from ideascube.downloads import send_file
 from ideascube.utils import get_all_languages
 
 from .backup import Backup
@@ -151,10 +151,7 @@ def backup(request):
                     filename=backup.name
                 )
             elif 'do_download' in request.POST:
-                response = StreamingHttpResponse(open(backup.path, 'rb'))
-                cd = 'attachment; filename="{name}"'.format(name=backup.name)
-                response['Content-Disposition'] = cd
-                return response
+                return send_file(request, backup.path, filename=backup.name)
             if msg:
                 messages.add_message(request, messages.SUCCESS, msg)
     context = {
@@ -0,0 +1,175 @@
+"""Fast extraction of uncompressed zip members
+
+ZIM files are already compressed, so our packages store them in the zip
+archives without compressing them again (ZIP_STORED). Extracting them with
+the zipfile module still pushes every byte through Python buffers, which
+makes installing a big ZIM file CPU-bound.
+
+For stored members we can instead copy the data straight from the archive to
+the destination file, letting the kernel do the work: either by sharing the
+blocks (reflink) on filesystems which support it, or with copy_file_range or
+sendfile. Compressed members are extracted the usual way.
+
+The CRC of members extracted this way is not verified, which is fine as our
+packages are verified with their sha256 checksum when they are downloaded.
+"""
+import fcntl
+import os
+import struct
+import zipfile
+
+
+# From linux/fs.h
+FICLONERANGE = 0x4020940d
+
+# See the "local file header" section of the zip specification
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+LOCAL_HEADER_SIGNATURE = b'PK\003\004'
+
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def get_data_offset(fileobj, info):
+    """Get the offset of the data of a zip member in the archive"""
+    fileobj.seek(info.header_offset)
+    header = fileobj.read(LOCAL_HEADER.size)
+
+    if len(header) != LOCAL_HEADER.size:
+        raise zipfile.BadZipFile('Truncated local header')
+
+    header = LOCAL_HEADER.unpack(header)
+
+    if header[0] != LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile('Bad magic number for local header')
+
+    # The name and extra field lengths of the local header may differ from
+    # the ones in the central directory
+    name_length, extra_length = header[-2:]
+
+    return info.header_offset + LOCAL_HEADER.size + name_length + extra_length
+
+
+def _reflink(src, dst, offset, length):
+    # The kernel only accepts block-aligned ranges, except at the end of the
+    # source file. It tells us with EINVAL when that isn't the case.
+    args = struct.pack('qQQQ', src, offset, length, 0)
+    fcntl.ioctl(dst, FICLONERANGE, args)
+
+
+def _copy_file_range(src, dst, offset, length):
+    copied = 0
+
+    while copied < length:
+        count = min(length - copied, COPY_CHUNK_SIZE)
+        sent = os.copy_file_range(src, dst, count, offset + copied, copied)
+
+        if sent == 0:
+            raise zipfile.BadZipFile('Truncated zip member')
+
+        copied += sent
+
+
+def _sendfile(src, dst, offset, length):
+    copied = 0
+
+    while copied < length:
+        count = min(length - copied, COPY_CHUNK_SIZE)
+        sent = os.sendfile(dst, src, offset + copied, count)
+
+        if sent == 0:
+            raise zipfile.BadZipFile('Truncated zip member')
+
+        copied += sent
+
+
+def _copy(src, dst, offset, length):
+    os.lseek(src, offset, os.SEEK_SET)
+    copied = 0
+
+    while copied < length:
+        data = os.read(src, min(length - copied, COPY_CHUNK_SIZE))
+
+        if not data:
+            raise zipfile.BadZipFile('Truncated zip member')
+
+        os.write(dst, data)
+        copied += len(data)
+
+
+def copy_range(src, dst, offset, length):
+    """Copy length bytes at offset in src to the beginning of dst
+
+    Both src and dst are file descriptors. This uses the most efficient
+    method supported by the platform and the filesystems.
+    """
+    if length == 0:
+        return
+
+    methods = [_reflink]
+
+    if hasattr(os, 'copy_file_range'):
+        methods.append(_copy_file_range)
+
+    if hasattr(os, 'sendfile'):
+        methods.append(_sendfile)
+
+    for method in methods:
+        try:
+            method(src, dst, offset, length)
+            return
+
+        except OSError:
+            # Not supported here, try the next one from the beginning
+            os.ftruncate(dst, 0)
+            os.lseek(dst, 0, os.SEEK_SET)
+
+    _copy(src, dst, offset, length)
+
+
+def get_target_path(info, path):
+    """Get where a member should be extracted, like zipfile does it"""
+    arcname = info.filename.replace('/', os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    invalid = ('', os.path.curdir, os.path.pardir)
+    arcname = os.path.sep.join(
+        x for x in arcname.split(os.path.sep) if x not in invalid)
+
+    return os.path.join(path, arcname)
+
+
+def extract_stored(z, info, path):
+    targetpath = get_target_path(info, path)
+    os.makedirs(os.path.dirname(targetpath), exist_ok=True)
+
+    with open(z.filename, 'rb') as src, open(targetpath, 'wb') as dst:
+        offset = get_data_offset(src, info)
+        copy_range(src.fileno(), dst.fileno(), offset, info.file_size)
+
+    return targetpath
+
+
+def is_stored(info):
+    encrypted = info.flag_bits & 0x1
+
+    return (info.compress_type == zipfile.ZIP_STORED and not encrypted
+            and not info.filename.endswith('/'))
+
+
+def extractall(z, path, members=None):
+    """Extract the members of the ZipFile z in path
+
+    This behaves like ZipFile.extractall, except that stored members are
+    copied without going through Python.
+    """
+    if members is None:
+        members = z.infolist()
+
+    for member in members:
+        if not isinstance(member, zipfile.ZipInfo):
+            member = z.getinfo(member)
+
+        if z.filename is not None and is_stored(member):
+            extract_stored(z, member, path)
+
+        else:
+            z.extract(member, path)
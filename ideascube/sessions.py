@@ -0,0 +1,51 @@
+"""A session engine which keeps the sessions out of the database
+
+Sessions are saved on every request, to log the members out after an hour
+of inactivity. With the database engine, that is a write to the backed up
+SQLite database for every page, and all the requests wait for each other on
+its lock.
+
+Instead, each session is a file in SESSION_FILE_PATH, outside of the backed
+up data. When a session did not change, its expiry is refreshed by touching
+its file, at most once every SESSION_REFRESH_INTERVAL seconds, so members
+are logged out between SESSION_COOKIE_AGE minus that interval and
+SESSION_COOKIE_AGE after their last request.
+"""
+import os
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.file import (
+    SessionStore as FileSessionStore)
+
+
+class SessionStore(FileSessionStore):
+    @classmethod
+    def _get_storage_path(cls):
+        # Not cached on the class, unlike in Django, as tests change it
+        path = settings.SESSION_FILE_PATH
+        os.makedirs(path, exist_ok=True)
+
+        return path
+
+    def save(self, must_create=False):
+        if must_create or self.modified or self.session_key is None:
+            return super().save(must_create=must_create)
+
+        path = self._key_to_file()
+
+        try:
+            age = time.time() - os.stat(path).st_mtime
+
+        except FileNotFoundError:
+            return super().save(must_create=must_create)
+
+        if age < getattr(settings, 'SESSION_REFRESH_INTERVAL', 60):
+            return
+
+        if age < self.get_expiry_age():
+            # The expiry of a session is the modification time of its file
+            os.utime(path)
+            return
+
+        return super().save(must_create=must_create)
@@ -51,15 +51,31 @@ finally:
     CATALOG_STORAGE_ROOT = (
         ldict.get('CATALOG_STORAGE_ROOT')
         or os.path.join(BACKUPED_ROOT, 'catalog'))
+    SESSION_FILE_PATH = (
+        ldict.get('SESSION_FILE_PATH')
+        or os.path.join(STORAGE_ROOT, 'sessions'))
+
+    if not ldict.get('CACHES'):
+        CACHES = {
+            'default': {
+                'BACKEND': 'ideascube.cache.SQLiteCache',
+                'LOCATION': os.path.join(STORAGE_ROOT, 'cache.sqlite'),
+                'OPTIONS': {
+                    'MAX_SIZE': 64 * 1024 * 1024,
+                },
+            }
+        }
 
     if not getattr(ldict, 'DATABASES', None):
         DATABASES = {
             'default': {
                 'ENGINE': 'django.db.backends.sqlite3',
                 'NAME': os.path.join(BACKUPED_ROOT, 'default.sqlite'),
+                'CONN_MAX_AGE': 600,
             },
             'transient': {
                 'ENGINE': 'django.db.backends.sqlite3',
                 'NAME': os.path.join(STORAGE_ROOT, 'transient.sqlite'),
+                'CONN_MAX_AGE': 600,
             }
         }
@@ -0,0 +1,162 @@
+"""Tune the SQLite connections
+
+The pragmas of SQLITE_PRAGMAS are applied to each new connection of the
+listed databases. By default, they use the write-ahead log, so that readers
+and the writer do not wait for each other, and they only sync to disk at
+checkpoints.
+
+Connections are persistent (see CONN_MAX_AGE), so they are checked at the
+beginning of each request: a connection to a database file which was
+replaced (e.g when restoring a backup) is closed. The write-ahead log is also
+checkpointed every SQLITE_CHECKPOINT_INTERVAL seconds, after a request, not
+to let it grow between the automatic checkpoints.
+"""
+from contextlib import contextmanager
+import os
+import time
+
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+CHECKPOINT_MODES = ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE')
+
+
+def get_pragmas(alias):
+    return getattr(settings, 'SQLITE_PRAGMAS', {}).get(alias, [])
+
+
+def get_path(connection):
+    name = connection.settings_dict['NAME']
+
+    if not name or name == ':memory:' or name.startswith('file:'):
+        return None
+
+    return name
+
+
+def get_inode(connection):
+    path = get_path(connection)
+
+    if path is None:
+        return None
+
+    try:
+        return os.stat(path).st_ino
+
+    except FileNotFoundError:
+        return None
+
+
+def get_connections():
+    """The open connections to the tuned databases"""
+    for alias in connections:
+        connection = connections[alias]
+
+        if (connection.vendor == 'sqlite' and get_pragmas(alias)
+                and connection.connection is not None):
+            yield connection
+
+
+def checkpoint(connection, mode='PASSIVE'):
+    """Checkpoint the write-ahead log of the database
+
+    Returns the (busy, log pages, checkpointed pages) reported by SQLite.
+    """
+    if mode not in CHECKPOINT_MODES:
+        raise ValueError('Unknown checkpoint mode: {}'.format(mode))
+
+    connection.ensure_connection()
+    cursor = connection.connection.cursor()
+
+    try:
+        cursor.execute('PRAGMA wal_checkpoint({})'.format(mode))
+        result = cursor.fetchone()
+
+    finally:
+        cursor.close()
+
+    connection.ideascube_checkpointed = time.monotonic()
+
+    return result
+
+
+@contextmanager
+def immediate_atomic(using=None):
+    """Like transaction.atomic(), but taking the write lock right away
+
+    SQLite transactions only take the write lock at their first write, so
+    two of them can read the same rows before writing based on them. A
+    transaction started with BEGIN IMMEDIATE makes the other writers wait.
+
+    Nested blocks are savepoints, they run in the transaction of the outer
+    block, which took the lock if it already wrote.
+    """
+    connection = transaction.get_connection(using)
+
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with transaction.atomic(using=using):
+            yield
+
+        return
+
+    def begin():
+        connection.cursor().execute('BEGIN IMMEDIATE')
+
+    # Django starts the transactions of SQLite with a plain (deferred) BEGIN
+    connection._start_transaction_under_autocommit = begin
+
+    try:
+        with transaction.atomic(using=using):
+            del connection._start_transaction_under_autocommit
+            yield
+
+    finally:
+        vars(connection).pop('_start_transaction_under_autocommit', None)
+
+
+@receiver(connection_created)
+def setup_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+
+    pragmas = get_pragmas(connection.alias)
+
+    if not pragmas:
+        return
+
+    cursor = connection.connection.cursor()
+
+    try:
+        for name, value in pragmas:
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
+
+    finally:
+        cursor.close()
+
+    connection.ideascube_inode = get_inode(connection)
+    connection.ideascube_checkpointed = time.monotonic()
+
+
+@receiver(request_started)
+def check_connections(sender, **kwargs):
+    for connection in list(get_connections()):
+        inode = getattr(connection, 'ideascube_inode', None)
+
+        if inode is not None and get_inode(connection) != inode:
+            connection.close()
+
+
+@receiver(request_finished)
+def checkpoint_connections(sender, **kwargs):
+    interval = getattr(settings, 'SQLITE_CHECKPOINT_INTERVAL', 300)
+    now = time.monotonic()
+
+    for connection in get_connections():
+        last = getattr(connection, 'ideascube_checkpointed', now)
+
+        if now - last >= interval:
+            checkpoint(connection)
@@ -0,0 +1,85 @@
+"""Resolve the names of tags from their slugs
+
+Pages show the tags they are filtered on by name, while the URLs only have
+their slugs. A TagNames collects the slugs a page needs, then resolves all
+of them in a single query, the first time one of them is rendered.
+
+The names are also cached in each process, until a tag is saved or deleted
+in any of them (see ideascube.fragments).
+"""
+from collections import OrderedDict
+from threading import Lock
+
+from taggit.models import Tag
+
+from ideascube import fragments
+
+
+MAX_CACHED = 1000
+
+_cache = OrderedDict()
+_cache_version = None
+_lock = Lock()
+
+
+def _get_cached(slugs):
+    global _cache_version
+
+    version = fragments.get_versions(['taggit.tag'])[0]
+    names = {}
+
+    with _lock:
+        if version != _cache_version:
+            _cache.clear()
+            _cache_version = version
+
+        for slug in slugs:
+            if slug in _cache:
+                _cache.move_to_end(slug)
+                names[slug] = _cache[slug]
+
+    return names
+
+
+def _set_cached(names):
+    with _lock:
+        _cache.update(names)
+
+        while len(_cache) > MAX_CACHED:
+            _cache.popitem(last=False)
+
+
+def resolve(slugs):
+    """Get a dict of the names of the tags with these slugs
+
+    Slugs which are not those of a tag are their own names.
+    """
+    slugs = set(slugs)
+    names = _get_cached(slugs)
+    missing = slugs - set(names)
+
+    if missing:
+        found = dict(Tag.objects.filter(
+            slug__in=missing).values_list('slug', 'name'))
+        found.update((slug, slug) for slug in missing - set(found))
+        _set_cached(found)
+        names.update(found)
+
+    return names
+
+
+class TagNames:
+    def __init__(self, slugs=()):
+        self._pending = set(slugs)
+        self._names = {}
+
+    def add(self, *slugs):
+        self._pending.update(slugs)
+
+    def __getitem__(self, slug):
+        if slug not in self._names:
+            self._pending.add(slug)
+            self._names.update(resolve(self._pending - set(self._names)))
+            self._pending.clear()
+
+        return self._names[slug]
@@ -1,14 +1,15 @@
 import re
 
 from django import template
-from django.db.models import Count
 from django.db.models.fields import FieldDoesNotExist
 from django.utils.safestring import mark_safe
 from django.utils.translation.trans_real import language_code_prefix_re
 from django.utils.datastructures import MultiValueDict
 from django.http import QueryDict
 
-from taggit.models import Tag, ContentType
+from ideascube import fragments
+from ideascube.models import TagCount
+from ideascube.tagnames import resolve as resolve_tag_names
 
 register = template.Library()
 
@@ -61,19 +62,17 @@ def fa(fa_id, extra_class=''):
                         takes_context=True)
 def tag_cloud(context, url, model=None, limit=20, tags=None):
     if not tags:
-        qs = Tag.objects.all()
-        if model:
-            content_type = ContentType.objects.get_for_model(model)
-            qs = qs.filter(taggit_taggeditem_items__content_type=content_type)
-        qs = qs.annotate(count=Count('taggit_taggeditem_items__id'))
-        tags = qs.order_by('-count', 'slug')[:limit]
+        tags = fragments.get_or_set(
+            'tag_cloud', ['taggit.tag', 'taggit.taggeditem'],
+            lambda: TagCount.objects.top(model=model, limit=limit),
+            vary_on=[fragments.get_label(model) if model else '', limit])
     return {'tags': tags, 'url': url, 'request': context.request}
 
 
 @register.filter()
 def tag_name(slug):
-    tag = Tag.objects.filter(slug=slug).first()
-    return tag.name if tag else slug
+    # Prefer a TagNames in the context, for pages with many tags
+    return resolve_tag_names([slug])[slug]
 
 
 @register.filter(name='getattr')
@@ -192,3 +191,47 @@ def media(instance, attribute):
     qs = 'mtime={0.modified_at:%Y-%m-%dT%H:%M:%S%Z}'.format(instance)
 
     return '%s?%s' % (url, qs)
+
+
+class CacheFragmentNode(template.Node):
+    def __init__(self, nodelist, name, depends, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.depends = depends
+        self.vary_on = vary_on
+
+    def render(self, context):
+        return mark_safe(fragments.get_or_set(
+            self.name.resolve(context),
+            self.depends.resolve(context).split(),
+            lambda: self.nodelist.render(context),
+            vary_on=[v.resolve(context) for v in self.vary_on]))
+
+
+@register.tag
+def cachefragment(parser, token):
+    """Cache a fragment until anything it depends on changes
+
+    Usage:
+
+        {% cachefragment 'name' 'library.book taggit.tag' user.is_staff %}
+            ...
+        {% endcachefragment %}
+
+    The second argument lists what the fragment depends on, see
+    ideascube.fragments. The following ones are the values the fragment
+    varies on, in addition to the current language.
+    """
+    bits = token.split_contents()
+
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(
+            "'%s' takes at least two arguments" % bits[0])
+
+    nodelist = parser.parse(('endcachefragment',))
+    parser.delete_first_token()
+
+    return CacheFragmentNode(
+        nodelist, parser.compile_filter(bits[1]),
+        parser.compile_filter(bits[2]),
+        [parser.compile_filter(bit) for bit in bits[3:]])
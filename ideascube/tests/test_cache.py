@@ -0,0 +1,100 @@
+import pytest
+
+from ..cache import SQLiteCache
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return SQLiteCache(
+        tmpdir.join('cache', 'cache.sqlite').strpath,
+        {'OPTIONS': {'MAX_SIZE': 2000, 'ACCESS_GRANULARITY': 0}})
+
+
+def get_total(cache):
+    conn = cache._get_connection()
+    return conn.execute('SELECT total FROM cache_size').fetchone()[0]
+
+
+def test_get_set_delete(cache):
+    assert cache.get('foo') is None
+    assert cache.get('foo', 'default') == 'default'
+
+    cache.set('foo', {'bar': [1, 2]})
+    assert cache.get('foo') == {'bar': [1, 2]}
+    assert cache.has_key('foo')
+
+    cache.delete('foo')
+    assert cache.get('foo') is None
+
+    cache.set('foo', 'bar')
+    cache.clear()
+    assert not cache.has_key('foo')
+
+
+def test_expiry(cache):
+    cache.set('foo', 'bar', timeout=0)
+    assert cache.get('foo') is None
+
+    cache.set('foo', 'bar', timeout=None)
+    assert cache.get('foo') == 'bar'
+
+
+def test_add(cache):
+    assert cache.add('foo', 'bar')
+    assert not cache.add('foo', 'baz')
+    assert cache.get('foo') == 'bar'
+
+    cache.set('expired', 'bar', timeout=0)
+    assert cache.add('expired', 'baz')
+
+
+def test_incr(cache):
+    with pytest.raises(ValueError):
+        cache.incr('foo')
+
+    cache.set('foo', 1)
+    assert cache.incr('foo', 41) == 42
+    assert cache.get('foo') == 42
+
+
+def test_shared_between_instances(cache):
+    other = SQLiteCache(cache.path, {})
+
+    cache.set('foo', 'bar')
+    assert other.get('foo') == 'bar'
+
+
+def test_total_size_is_tracked(cache):
+    cache.set('foo', 'bar')
+    total = get_total(cache)
+    assert total > 0
+
+    # Replacing an entry does not count it twice
+    cache.set('foo', 'baz')
+    assert get_total(cache) == total
+
+    cache.delete('foo')
+    assert get_total(cache) == 0
+
+
+def test_least_recently_used_are_evicted(cache, monkeypatch):
+    now = 1000
+
+    monkeypatch.setattr('time.time', lambda: now)
+
+    for i in range(10):
+        now += 1
+        cache.set('key{}'.format(i), 'x' * 100)
+
+    # Reading it makes it the most recently used
+    now += 1
+    assert cache.get('key0') is not None
+
+    for i in range(10, 20):
+        now += 1
+        cache.set('key{}'.format(i), 'x' * 100)
+
+    assert get_total(cache) <= 2000
+    assert cache.get('key0') is not None
+    assert cache.get('key1') is None
+    assert cache.get('key19') is not None
@@ -0,0 +1,106 @@
+import pytest
+
+from django.test import RequestFactory
+
+from ideascube.downloads import parse_range, send_file
+
+
+@pytest.fixture()
+def path(tmpdir):
+    path = tmpdir.mkdir('backups').join('backup.tar.gz')
+    path.write_binary(bytes(range(100)))
+
+    return path.strpath
+
+
+def get_content(response):
+    return b''.join(response.streaming_content)
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-9', (0, 10)),
+    ('bytes=90-', (90, 10)),
+    ('bytes=90-200', (90, 10)),
+    ('bytes=-10', (90, 10)),
+    ('bytes=-200', (0, 100)),
+    ('bytes=100-', None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize('header', [
+    'bytes=9-0', 'bytes=-', 'bytes=0-1,5-6', 'lines=0-1',
+])
+def test_parse_invalid_range(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 100)
+
+
+def test_send_file(path):
+    response = send_file(RequestFactory().get('/'), path, filename='b.tgz')
+
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'application/octet-stream'
+    assert response['Content-Length'] == '100'
+    assert response['Accept-Ranges'] == 'bytes'
+    assert response['Content-Disposition'] == 'attachment; filename="b.tgz"'
+    assert get_content(response) == bytes(range(100))
+
+
+def test_send_file_range(path):
+    request = RequestFactory().get('/', HTTP_RANGE='bytes=10-19')
+    response = send_file(request, path)
+
+    assert response.status_code == 206
+    assert response['Content-Length'] == '10'
+    assert response['Content-Range'] == 'bytes 10-19/100'
+    assert 'Content-Disposition' not in response
+    assert get_content(response) == bytes(range(10, 20))
+
+
+def test_send_file_unsatisfiable_range(path):
+    request = RequestFactory().get('/', HTTP_RANGE='bytes=100-')
+    response = send_file(request, path)
+
+    assert response.status_code == 416
+    assert response['Content-Range'] == 'bytes */100'
+
+
+def test_send_file_range_of_a_modified_file(path):
+    request = RequestFactory().get(
+        '/', HTTP_RANGE='bytes=10-19',
+        HTTP_IF_RANGE='Thu, 01 Jan 1970 00:00:00 GMT')
+    response = send_file(request, path)
+
+    assert response.status_code == 200
+    assert get_content(response) == bytes(range(100))
+
+
+def test_send_file_with_nginx(path, tmpdir):
+    request = RequestFactory().get(
+        '/', X_ACCEL_MAPPING='/nowhere/=/foo/, {}=/_protected/'.format(
+            tmpdir.strpath))
+    response = send_file(request, path, filename='b.tgz')
+
+    assert response.status_code == 200
+    assert response['X-Accel-Redirect'] == (
+        '/_protected/backups/backup.tar.gz')
+    assert response['Content-Disposition'] == 'attachment; filename="b.tgz"'
+    assert not response.content
+
+
+def test_send_file_outside_of_the_nginx_locations(path):
+    request = RequestFactory().get('/', X_ACCEL_MAPPING='/nowhere/=/foo/')
+    response = send_file(request, path)
+
+    assert 'X-Accel-Redirect' not in response
+    assert get_content(response) == bytes(range(100))
+
+
+def test_send_file_invalid_range(path):
+    request = RequestFactory().get('/', HTTP_RANGE='bytes=0-1,5-6')
+    response = send_file(request, path)
+
+    assert response.status_code == 200
+    assert get_content(response) == bytes(range(100))
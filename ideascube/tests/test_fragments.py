@@ -0,0 +1,101 @@
+import pytest
+
+from django.core.cache import cache
+from django.template import Context, Template
+
+from ideascube.blog.tests.factories import ContentFactory
+from ideascube.library.tests.factories import BookFactory
+
+from .. import fragments
+from ..templatetags.ideascube_tags import tag_cloud
+
+pytestmark = pytest.mark.django_db
+
+
+def test_bump_invalidates_dependent_keys():
+    key = fragments.make_key('foo', ['library.book', 'catalog'])
+    assert fragments.make_key('foo', ['library.book', 'catalog']) == key
+
+    fragments.bump('blog.content')
+    assert fragments.make_key('foo', ['library.book', 'catalog']) == key
+
+    fragments.bump('catalog')
+    assert fragments.make_key('foo', ['library.book', 'catalog']) != key
+
+
+def test_evicted_version_does_not_come_back():
+    key = fragments.make_key('foo', ['catalog'])
+    cache.delete(fragments.VERSION_KEY.format('catalog'))
+
+    assert fragments.make_key('foo', ['catalog']) != key
+
+
+def test_key_varies_on_language_and_values(settings):
+    from django.utils import translation
+
+    key = fragments.make_key('foo', ['catalog'], vary_on=[True])
+    assert fragments.make_key('foo', ['catalog'], vary_on=[False]) != key
+
+    with translation.override('ar'):
+        assert fragments.make_key('foo', ['catalog'], vary_on=[True]) != key
+
+
+def test_saving_a_model_bumps_its_version():
+    book = BookFactory()
+    key = fragments.make_key('foo', ['library.book'])
+
+    book.save()
+    assert fragments.make_key('foo', ['library.book']) != key
+    key = fragments.make_key('foo', ['library.book'])
+
+    book.delete()
+    assert fragments.make_key('foo', ['library.book']) != key
+
+
+def test_saving_an_untracked_model_does_not_touch_the_cache(mocker):
+    from taggit.models import Tag
+    from ideascube.models import TagCount
+
+    tag = Tag.objects.create(name='foo')
+    set_many = mocker.spy(cache, 'set_many')
+    TagCount.objects.create(tag=tag, count=1)
+
+    assert fragments.get_label(TagCount) not in fragments.MODELS
+    assert set_many.call_count == 0
+
+
+def test_get_or_set(mocker):
+    compute = mocker.Mock(return_value=['result'])
+
+    assert fragments.get_or_set('foo', ['catalog'], compute) == ['result']
+    assert fragments.get_or_set('foo', ['catalog'], compute) == ['result']
+    assert compute.call_count == 1
+
+    fragments.bump('catalog')
+    fragments.get_or_set('foo', ['catalog'], compute)
+    assert compute.call_count == 2
+
+
+def test_cachefragment_tag():
+    template = Template(
+        '{% load ideascube_tags %}'
+        '{% cachefragment "books" "library.book" lang %}'
+        '{{ value }}'
+        '{% endcachefragment %}')
+
+    assert template.render(Context({'value': 'foo', 'lang': 'fr'})) == 'foo'
+    assert template.render(Context({'value': 'bar', 'lang': 'fr'})) == 'foo'
+    assert template.render(Context({'value': 'bar', 'lang': 'en'})) == 'bar'
+
+    BookFactory()
+    assert template.render(Context({'value': 'baz', 'lang': 'fr'})) == 'baz'
+
+
+def test_tag_cloud_is_invalidated_by_new_tags(mocker):
+    ContentFactory(tags=['plane'])
+    context = tag_cloud(mocker.Mock(), 'xxxx')
+    assert [t.name for t in context['tags']] == ['plane']
+
+    ContentFactory(tags=['boat'])
+    context = tag_cloud(mocker.Mock(), 'xxxx')
+    assert [t.name for t in context['tags']] == ['boat', 'plane']
@@ -3,7 +3,7 @@ import pytest
 from django.contrib.auth import get_user_model
 from django.db import models
 
-from ..models import JSONField, User
+from ..models import JSONField, TagCount, User
 from .factories import UserFactory
 
 pytestmark = pytest.mark.django_db
@@ -97,3 +97,101 @@ def test_json_field(value):
 
     obj = JSONModel.objects.first()
     assert obj.data == value
+
+
+def get_counts(model=None):
+    return [(tag.name, tag.count) for tag in TagCount.objects.top(model)]
+
+
+def test_tag_counts_are_maintained():
+    from ideascube.blog.models import Content
+    from ideascube.blog.tests.factories import ContentFactory
+    from ideascube.library.models import Book
+    from ideascube.library.tests.factories import BookFactory
+
+    content = ContentFactory(tags=['plane', 'boat'])
+    ContentFactory(tags=['plane'])
+    book = BookFactory(tags=['boat'])
+
+    assert get_counts(Content) == [('plane', 2), ('boat', 1)]
+    assert get_counts(Book) == [('boat', 1)]
+    assert get_counts() == [('boat', 2), ('plane', 2)]
+
+    content.tags.remove('plane')
+    book.delete()
+    assert get_counts(Content) == [('boat', 1), ('plane', 1)]
+    assert get_counts(Book) == []
+    assert get_counts() == [('boat', 1), ('plane', 1)]
+
+
+def test_tag_counts_of_bulk_created_documents():
+    from ideascube.mediacenter.models import Document
+
+    Document.objects.bulk_create_with_tags([
+        (Document(title='foo', original='foo.pdf'), ['plane', 'boat']),
+        (Document(title='bar', original='bar.pdf'), ['plane']),
+    ])
+
+    assert get_counts(Document) == [('plane', 2), ('boat', 1)]
+
+
+def test_tag_counts_rebuild():
+    from ideascube.blog.tests.factories import ContentFactory
+
+    ContentFactory(tags=['plane', 'boat'])
+    ContentFactory(tags=['plane'])
+    TagCount.objects.all().delete()
+    assert get_counts() == []
+
+    TagCount.objects.rebuild()
+    assert get_counts() == [('plane', 2), ('boat', 1)]
+
+
+def test_tag_count_totals_are_unique():
+    import importlib
+    from django.db import IntegrityError, connection, transaction
+    from taggit.models import Tag
+
+    # The tests do not run the migrations
+    migration = importlib.import_module(
+        'ideascube.migrations.0015_tagcount_unique_total')
+
+    with connection.cursor() as cursor:
+        cursor.execute(migration.CREATE_INDEX)
+
+    tag = Tag.objects.create(name='plane', slug='plane')
+    TagCount.objects.create(tag=tag, count=1)
+
+    with pytest.raises(IntegrityError):
+        with transaction.atomic():
+            TagCount.objects.create(tag=tag, count=1)
+
+
+def test_tag_counts_created_by_another_writer(monkeypatch):
+    from collections import Counter
+    from django.contrib.contenttypes.models import ContentType
+    from taggit.models import Tag
+    from ideascube.blog.models import Content
+    from ideascube.models import TagCountQuerySet
+
+    tag = Tag.objects.create(name='plane', slug='plane')
+    content_type = ContentType.objects.get_for_model(Content)
+    TagCount.objects.create(tag=tag, content_type=content_type, count=1)
+    TagCount.objects.create(tag=tag, count=1)
+
+    # Another writer creates the row right after we failed to update it
+    update = TagCountQuerySet.update
+    missed = []
+
+    def update_once_too_early(self, **kwargs):
+        if not missed:
+            missed.append(True)
+            return 0
+
+        return update(self, **kwargs)
+
+    monkeypatch.setattr(TagCountQuerySet, 'update', update_once_too_early)
+    TagCount.objects.add(content_type.id, Counter({tag.id: 1}))
+
+    assert get_counts(Content) == [('plane', 2)]
+    assert get_counts() == [('plane', 2)]
@@ -0,0 +1,112 @@
+import pytest
+
+from ideascube.library.models import available_books
+from ideascube.library.tests.factories import BookFactory, BookSpecimenFactory
+from ideascube.mediacenter.models import Document, all_documents
+from ideascube.mediacenter.tests.factories import DocumentFactory
+
+from ..models import RandomSample
+from ..sampling import Sampler
+
+pytestmark = pytest.mark.django_db
+
+
+def get_samples(key):
+    return list(RandomSample.objects.filter(key=key).order_by(
+        'position').values_list('position', 'object_id'))
+
+
+@pytest.fixture
+def sampler():
+    return Sampler('documents', lambda: Document.objects)
+
+
+def test_add_and_discard(sampler):
+    sampler.add_many([10, 20, 30, 40])
+    sampler.add(20)
+    assert get_samples('documents') == [(0, 10), (1, 20), (2, 30), (3, 40)]
+
+    # The last one takes the place of the removed one
+    sampler.discard(20)
+    assert get_samples('documents') == [(0, 10), (1, 40), (2, 30)]
+
+    sampler.discard(30)
+    sampler.discard(99)
+    assert get_samples('documents') == [(0, 10), (1, 40)]
+
+
+def test_add_conflicting_with_another_writer(sampler, monkeypatch):
+    sampler.add(10)
+    last_positions = iter([None])
+
+    # Another writer added 10 after we read the last position
+    def get_last_position():
+        return next(last_positions, Sampler._get_last_position(sampler))
+
+    monkeypatch.setattr(sampler, '_get_last_position', get_last_position)
+    sampler.add(20)
+    assert get_samples('documents') == [(0, 10), (1, 20)]
+
+
+def test_pick(sampler):
+    assert sampler.pick() is None
+
+    documents = DocumentFactory.create_batch(3)
+    sampler.add_many([d.pk for d in documents])
+
+    assert {sampler.pick() for _ in range(30)} == set(documents)
+
+
+def test_pick_discards_stale_entries(sampler):
+    document = DocumentFactory()
+    sampler.add_many([document.pk + 1000])
+
+    assert sampler.pick() is None
+    assert get_samples('documents') == []
+
+    sampler.add_many([document.pk])
+    assert sampler.pick() == document
+
+
+def test_rebuild(sampler):
+    sampler.add_many([10, 20])
+    document = DocumentFactory()
+
+    sampler.rebuild()
+    assert get_samples('documents') == [(0, document.pk)]
+
+
+def test_documents_are_sampled():
+    document = DocumentFactory()
+    assert all_documents.pick() == document
+
+    document.delete()
+    assert all_documents.pick() is None
+
+
+def test_documents_created_in_bulk_are_sampled():
+    documents = Document.objects.bulk_create_with_tags([
+        (Document(title='foo', original='foo.pdf'), []),
+        (Document(title='bar', original='bar.pdf'), []),
+    ])
+
+    assert [id for _, id in get_samples('mediacenter.documents')] == [
+        d.pk for d in documents]
+
+
+def test_only_available_books_are_sampled():
+    BookFactory()
+    assert available_books.pick() is None
+
+    specimen = BookSpecimenFactory()
+    assert available_books.pick() == specimen.item
+
+    specimen.delete()
+    assert available_books.pick() is None
+
+
+def test_deleted_books_are_not_sampled():
+    specimen = BookSpecimenFactory()
+    specimen.item.delete()
+
+    assert get_samples('library.available_books') == []
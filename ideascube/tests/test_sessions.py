@@ -0,0 +1,69 @@
+import os
+import time
+
+import pytest
+
+from ..sessions import SessionStore
+
+
+@pytest.fixture
+def session():
+    session = SessionStore()
+    session['foo'] = 'bar'
+    session.save()
+
+    return SessionStore(session.session_key)
+
+
+def set_age(session, age):
+    path = session._key_to_file()
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+    return mtime
+
+
+def get_mtime(session):
+    return os.stat(session._key_to_file()).st_mtime
+
+
+def test_sessions_are_not_in_the_backuped_data(session, settings):
+    path = session._key_to_file()
+
+    assert path.startswith(settings.SESSION_FILE_PATH)
+    assert not path.startswith(settings.BACKUPED_ROOT)
+
+
+def test_refresh_is_coalesced(session, settings):
+    settings.SESSION_REFRESH_INTERVAL = 60
+    mtime = set_age(session, 30)
+
+    session.save()
+    assert get_mtime(session) == mtime
+
+    mtime = set_age(session, 90)
+    session.save()
+    assert get_mtime(session) > mtime
+
+    assert SessionStore(session.session_key)['foo'] == 'bar'
+
+
+def test_modified_session_is_saved(session, settings):
+    settings.SESSION_REFRESH_INTERVAL = 60
+    set_age(session, 1)
+
+    session['foo'] = 'baz'
+    session.save()
+
+    assert SessionStore(session.session_key)['foo'] == 'baz'
+
+
+def test_expired_session_is_not_refreshed(session, settings):
+    settings.SESSION_REFRESH_INTERVAL = 60
+    set_age(session, settings.SESSION_COOKIE_AGE + 1)
+    key = session.session_key
+
+    session.save()
+
+    assert session.session_key != key
+    assert 'foo' not in SessionStore(session.session_key)
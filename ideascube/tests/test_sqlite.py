@@ -0,0 +1,125 @@
+import os
+
+from django.core.management import call_command
+from django.db import connections
+from django.db.backends.sqlite3.base import DatabaseWrapper
+
+import pytest
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def connection(tmpdir, monkeypatch):
+    settings_dict = dict(connections['default'].settings_dict)
+    settings_dict['NAME'] = tmpdir.join('test.sqlite').strpath
+    connection = DatabaseWrapper(settings_dict, alias='default')
+    monkeypatch.setattr(
+        'ideascube.sqlite.connections', {'default': connection})
+    monkeypatch.setattr(
+        'ideascube.management.commands.sqlite.connections',
+        {'default': connection})
+
+    yield connection
+
+    connection.close()
+
+
+def get_pragma(connection, name):
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA {}'.format(name))
+        return cursor.fetchone()[0]
+
+
+def test_pragmas_are_applied(connection, settings):
+    settings.SQLITE_PRAGMAS = {'default': [
+        ('journal_mode', 'WAL'), ('synchronous', 'NORMAL'),
+        ('busy_timeout', 1234)]}
+
+    assert get_pragma(connection, 'journal_mode') == 'wal'
+    assert get_pragma(connection, 'synchronous') == 1
+    assert get_pragma(connection, 'busy_timeout') == 1234
+
+
+def test_pragmas_only_for_configured_databases(connection, settings):
+    settings.SQLITE_PRAGMAS = {'transient': [('journal_mode', 'WAL')]}
+
+    assert get_pragma(connection, 'journal_mode') == 'delete'
+
+
+def test_replaced_database_is_reconnected(connection):
+    from ideascube.sqlite import check_connections
+
+    connection.ensure_connection()
+    check_connections(sender=None)
+    assert connection.connection is not None
+
+    path = connection.settings_dict['NAME']
+    os.rename(path, path + '.old')
+    open(path, 'w').close()
+
+    check_connections(sender=None)
+    assert connection.connection is None
+
+
+def test_periodic_checkpoint(connection, settings):
+    from ideascube.sqlite import checkpoint_connections
+
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE TABLE foo (bar INTEGER)')
+        cursor.execute('INSERT INTO foo VALUES (42)')
+
+    wal = connection.settings_dict['NAME'] + '-wal'
+    last = connection.ideascube_checkpointed
+
+    settings.SQLITE_CHECKPOINT_INTERVAL = 60
+    checkpoint_connections(sender=None)
+    assert connection.ideascube_checkpointed == last
+
+    settings.SQLITE_CHECKPOINT_INTERVAL = 0
+    checkpoint_connections(sender=None)
+    assert connection.ideascube_checkpointed > last
+    assert os.path.getsize(wal) > 0
+
+
+def test_checkpoint_command(connection, capsys):
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE TABLE foo (bar INTEGER)')
+
+    wal = connection.settings_dict['NAME'] + '-wal'
+    assert os.path.getsize(wal) > 0
+
+    call_command('sqlite', 'checkpoint')
+
+    out, err = capsys.readouterr()
+    assert out.startswith('default: checkpointed')
+    assert os.path.getsize(wal) == 0
+
+
+def test_info_command(connection, capsys):
+    call_command('sqlite', 'info')
+
+    out, err = capsys.readouterr()
+    assert 'journal_mode = wal (configured: WAL)' in out
+    assert 'conn_max_age = ' in out
+
+
+def test_immediate_atomic_takes_the_write_lock(connection, monkeypatch):
+    import sqlite3
+    from ideascube.sqlite import immediate_atomic
+
+    monkeypatch.setattr(
+        connections._connections, 'other', connection, raising=False)
+    path = connection.settings_dict['NAME']
+    other = sqlite3.connect(path, timeout=0, isolation_level=None)
+
+    with immediate_atomic(using='other'):
+        # We did not write anything yet, but another writer has to wait
+        with pytest.raises(sqlite3.OperationalError) as exc:
+            other.execute('BEGIN IMMEDIATE')
+
+        assert 'locked' in str(exc.value)
+
+    other.execute('BEGIN IMMEDIATE')
+    other.execute('ROLLBACK')
+    other.close()
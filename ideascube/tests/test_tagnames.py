@@ -0,0 +1,60 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+import pytest
+
+from taggit.models import Tag
+
+from ..tagnames import TagNames, resolve
+from ..templatetags.ideascube_tags import tag_name
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def tags():
+    return [Tag.objects.create(name=name) for name in ('Plane', 'Boat')]
+
+
+def test_resolve_in_one_query(tags):
+    with CaptureQueriesContext(connection) as queries:
+        assert resolve(['plane', 'boat', 'unknown']) == {
+            'plane': 'Plane', 'boat': 'Boat', 'unknown': 'unknown'}
+
+    assert len(queries) == 1
+
+    # They are cached now
+    with CaptureQueriesContext(connection) as queries:
+        assert tag_name('plane') == 'Plane'
+        assert tag_name('unknown') == 'unknown'
+
+    assert len(queries) == 0
+
+
+def test_resolve_after_rename(tags):
+    assert resolve(['plane']) == {'plane': 'Plane'}
+
+    tags[0].name = 'Aeroplane'
+    tags[0].save()
+
+    assert resolve(['plane']) == {'plane': 'Aeroplane'}
+
+
+def test_tag_names_are_resolved_together(tags):
+    names = TagNames(['plane'])
+    names.add('boat')
+
+    with CaptureQueriesContext(connection) as queries:
+        assert names['plane'] == 'Plane'
+        assert names['boat'] == 'Boat'
+
+    assert len(queries) == 1
+
+
+def test_filter_cloud_shows_tag_names(app, tags):
+    from django.core.urlresolvers import reverse
+
+    response = app.get(reverse('library:index'), {'tags': ['plane', 'boat']})
+
+    assert 'Plane' in response.pyquery('.filters').text()
+    assert 'Boat' in response.pyquery('.filters').text()
@@ -3,6 +3,7 @@ from django.core.management import call_command
 import pytest
 
 from ideascube.mediacenter.tests.factories import DocumentFactory
+from ideascube.models import TagCount
 from taggit.models import Tag
 
 pytestmark = pytest.mark.django_db
@@ -79,3 +80,17 @@ def test_list_should_list_tags_and_slugs(capsys):
     out, err = capsys.readouterr()
     assert tag.name in out
     assert tag.slug in out
+
+
+def test_list_should_show_counts(capsys):
+    DocumentFactory.create_batch(size=3, tags=['tag1'])
+    call_command('tags', 'list',)
+    out, err = capsys.readouterr()
+    assert out.strip().splitlines()[-1].split() == ['tag1', 'tag1', '3']
+
+
+def test_recount_should_rebuild_counts(capsys):
+    DocumentFactory.create_batch(size=3, tags=['tag1'])
+    TagCount.objects.all().delete()
+    call_command('tags', 'recount')
+    assert TagCount.objects.get(content_type=None).count == 3
@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import os
+
 import pytest
 
 from django.contrib.auth import get_user_model
@@ -25,6 +27,45 @@ def test_home_page(app):
     assert app.get('/')
 
 
+def test_home_page_picks_again_each_time(app, staffuser):
+    from ideascube.library.models import available_books
+    from ideascube.mediacenter.models import all_documents
+
+    response = app.get(reverse('index'))
+    assert 'ETag' not in response.headers
+
+    with mock.patch.object(
+            available_books, 'pick', wraps=available_books.pick) as books, \
+            mock.patch.object(
+                all_documents, 'pick', wraps=all_documents.pick) as docs:
+        for _ in range(2):
+            app.get(
+                reverse('index'), headers={'If-None-Match': '"anything"'},
+                status=200)
+
+    assert books.call_count == 2
+    assert docs.call_count == 2
+
+
+def test_home_page_is_compressed(client, staffuser):
+    response = client.get(reverse('index'), HTTP_ACCEPT_ENCODING='gzip')
+    assert response.status_code == 200
+    assert response['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response['Vary']
+
+
+def test_compressed_page_etag_still_matches(client, staffuser):
+    response = client.get(reverse('blog:index'), HTTP_ACCEPT_ENCODING='gzip')
+    assert response['Content-Encoding'] == 'gzip'
+
+    etag = response['ETag']
+    assert etag.startswith('W/"')
+    response = client.get(
+        reverse('blog:index'), HTTP_ACCEPT_ENCODING='gzip',
+        HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+
 def test_anonymous_user_should_not_access_admin(app):
     response = app.get(reverse('admin:index'), status=302)
     assert 'login' in response['Location']
@@ -577,3 +618,24 @@ def test_cards_properly_displayed(app):
         }]
         response = app.get(reverse('index'), status=200)
         assert 'Test package1' in response.unicode_body
+
+
+def test_media_supports_range_requests(settings):
+    from ideascube.views import media
+
+    with open(os.path.join(settings.MEDIA_ROOT, 'video.mp4'), 'wb') as f:
+        f.write(b'0123456789')
+
+    request = RequestFactory().get('/', HTTP_RANGE='bytes=2-5')
+    response = media(request, 'video.mp4')
+    assert response.status_code == 206
+    assert response['Content-Type'] == 'video/mp4'
+    assert b''.join(response.streaming_content) == b'2345'
+
+
+def test_media_not_found(settings):
+    from django.http import Http404
+    from ideascube.views import media
+
+    with pytest.raises(Http404):
+        media(RequestFactory().get('/'), 'missing.mp4')
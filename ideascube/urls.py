@@ -1,7 +1,8 @@
+import re
+
 from django.conf import settings
 from django.conf.urls import include, url
 from django.conf.urls.i18n import i18n_patterns
-from django.conf.urls.static import static
 from django.contrib import admin
 from django.contrib.auth import views as auth_views
 from django.views.decorators.cache import cache_control, cache_page
@@ -43,4 +44,9 @@ urlpatterns = urlpatterns + [
     url(r'^jsi18n/$', cache_control(max_age=31536000)(javascript_catalog),
         name='jsi18n'),
     url(r'^i18n/', include('django.conf.urls.i18n')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
+
+if settings.DEBUG:
+    media_prefix = re.escape(settings.MEDIA_URL.lstrip('/'))
+    urlpatterns.append(
+        url(r'^{}(?P<path>.*)$'.format(media_prefix), views.media))
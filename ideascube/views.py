@@ -1,4 +1,5 @@
 import mimetypes
+import os
 import socket
 from urllib.parse import urlparse
 from urllib.request import Request, build_opener
@@ -11,19 +12,22 @@ from django.contrib.auth.forms import SetPasswordForm
 from django.core.urlresolvers import reverse_lazy
 from django.core.validators import URLValidator, ValidationError
 from django.db import IntegrityError
-from django.http import (HttpResponse, HttpResponseBadRequest,
+from django.http import (Http404, HttpResponse, HttpResponseBadRequest,
                          HttpResponseRedirect)
 from django.shortcuts import get_object_or_404, render
+from django.utils._os import safe_join
 from django.utils.translation import ugettext as _
 from django.views.generic import (CreateView, DeleteView, DetailView, FormView,
                                   ListView, UpdateView, View)
 from taggit.models import TaggedItem
 
+from ideascube import fragments
 from ideascube.configuration import get_config
 from ideascube.blog.models import Content
 from ideascube.decorators import staff_member_required
-from ideascube.library.models import Book
-from ideascube.mediacenter.models import Document
+from ideascube.downloads import send_file
+from ideascube.library.models import available_books
+from ideascube.mediacenter.models import all_documents
 
 # For unittesting purpose, we need to mock the Catalog class.
 # However, the mock is made in a fixture and at this moment, we don't
@@ -40,6 +44,13 @@ from .mixins import CSVExportMixin
 user_model = get_user_model()
 
 def build_package_card_info():
+    # Loading the catalog is slow, do it only when the packages changed
+    return fragments.get_or_set(
+        'package_cards', ['configuration.configuration', 'catalog'],
+        _build_package_card_info)
+
+
+def _build_package_card_info():
     package_card_info = []
     catalog = catalog_mod.Catalog()
     packages_to_display = catalog.list_installed(get_config('home-page', 'displayed-package-ids'))
@@ -58,12 +69,15 @@ def build_package_card_info():
         package_card_info.append(card_info)
     return package_card_info
 
+
+# Not a conditional page: it shows a different random book and document
+# every time it is displayed
 def index(request):
     if not user_model.objects.filter(is_staff=True).exists():
         return HttpResponseRedirect(reverse_lazy('welcome_staff'))
     content = Content.objects.published().order_by('published_at').first()
-    random_book = Book.objects.available().order_by('?').first()
-    random_doc = Document.objects.order_by('?').first()
+    random_book = available_books.pick()
+    random_doc = all_documents.pick()
 
     cards = settings.HOME_CARDS + build_package_card_info()
 
@@ -293,3 +307,13 @@ class AjaxProxy(View):
             return HttpResponse(content, status=status_code,
                                 content_type=mimetype)
 ajax_proxy = AjaxProxy.as_view()
+
+
+def media(request, path):
+    # In production, nginx serves the media files itself
+    path = safe_join(settings.MEDIA_ROOT, path)
+
+    if not os.path.isfile(path):
+        raise Http404()
+
+    return send_file(request, path)